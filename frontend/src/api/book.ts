@@ -1,11 +1,11 @@
 import axios from "axios";
 import { BACKEND_URL } from "../constants";
-import { BookInput } from "../models/book";
+import { Book, BookInput } from "../models/book";
+import { fetchAllPages } from "./page";
 
 export const fetchAllBooks = async () => {
   try {
-    const response = await axios.get(BACKEND_URL + "/books");
-    return response.data;
+    return await fetchAllPages<Book>(BACKEND_URL + "/books");
   } catch (error) {
     console.log(error);
     return null;
@@ -0,0 +1,17 @@
+import axios from "axios";
+import { Page } from "../models/page";
+
+const PAGE_SIZE = 500;
+
+export const fetchAllPages = async <T>(url: string): Promise<T[]> => {
+  const items: T[] = [];
+  let cursor: string | null = null;
+  do {
+    const params: Record<string, string | number> = { limit: PAGE_SIZE };
+    if (cursor) params.cursor = cursor;
+    const response = await axios.get<Page<T>>(url, { params });
+    items.push(...response.data.items);
+    cursor = response.data.next_cursor;
+  } while (cursor);
+  return items;
+};
@@ -0,0 +1,18 @@
+import axios from "axios";
+
+// The backend returns the time of every write in this header, the reads carrying it back
+// are served from the primary database until the replicas have caught up with the write
+const LAST_WRITE_HEADER = "X-Last-Write";
+
+let lastWrite: string | null = null;
+
+axios.interceptors.response.use((response) => {
+  const value = response.headers[LAST_WRITE_HEADER.toLowerCase()];
+  if (value) lastWrite = value;
+  return response;
+});
+
+axios.interceptors.request.use((config) => {
+  if (lastWrite) config.headers.set(LAST_WRITE_HEADER, lastWrite);
+  return config;
+});
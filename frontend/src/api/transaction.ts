@@ -1,11 +1,11 @@
 import axios from "axios";
 import { BACKEND_URL } from "../constants";
-import { Status, TransactionInput } from "../models/transaction";
+import { Status, Transaction, TransactionInput } from "../models/transaction";
+import { fetchAllPages } from "./page";
 
 export const fetchAllTransactions = async () => {
   try {
-    const response = await axios.get(BACKEND_URL + "/transactions");
-    return response.data;
+    return await fetchAllPages<Transaction>(BACKEND_URL + "/transactions");
   } catch (error) {
     console.log(error);
     return null;
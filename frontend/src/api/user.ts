@@ -1,11 +1,11 @@
 import axios from "axios";
 import { BACKEND_URL } from "../constants";
-import { UserInput } from "../models/user";
+import { User, UserInput } from "../models/user";
+import { fetchAllPages } from "./page";
 
 export const fetchAllUsers = async () => {
   try {
-    const response = await axios.get(BACKEND_URL + "/users");
-    return response.data;
+    return await fetchAllPages<User>(BACKEND_URL + "/users");
   } catch (error) {
     console.log(error);
     return null;
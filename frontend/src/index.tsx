@@ -5,6 +5,7 @@ import reportWebVitals from "./reportWebVitals";
 import { AppRouter } from "./routes";
 import { SnackbarProvider } from "notistack";
 import { AppContextProvider } from "./context/AppContext";
+import "./api/readYourWrites";
 
 const root = ReactDOM.createRoot(
   document.getElementById("root") as HTMLElement
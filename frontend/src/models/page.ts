@@ -0,0 +1,4 @@
+export type Page<T> = {
+    items: T[];
+    next_cursor: string | null;
+}
@@ -1,111 +1,185 @@
-from datetime import datetime
-from typing import List, Optional
-from app.entities.book import CreateBookInput, UpdateBookInput
-from app.models.book import Book, FrappeBook
+from typing import Any, Dict, List, Optional
+import httpx
+from app.entities.book import BookIngestStatus, CreateBookInput, UpdateBookInput
+from app.entities.export import ExportFormat
+from app.models.book import Book, BookBatchResult, BookIngestResult, BookSearchResult, FrappeBook
+from app.models.page import Page
+from app.models.table_version import TableVersion
 from app.services.book_service import BookService
+from app.services.frappe_service import FrappeService
+from app.services.table_version_service import TableVersionService
+from app.utils.etag_utils import is_not_modified, validators
+from app.utils.export_utils import MEDIA_TYPES, encode_export
 from app.utils.logging_utils import logger
-from fastapi import APIRouter, Query
-import requests
+from app.utils.pagination_utils import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
+from app.utils.response_utils import JSONBytesResponse, JSONRoute
+from fastapi import APIRouter, Body, Query, Request
+from fastapi.responses import Response, StreamingResponse
 from asyncpg import UniqueViolationError
 
-router: APIRouter = APIRouter()
+router: APIRouter = APIRouter(route_class=JSONRoute)
 
 
 @router.post(path="")
 async def create_book(create_book_input: CreateBookInput):
-    logger.info(f"Recieved a request to create a new book entry")
+    logger.info("Recieved a request to create a new book entry")
     try:
         book: Book = await BookService().create_new_book(
             create_book_input.model_dump(exclude_none=True)
         )
     except UniqueViolationError as e:
-        logger.exception(f"UniqueViolationError occurred while creating new user: {create_book_input.dict()}")
+        logger.exception("UniqueViolationError occurred while creating new user: %s", create_book_input.dict())
         return {"message": e.as_dict()['detail']}
 
-    logger.info(f"Successfully created a new book entry with id: {book.id}")
+    logger.info("Successfully created a new book entry with id: %s", book.id)
     return book
 
 
 @router.post(path="/batch")
-async def create_book_batch(create_book_batch_input: List[CreateBookInput]):
-    logger.info(f"Recieved a request to create a new book entry")
-    try:
-        books_input = [x.model_dump(exclude_none=True) for x in create_book_batch_input]
-        books: List[Book] = await BookService().create_new_book_batch(
-            books_input
-        )
+async def create_book_batch(create_book_batch_input: List[Dict[str, Any]] = Body(...)):
+    logger.info("Recieved a request to create %s new book entries", len(create_book_batch_input))
 
+    books_input, invalid = BookService.validate_book_batch(create_book_batch_input)
 
-        n_duplicates = len(create_book_batch_input)-len(books)
-        logger.info(f"Found {n_duplicates} duplicates. Successfully created {len(books)}")
-        return {
-                "count_duplicates": n_duplicates, 
-                "count_unique":len(books), 
-                "books": books
-                }
+    try:
+        inserted: Dict[int, int] = await BookService().create_new_book_batch(books_input)
     except Exception as e:
+        logger.exception("Error while creating %s books in batch", len(books_input))
         return {'message': 'Something went wrong'}
 
+    results: List[BookIngestResult] = []
+    for row in range(len(create_book_batch_input)):
+        if row in invalid:
+            results.append(BookIngestResult(row=row, status=BookIngestStatus.INVALID, error=invalid[row]))
+        elif row in inserted:
+            results.append(BookIngestResult(row=row, status=BookIngestStatus.INSERTED, id=inserted[row]))
+        else:
+            results.append(BookIngestResult(row=row, status=BookIngestStatus.DUPLICATE))
+
+    n_duplicates = len(books_input) - len(inserted)
+    logger.info(
+        "Found %s duplicates and %s invalid. Successfully created %s", n_duplicates, len(invalid), len(inserted)
+    )
+    return BookBatchResult(
+        count_unique=len(inserted),
+        count_duplicates=n_duplicates,
+        count_invalid=len(invalid),
+        results=results,
+    )
 
-@router.get(path="/import/frappe")
-async def fetch_book_from_frappe_api(limit: int = Query(10), includes: Optional[str] = Query(None)):
-    logger.info(f"Recieved a request to import books from frappe API with following filters {limit, includes}")
 
-    url: str = "https://frappe.io/api/method/frappe-library"
-    page_size: int = 20
-    page: int = limit//page_size+1
-    params_arr: List[dict] = [{"page": pg+1, "title": includes} for pg in range(page)]
+@router.get(path="/import/frappe")
+async def fetch_book_from_frappe_api(limit: int = Query(10, ge=1), includes: Optional[str] = Query(None)):
+    logger.info(
+        "Recieved a request to import books from frappe API with following filters %s", (limit, includes)
+    )
 
     try:
-        processed_response: List[dict] = []
-        for params in params_arr:
-            logger.info(f"Fetching from Frappe API with the following params: {params['page'], params['title']}")
-            response = requests.get(url, params=params)
-            processed_response+=response.json()['message']
+        books: List[FrappeBook] = await FrappeService().fetch_books(limit, includes)
+    except httpx.HTTPError as e:
+        logger.error("Error making API request: %s", e)
+        return {"message": "Could not fetch books from the Frappe API"}
 
-        # Process json from the response 
-        for item in processed_response:
-            item['publication_date'] = datetime.strptime(item['publication_date'], f"%m/%d/%Y")
-            item['authors'] = item['authors'].split('/')
-        
-        # De-serialize the dictionary into List[FrappeBook] model
-        books: List[FrappeBook] = [FrappeBook(**{k.strip(): v for k, v in book_dict.items() if k.strip() in FrappeBook.__annotations__}) \
-                        for book_dict in processed_response]
-
-    except requests.exceptions.RequestException as e:
-        logger.error(f"Error making API request: {e}")
-
-    logger.info(f"Successfully fetched {len(books)} new books from frappe API")
-    return {'count': len(books[:limit]), "books": books[:limit]}
+    logger.info("Successfully fetched %s new books from frappe API", len(books))
+    return {'count': len(books), "books": books}
 
 
 @router.get(path="")
-async def get_books():
-    logger.info(f"Recieved a request to fetch all books")
+async def get_books(
+    request: Request,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = Query(None),
+    ids: Optional[str] = Query(None, description="comma separated ids, fetches these books instead of a page"),
+):
+    if ids is not None:
+        return await get_books_by_ids(request, ids)
+
+    logger.info("Recieved a request to fetch books with limit: %s", limit)
     try:
-        books: list[Book] = await BookService().get_all_books()
+        version: TableVersion = await TableVersionService().get_table_version("book")
+        headers: Dict[str, str] = validators(version)
+        if is_not_modified(request, headers):
+            return Response(status_code=304, headers=headers)
+        books: Page[Book] = await BookService().get_all_books(limit, cursor)
+    except ValueError as e:
+        logger.error(e)
+        return {"message": "Invalid cursor"}
     except Exception as e:
         # Implement better exception handling
         return {}
-    logger.info(f"Successfully fetched all books")
+    logger.info("Successfully fetched %s books", len(books.items))
+    return JSONBytesResponse(books, headers=headers)
+
+
+async def get_books_by_ids(request: Request, ids: str):
+    try:
+        book_ids: List[int] = [int(id) for id in ids.split(",") if id.strip()]
+    except ValueError:
+        return {"message": "Invalid ids"}
+    if not book_ids or len(book_ids) > MAX_PAGE_SIZE:
+        return {"message": f"Between 1 and {MAX_PAGE_SIZE} ids can be fetched at once"}
+
+    logger.info("Recieved a request to fetch %s books by id", len(book_ids))
+    try:
+        version: TableVersion = await TableVersionService().get_table_version("book")
+        headers: Dict[str, str] = validators(version)
+        if is_not_modified(request, headers):
+            return Response(status_code=304, headers=headers)
+        books: List[Book] = await BookService().get_books_by_ids(book_ids, version.version)
+    except Exception as e:
+        # Implement better exception handling
+        logger.error(e)
+        return []
+    logger.info("Successfully fetched %s books", len(books))
+    return JSONBytesResponse(books, headers=headers)
+
+
+@router.get(path="/search")
+async def search_books(
+    q: str = Query(..., min_length=1),
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+):
+    logger.info("Recieved a request to search books matching: %s", q)
+    try:
+        books: List[BookSearchResult] = await BookService().search_books(q, limit)
+    except Exception as e:
+        # Implement better exception handling
+        logger.error(e)
+        return []
+    logger.info("Successfully found %s books", len(books))
     return books
 
 
+@router.get(path="/export")
+async def export_books(format: ExportFormat = Query(ExportFormat.NDJSON)):
+    logger.info("Recieved a request to export all books as %s", format.value)
+    chunks = BookService().export_books()
+    return StreamingResponse(
+        encode_export(chunks, format),
+        media_type=MEDIA_TYPES[format],
+        headers={"Content-Disposition": f"attachment; filename=books.{format.value}"},
+    )
+
+
 @router.get(path="/{id}")
-async def get_book(id: int):
-    logger.info(f"Recieved a request to fetch book with id: {id}")
+async def get_book(id: int, request: Request):
+    logger.info("Recieved a request to fetch book with id: %s", id)
     try:
-        book: book = await BookService().get_book_by_id(id)
+        version: TableVersion = await TableVersionService().get_table_version("book")
+        headers: Dict[str, str] = validators(version)
+        if is_not_modified(request, headers):
+            return Response(status_code=304, headers=headers)
+        book: Book = await BookService().get_book_by_id(id, version.version)
     except Exception as e:
         # Implement better exception handling
         return {}
-    logger.info(f"Successfully fetched book with id: {id}")
-    return book
+    logger.info("Successfully fetched book with id: %s", id)
+    return JSONBytesResponse(book, headers=headers)
 
 
 @router.patch(path="/{id}")
 async def update_book(id: int, update_book_input: UpdateBookInput):
-    logger.info(f"Recieved a request to update book with id: {id}")
+    logger.info("Recieved a request to update book with id: %s", id)
     try:
         book: Book = await BookService().update_book_by_id(
             id, update_book_input.model_dump(exclude_none=True)
@@ -113,17 +187,17 @@ async def update_book(id: int, update_book_input: UpdateBookInput):
     except Exception as e:
         # Implement better exception handling
         return {}
-    logger.info(f"Successfully updated book with id: {id}")
+    logger.info("Successfully updated book with id: %s", id)
     return book
 
 
 @router.delete(path="/{id}")
 async def delete_book(id: int):
-    logger.info(f"Recieved a request to delete book with id: {id}")
+    logger.info("Recieved a request to delete book with id: %s", id)
     try:
         book: Book = await BookService().delete_book_by_id(id)
     except Exception as e:
         # Implement better exception handling
         return {'message': 'Could not delete book as it is involved in a transaction'}
-    logger.info(f"Successfully deleted book with id: {id}")
+    logger.info("Successfully deleted book with id: %s", id)
     return book
@@ -0,0 +1,12 @@
+from app.utils.cache_utils import CacheRegistry
+from app.utils.logging_utils import logger
+from app.utils.response_utils import JSONRoute
+from fastapi import APIRouter
+
+router: APIRouter = APIRouter(route_class=JSONRoute)
+
+
+@router.get(path="/stats")
+async def get_cache_stats():
+    logger.info("Recieved a request to fetch cache stats")
+    return CacheRegistry.stats()
@@ -0,0 +1,66 @@
+from typing import Any, Dict, List, Optional
+
+from app.entities.job import JobKind
+from app.job_runner import JobRunner
+from app.models.job import Job
+from app.services.job_service import JobService
+from app.utils.logging_utils import logger
+from app.utils.response_utils import JSONBytesResponse, JSONRoute
+from fastapi import APIRouter, Body, Query, Request
+
+router: APIRouter = APIRouter(route_class=JSONRoute)
+
+
+async def submit_job(
+    request: Request, kind: JobKind, params: Dict[str, Any], input: Optional[List[Any]], total: Optional[int]
+):
+    try:
+        job: Job = await JobService().submit_job(kind, params, input, total)
+    except Exception as e:
+        logger.exception("Error while submitting a %s job", kind.value)
+        return {'message': 'Something went wrong'}
+
+    JobRunner.wake()
+    return JSONBytesResponse(job, status_code=202, headers={"Location": str(request.url_for("get_job", id=job.id))})
+
+
+@router.post(path="/books/batch")
+async def submit_book_batch_job(request: Request, create_book_batch_input: List[Dict[str, Any]] = Body(...)):
+    logger.info("Recieved a request to create %s new book entries in the background", len(create_book_batch_input))
+    return await submit_job(request, JobKind.BOOK_BATCH, {}, create_book_batch_input, len(create_book_batch_input))
+
+
+@router.post(path="/books/import/frappe")
+async def submit_frappe_import_job(
+    request: Request,
+    limit: int = Query(10, ge=1),
+    includes: Optional[str] = Query(None),
+    stock_quantity: int = Query(1, ge=0, description="Number of copies in stock of every imported book"),
+):
+    logger.info(
+        "Recieved a request to import books from frappe API in the background with following filters %s",
+        (limit, includes),
+    )
+    params = {"limit": limit, "includes": includes, "stock_quantity": stock_quantity}
+    # The number of pages to fetch depends on the invalid rows, counts.fetched tells the progress against limit
+    return await submit_job(request, JobKind.FRAPPE_IMPORT, params, None, None)
+
+
+@router.get(path="/{id}")
+async def get_job(id: int):
+    logger.info("Recieved a request to fetch job with id: %s", id)
+    job: Optional[Job] = await JobService().get_job(id)
+    if not job:
+        return {"message": "Job not found"}
+    return job
+
+
+@router.post(path="/{id}/cancel")
+async def cancel_job(id: int):
+    logger.info("Recieved a request to cancel job with id: %s", id)
+    job: Optional[Job] = await JobService().cancel_job(id)
+    if not job:
+        return {"message": "Job not found"}
+    # Stopped right away when run by this process, else by its worker when renewing its lease
+    JobRunner.cancel(id)
+    return job
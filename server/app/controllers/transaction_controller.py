@@ -1,50 +1,124 @@
-from datetime import datetime
-import os
-from typing import List
-from fastapi import APIRouter
-
-from app.entities.transctions import CreateTransactionInput, TransactionStatus
+from datetime import date
+from typing import Dict, FrozenSet, List, Optional
+from fastapi import APIRouter, Query, Request
+from fastapi.responses import Response, StreamingResponse
+
+from app.entities.export import ExportFormat
+from app.entities.transctions import (
+    CheckoutStatus,
+    CreateTransactionBatchInput,
+    CreateTransactionInput,
+    TransactionExpansion,
+    TransactionStatus,
+    UpdateTransactionStatusBatchInput,
+)
+from app.models.table_version import TableVersion
+from app.models.transactions import CheckoutResult, StatusChangeResult
+from app.services.table_version_service import TableVersionService
 from app.services.transaction_service import TransactionService
+from app.utils.etag_utils import is_not_modified, validators
+from app.utils.export_utils import MEDIA_TYPES, encode_export
 from app.utils.logging_utils import logger
+from app.utils.pagination_utils import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
+from app.utils.response_utils import JSONBytesResponse, JSONRoute
+
+router: APIRouter = APIRouter(route_class=JSONRoute)
+
+EXPAND_DESCRIPTION = "comma separated book and / or user, embedded in every transaction"
+
+
+def parse_expand(expand: Optional[str]) -> FrozenSet[TransactionExpansion]:
+    """Parses the expand query parameter.
 
-router: APIRouter = APIRouter()
+    Raises:
+        ValueError: if it names anything other than book and user
+    """
+
+    if not expand:
+        return frozenset()
+    return frozenset(TransactionExpansion(name.strip()) for name in expand.split(",") if name.strip())
+
+
+async def transaction_validators(expand: FrozenSet[TransactionExpansion], *etag_parts: str) -> Dict[str, str]:
+    """Builds the validators of a transaction listing, expanded ones also change with the tables they embed."""
+
+    if not expand:
+        version: TableVersion = await TableVersionService().get_table_version("transaction")
+        return validators(version, *etag_parts)
+
+    tables = sorted(expansion.value for expansion in expand)
+    versions: Dict[str, TableVersion] = await TableVersionService().get_table_versions(["transaction", *tables])
+    return validators(
+        versions["transaction"], *[f"{table}-{versions[table].version}" for table in tables], *etag_parts
+    )
 
 
 @router.post(path="")
 async def create_transaction(create_transaction_input: CreateTransactionInput):
-    logger.info(f"Creating new transaction: {create_transaction_input}")
+    logger.info("Creating new transaction: %s", create_transaction_input)
 
     user_id: int = create_transaction_input.user_id
     book_id: int = create_transaction_input.book_id
 
-    transaction_service = TransactionService()
-
-    logger.info("Validating that the transaction is possible")
-    is_in_stock: bool = await transaction_service.validate_book_stock(book_id)
-    if not is_in_stock:
+    checkout: CheckoutResult = await TransactionService().checkout(user_id, book_id)
+    if checkout.status == CheckoutStatus.OUT_OF_STOCK:
         return {"message": "Book is not in stock"}
-    logger.info("Validated that the book is in stock")
-
-    is_transaction_possible: bool = (
-        await transaction_service.validate_transaction_possible(user_id)
-    )
-    if not is_transaction_possible:
+    if checkout.status == CheckoutStatus.CREDIT_LIMIT_EXCEEDED:
         return {"message": "User has to settle their credit first"}
-    logger.info("Validated that the transaction is possible")
-    
-    transaction = await transaction_service.create_transaction(user_id, book_id)
-    return transaction
+    if checkout.status == CheckoutStatus.USER_NOT_FOUND:
+        return {"message": "User not found"}
+    logger.info("Validated that the book is in stock and the transaction is possible")
+
+    return checkout.transaction
+
+
+@router.post(path="/batch")
+async def create_transaction_batch(create_transaction_batch_input: CreateTransactionBatchInput):
+    logger.info("Creating new transactions: %s", create_transaction_batch_input)
+
+    user_id: int = create_transaction_batch_input.user_id
+    book_ids: List[int] = create_transaction_batch_input.book_ids
+
+    checkouts: List[CheckoutResult] = await TransactionService().checkout_batch(user_id, book_ids)
+    logger.info("Checked out books for user_id: %s", user_id)
+    return checkouts
 
 
 @router.get(path="")
-async def get_all_transactions():
+async def get_all_transactions(
+    request: Request,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = Query(None),
+    expand: Optional[str] = Query(None, description=EXPAND_DESCRIPTION),
+):
+    try:
+        expansions: FrozenSet[TransactionExpansion] = parse_expand(expand)
+    except ValueError:
+        return {"message": "Invalid expand"}
+
     try:
-        # TODO: Add pagination
-        transactions = await TransactionService().get_all_transactions()
+        headers: Dict[str, str] = await transaction_validators(expansions)
+        if is_not_modified(request, headers):
+            return Response(status_code=304, headers=headers)
+        transactions = await TransactionService().get_all_transactions(limit, cursor, expansions)
+    except ValueError as e:
+        logger.info("Invalid cursor while getting transactions - %s", e)
+        return {"message": "Invalid cursor"}
     except Exception as e:
-        logger.info(f"Error while getting all transactions - {e}")
+        logger.info("Error while getting all transactions - %s", e)
         return []
-    return transactions
+    return JSONBytesResponse(transactions, headers=headers)
+
+
+@router.get(path="/export")
+async def export_transactions(format: ExportFormat = Query(ExportFormat.NDJSON)):
+    logger.info("Exporting all transactions as %s", format.value)
+    chunks = TransactionService().export_transactions()
+    return StreamingResponse(
+        encode_export(chunks, format),
+        media_type=MEDIA_TYPES[format],
+        headers={"Content-Disposition": f"attachment; filename=transactions.{format.value}"},
+    )
 
 
 @router.get(path="/{transaction_id}")
@@ -52,11 +126,29 @@ async def get_transaction(transaction_id: int):
     try:
         transaction = await TransactionService().get_transaction(transaction_id)
     except Exception as e:
-        logger.info(f"Error while getting transaction with id: {transaction_id} - {e}")
+        logger.info("Error while getting transaction with id: %s - %s", transaction_id, e)
         return None
     return transaction
 
 
+@router.patch(path="/batch")
+async def update_transaction_batch(update_transaction_status_batch_input: UpdateTransactionStatusBatchInput):
+    transaction_ids: List[int] = update_transaction_status_batch_input.transaction_ids
+    loans = [(loan.user_id, loan.book_id) for loan in update_transaction_status_batch_input.loans]
+
+    if not transaction_ids and not loans:
+        return {"message": "Nothing to update"}
+
+    try:
+        results: List[StatusChangeResult] = await TransactionService().update_transaction_status_batch(
+            update_transaction_status_batch_input.status, transaction_ids, loans
+        )
+    except Exception as e:
+        logger.info("Error while updating transactions: %s - %s", update_transaction_status_batch_input, e)
+        return []
+    return results
+
+
 @router.patch(path="/{transaction_id}")
 async def update_transaction(transaction_id: int, status: TransactionStatus):
     try:
@@ -64,32 +156,50 @@ async def update_transaction(transaction_id: int, status: TransactionStatus):
             transaction_id, status
         )
     except Exception as e:
-        logger.info(f"Error while updating transaction with id: {transaction_id} - {e}")
+        logger.info("Error while updating transaction with id: %s - %s", transaction_id, e)
         return None
     return transaction
 
 
 @router.get(path="/users/{user_id}")
-async def get_all_transactions_for_user(user_id: int):
+async def get_all_transactions_for_user(
+    user_id: int, request: Request, expand: Optional[str] = Query(None, description=EXPAND_DESCRIPTION)
+):
     try:
-        transactions = await TransactionService().get_all_transactions_for_user(user_id)
-        
-        charge_per_day: int = int(os.environ.get('CHARGE_PER_DAY'))
-        dues: List[int] = [(datetime.now().date() - x.created_at.date()).days for x in transactions
-                                if x.status == TransactionStatus.PENDING]*charge_per_day
-        total_due: int = sum(dues)
+        expansions: FrozenSet[TransactionExpansion] = parse_expand(expand)
+    except ValueError:
+        return {"message": "Invalid expand"}
+
+    try:
+        # The dues grow every day without any write to the table
+        headers: Dict[str, str] = await transaction_validators(expansions, date.today().isoformat())
+        if is_not_modified(request, headers):
+            return Response(status_code=304, headers=headers)
+        transaction_service = TransactionService()
+        transactions = await transaction_service.get_all_transactions_for_user(user_id, expansions)
+        total_due: int = await transaction_service.get_user_due(user_id)
 
     except Exception as e:
-        logger.info(f"Error while getting transactions for user_id: {user_id} - {e}")
+        logger.info("Error while getting transactions for user_id: %s - %s", user_id, e)
         return []
-    return {"total_due": total_due, "transactions": transactions}
+    return JSONBytesResponse({"total_due": total_due, "transactions": transactions}, headers=headers)
 
 
 @router.get(path="/books/{book_id}")
-async def get_all_transactions_for_book(book_id: int):
+async def get_all_transactions_for_book(
+    book_id: int, request: Request, expand: Optional[str] = Query(None, description=EXPAND_DESCRIPTION)
+):
+    try:
+        expansions: FrozenSet[TransactionExpansion] = parse_expand(expand)
+    except ValueError:
+        return {"message": "Invalid expand"}
+
     try:
-        transactions = await TransactionService().get_all_transactions_for_book(book_id)
+        headers: Dict[str, str] = await transaction_validators(expansions)
+        if is_not_modified(request, headers):
+            return Response(status_code=304, headers=headers)
+        transactions = await TransactionService().get_all_transactions_for_book(book_id, expansions)
     except Exception as e:
-        logger.info(f"Error while getting transactions for book_id: {book_id} - {e}")
+        logger.info("Error while getting transactions for book_id: %s - %s", book_id, e)
         return []
-    return transactions
+    return JSONBytesResponse(transactions, headers=headers)
@@ -1,51 +1,82 @@
+from typing import Dict, List, Optional
 from app.entities.user import CreateUserInput, UpdateUserInput
-from app.models.user import User
+from app.models.page import Page
+from app.models.table_version import TableVersion
+from app.models.user import User, UserDues
+from app.services.table_version_service import TableVersionService
 from app.services.user_service import UserService
+from app.utils.etag_utils import is_not_modified, validators
 from app.utils.logging_utils import logger
-from fastapi import APIRouter
+from app.utils.pagination_utils import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
+from app.utils.response_utils import JSONBytesResponse, JSONRoute
+from fastapi import APIRouter, Query, Request
+from fastapi.responses import Response
 
-router: APIRouter = APIRouter()
+router: APIRouter = APIRouter(route_class=JSONRoute)
 
 
 @router.post(path="")
 async def create_user(create_user_input: CreateUserInput):
-    logger.info(f"Recieved a request to create a new user entry")
+    logger.info("Recieved a request to create a new user entry")
     email, name = create_user_input.email, create_user_input.name
 
     user: User = await UserService().create_new_user(email, name)
-    logger.info(f"Successfully created a new user entry with id: {user.id}")
+    logger.info("Successfully created a new user entry with id: %s", user.id)
     return user
 
 
+@router.get(path="/dues")
+async def get_top_user_dues(top: int = Query(10, ge=1, le=MAX_PAGE_SIZE)):
+    logger.info("Recieved a request to fetch the top %s user dues", top)
+    try:
+        dues: List[UserDues] = await UserService().get_top_dues(top)
+    except Exception as e:
+        # Implement better exception handling
+        logger.error(e)
+        return []
+    logger.info("Successfully fetched %s user dues", len(dues))
+    return dues
+
+
 @router.get(path="/{id}")
-async def get_user(id: int):
-    logger.info(f"Recieved a request to fetch user with id: {id}")
+async def get_user(id: int, request: Request):
+    logger.info("Recieved a request to fetch user with id: %s", id)
     try:
+        version: TableVersion = await TableVersionService().get_table_version("user")
+        headers: Dict[str, str] = validators(version)
+        if is_not_modified(request, headers):
+            return Response(status_code=304, headers=headers)
         user: User = await UserService().get_user_by_id(id)
     except Exception as e:
         # Implement better exception handling
         logger.error(e)
         return {}
-    logger.info(f"Successfully fetched user with id: {id}")
-    return user
+    logger.info("Successfully fetched user with id: %s", id)
+    return JSONBytesResponse(user, headers=headers)
 
 
 @router.get(path="")
-async def get_all_users():
-    logger.info(f"Recieved a request to fetch all users")
+async def get_all_users(
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = Query(None),
+):
+    logger.info("Recieved a request to fetch users with limit: %s", limit)
     try:
-        users: list[User] = await UserService().get_all_users()
+        users: Page[User] = await UserService().get_all_users(limit, cursor)
+    except ValueError as e:
+        logger.error(e)
+        return {"message": "Invalid cursor"}
     except Exception as e:
         # Implement better exception handling
         logger.error(e)
         return {}
-    logger.info(f"Successfully fetched all users")
+    logger.info("Successfully fetched %s users", len(users.items))
     return users
 
 
 @router.patch(path="/{id}")
 async def update_user(id: int, update_user_input: UpdateUserInput):
-    logger.info(f"Recieved a request to update user with id: {id}")
+    logger.info("Recieved a request to update user with id: %s", id)
 
     name = update_user_input.name
     email = update_user_input.email
@@ -59,18 +90,18 @@ async def update_user(id: int, update_user_input: UpdateUserInput):
         # Implement better exception handling
         logger.error(e)
         return {}
-    logger.info(f"Successfully updated user with id: {id}")
+    logger.info("Successfully updated user with id: %s", id)
     return user
 
 
 @router.delete(path="/{id}")
 async def delete_user(id: int):
-    logger.info(f"Recieved a request to delete user with id: {id}")
+    logger.info("Recieved a request to delete user with id: %s", id)
     try:
         user: User = await UserService().delete_user_by_id(id)
     except Exception as e:
         # Implement better exception handling
         logger.error(e)
         return {}
-    logger.info(f"Successfully deleted user with id: {id}")
+    logger.info("Successfully deleted user with id: %s", id)
     return user
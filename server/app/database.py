@@ -1,14 +1,143 @@
+import asyncio
+import itertools
+import json
 from os import environ
+from typing import Any, Dict, List, Optional
 
 import asyncpg
-from asyncpg import create_pool
+from asyncpg import Connection, create_pool
+from prometheus_client import REGISTRY
 
-from app.utils.database_utils import generate_dsn
+from app.utils.database_utils import generate_dsn, generate_replica_dsns, request_routing
 from app.utils.logging_utils import logger
+from app.utils.metrics_utils import (
+    DB_REPLICA_HEALTHY,
+    DB_REPLICA_LAG_SECONDS,
+    InstrumentedPool,
+    PoolCollector,
+)
+from app.utils.statement_utils import StatementRegistry
+
+# Seconds since the last replayed transaction, 0 when everything received has been replayed since the primary
+# may simply be idle. 0 on a server that is not a standby.
+REPLICA_LAG_QUERY = """SELECT CASE
+    WHEN NOT pg_is_in_recovery() OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+    ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+END::float8;"""
+
+# Failures to reach a replica, the reads fall back to the primary
+UNAVAILABLE_ERRORS = (OSError, asyncio.TimeoutError, asyncpg.PostgresError, asyncpg.InterfaceError)
+
+
+class PreparedConnection(asyncpg.Connection):
+    """Connection whose statement cache is warmed with every statement of the StatementRegistry.
+
+    asyncpg keeps one server-side prepared statement per query text in a per-connection cache, the
+    registry guarantees the services always send the same text for the same query shape.
+    """
+
+    async def prepare_registered_statements(self):
+        for query in StatementRegistry.all():
+            try:
+                # Same code path as fetch() so that the statement lands in the connection statement cache
+                await self._get_statement(query, None)
+            except asyncpg.PostgresError as e:
+                # Prepared lazily on first use instead, the query will report the error to its caller
+                logger.warning("Could not prepare statement: %s - %s", query, e)
+            except (TypeError, AttributeError) as e:
+                # _get_statement is private to asyncpg, pinned in requirements.txt. Should another version change
+                # it, every statement is prepared lazily on first use instead.
+                logger.warning(
+                    "Could not warm the statement cache with asyncpg %s, statements are prepared on first use - %s",
+                    asyncpg.__version__,
+                    e,
+                )
+                break
+        # Preparing only flushes, the implicit transaction it opened keeps locks on every table of the
+        # prepared statements until the next Sync. Close it so idle connections do not block DDL and LOCK TABLE.
+        await self.execute("SELECT 1;")
+
+
+async def init_connection(connection: PreparedConnection):
+    # Before preparing, the codecs of a prepared statement are resolved when it is prepared
+    await connection.set_type_codec("jsonb", encoder=json.dumps, decoder=json.loads, schema="pg_catalog")
+    await connection.prepare_registered_statements()
+
+
+class Replica:
+    """Connection pool of a read replica and the outcome of its last health check."""
+
+    def __init__(self, pool: InstrumentedPool):
+        self.pool = pool
+        # None until the first health check
+        self.healthy: Optional[bool] = None
+        self.lag: Optional[float] = None
+
+    async def check(self, max_lag: float):
+        """Measures the replication lag, the replica is healthy if it answers and lags at most max_lag seconds."""
+
+        try:
+            async with self.pool.acquire() as connection:
+                lag: float = await connection.fetchval(REPLICA_LAG_QUERY)
+        except UNAVAILABLE_ERRORS as e:
+            if self.healthy is not False:
+                logger.warning("Replica %s is unavailable, reads fall back to the primary - %s", self.pool.name, e)
+            self.mark_unhealthy()
+            return
+
+        healthy = lag <= max_lag
+        if healthy != self.healthy:
+            logger.warning(
+                "Replica %s is %s with a lag of %.1f s", self.pool.name, "healthy" if healthy else "lagging", lag
+            )
+        self.healthy, self.lag = healthy, lag
+        DB_REPLICA_HEALTHY.labels(self.pool.name).set(healthy)
+        DB_REPLICA_LAG_SECONDS.labels(self.pool.name).set(lag)
+
+    def mark_unhealthy(self):
+        self.healthy, self.lag = False, None
+        DB_REPLICA_HEALTHY.labels(self.pool.name).set(0)
+
+
+class ReadAcquireContext:
+    def __init__(self, timeout: Optional[float]):
+        self.timeout = timeout
+        self.context = None
+
+    async def __aenter__(self) -> Connection:
+        replica = DatabaseConnectionPool.read_replica()
+        if replica is not None:
+            self.context = replica.pool.acquire(timeout=self.timeout)
+            try:
+                return await self.context.__aenter__()
+            except UNAVAILABLE_ERRORS as e:
+                logger.warning(
+                    "Could not acquire a connection from %s, reading from the primary - %s", replica.pool.name, e
+                )
+                replica.mark_unhealthy()
+        self.context = DatabaseConnectionPool.instance.acquire(timeout=self.timeout)
+        return await self.context.__aenter__()
+
+    async def __aexit__(self, *exc_info: Any):
+        await self.context.__aexit__(*exc_info)
+
+
+class ReadPool:
+    """Pool of the read-only queries, served by a healthy replica or else by the primary.
+
+    Only `async with pool.acquire()` is supported. A query that fails on the replica once acquired is not retried.
+    """
+
+    def acquire(self, *, timeout: Optional[float] = None) -> ReadAcquireContext:
+        return ReadAcquireContext(timeout)
 
 
 class DatabaseConnectionPool:
-    instance: asyncpg.Pool = None
+    instance: InstrumentedPool = None
+    replicas: List[Replica] = []
+    read_pool: ReadPool = ReadPool()
+    health_check: Optional[asyncio.Task] = None
+    replica_turns = itertools.count()
 
     def __init__(self):
         raise NotImplementedError(f"DatabaseConnectionPool cannot be instantiated")
@@ -23,6 +152,14 @@ class DatabaseConnectionPool:
             - maximum time to wait before a connection is acquired = 10 s
             - maximum time to wait before a query finishes execution = 1 min
             - maximum time to wait before a connection in the pool is removed = 8 min
+            - maximum number of prepared statements cached per connection = 256, kept for the connection lifetime
+
+        Every statement registered in the StatementRegistry is prepared when a connection is opened. The time spent
+        waiting for and holding connections is recorded in the metrics.
+
+        A pool with the same configuration is created for every replica of generate_replica_dsns, except that its
+        connections are opened on demand so that an unavailable replica does not prevent the startup. The replicas
+        are health checked every DB_REPLICA_CHECK_INTERVAL seconds.
         """
 
         if cls.instance:
@@ -30,30 +167,88 @@ class DatabaseConnectionPool:
             return
 
         logger.info("Creating database connection pool instance")
-        cls.instance = await create_pool(
-            dsn=generate_dsn(),
-            min_size=5,
+        cls.instance = InstrumentedPool(await cls.create_pool(generate_dsn(), min_size=5), "primary")
+
+        replica_dsns = generate_replica_dsns()
+        for i, dsn in enumerate(replica_dsns):
+            cls.replicas.append(Replica(InstrumentedPool(await cls.create_pool(dsn, min_size=0), f"replica-{i}")))
+        if cls.replicas:
+            logger.info("Created connection pools for %s replica(s)", len(cls.replicas))
+            await cls.check_replicas()
+            cls.health_check = asyncio.create_task(cls.check_replicas_periodically())
+
+    @staticmethod
+    async def create_pool(dsn: str, min_size: int) -> asyncpg.Pool:
+        return await create_pool(
+            dsn=dsn,
+            min_size=min_size,
             max_size=40,
             timeout=int(environ.get("CONNECTION_TIMEOUT", 10)),
             command_timeout=int(environ.get("QUERY_TIMEOUT", 60)),
             max_inactive_connection_lifetime=480,
+            statement_cache_size=int(environ.get("STATEMENT_CACHE_SIZE", 256)),
+            max_cached_statement_lifetime=0,
+            connection_class=PreparedConnection,
+            init=init_connection,
         )
 
     @classmethod
-    def get(cls):
+    def get(cls, read_only: bool = False):
         """Returns the connection pool instance.
 
+        Args:
+            read_only: return the pool of the queries that do not write, routed to the replicas when there are.
+                Reads filling a cache should not use it, a lagging replica would cache the rows invalidated by a
+                write again.
+
         Raises:
             ValueError: if the connection pool instance has not been initialised before being requested for
         """
 
-        logger.info("Acquiring database connection pool instance")
+        logger.debug("Acquiring database connection pool instance")
         if not cls.instance:
             raise ValueError(
                 "Connection pool instance was not initialised on application startup"
             )
+        if read_only and cls.replicas:
+            return cls.read_pool
         return cls.instance
 
+    @classmethod
+    def read_replica(cls) -> Optional[Replica]:
+        """Picks the replica serving a read, None if it has to be served by the primary.
+
+        Reads of requests that write or whose client wrote recently go to the primary, see ReadYourWritesMiddleware.
+        The other requests read from one replica, picked in turn among the healthy ones.
+        """
+
+        routing = request_routing.get()
+        if routing is not None:
+            if routing.primary_only:
+                return None
+            if routing.replica is not None and routing.replica.healthy:
+                return routing.replica
+
+        healthy = [replica for replica in cls.replicas if replica.healthy]
+        if not healthy:
+            return None
+        replica = healthy[next(cls.replica_turns) % len(healthy)]
+        if routing is not None:
+            routing.replica = replica
+        return replica
+
+    @classmethod
+    async def check_replicas(cls):
+        max_lag = float(environ.get("DB_REPLICA_MAX_LAG", 5))
+        await asyncio.gather(*(replica.check(max_lag) for replica in cls.replicas))
+
+    @classmethod
+    async def check_replicas_periodically(cls):
+        interval = float(environ.get("DB_REPLICA_CHECK_INTERVAL", 5))
+        while True:
+            await asyncio.sleep(interval)
+            await cls.check_replicas()
+
     @classmethod
     async def close(cls):
         """Gracefully closes all open and active connections in the connection pool.
@@ -61,5 +256,21 @@ class DatabaseConnectionPool:
         Invoked automatically at application shutdown.
         """
 
-        logger.info(f"Closing all connections in the connection pool")
+        logger.info("Closing all connections in the connection pool")
+        if cls.health_check:
+            cls.health_check.cancel()
+            cls.health_check = None
+        for replica in cls.replicas:
+            await replica.pool.close()
+        cls.replicas = []
         await cls.instance.close()
+        cls.instance = None
+
+    @classmethod
+    def pools(cls) -> Dict[str, InstrumentedPool]:
+        if not cls.instance:
+            return {}
+        return {pool.name: pool for pool in [cls.instance] + [replica.pool for replica in cls.replicas]}
+
+
+REGISTRY.register(PoolCollector(DatabaseConnectionPool.pools))
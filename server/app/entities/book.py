@@ -1,15 +1,22 @@
 from datetime import datetime
+from enum import Enum
 from typing import List, Optional
 
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, constr
+
+
+class BookIngestStatus(str, Enum):
+    INSERTED = "INSERTED"
+    DUPLICATE = "DUPLICATE"
+    INVALID = "INVALID"
 
 
 class CreateBookInput(BaseModel):
-    title: str = Field(..., description="Primary key - title of the book")
-    authors: List[str] = Field(..., description="Author(s) of the book")
-    isbn: Optional[str] = Field(None, description="ISBN of the book")
-    isbn13: Optional[str] = Field(None, description="ISBN13 of the book")
-    language_code: Optional[str] = Field(None, description="Language code of the book")
+    title: str = Field(..., max_length=255, description="Primary key - title of the book")
+    authors: List[constr(max_length=255)] = Field(..., description="Author(s) of the book")
+    isbn: Optional[str] = Field(None, max_length=13, description="ISBN of the book")
+    isbn13: Optional[str] = Field(None, max_length=13, description="ISBN13 of the book")
+    language_code: Optional[str] = Field(None, max_length=10, description="Language code of the book")
     num_pages: Optional[int] = Field(None, description="Number of pages in the book")
     stock_quantity: int = Field(
         ..., description="Number of books in stock in the platform"
@@ -17,7 +24,7 @@ class CreateBookInput(BaseModel):
     publication_date: Optional[datetime] = Field(
         None, description="Publication date of the book"
     )
-    publisher: Optional[str] = Field(None, description="Publisher of the book")
+    publisher: Optional[str] = Field(None, max_length=255, description="Publisher of the book")
 
 
 class UpdateBookInput(BaseModel):
@@ -0,0 +1,14 @@
+from enum import Enum
+
+
+class JobStatus(str, Enum):
+    QUEUED = "QUEUED"
+    RUNNING = "RUNNING"
+    COMPLETED = "COMPLETED"
+    FAILED = "FAILED"
+    CANCELLED = "CANCELLED"
+
+
+class JobKind(str, Enum):
+    BOOK_BATCH = "book_batch"
+    FRAPPE_IMPORT = "frappe_import"
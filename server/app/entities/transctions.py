@@ -1,4 +1,5 @@
 from enum import Enum
+from typing import List
 
 from pydantic import BaseModel, Field
 
@@ -8,6 +9,48 @@ class TransactionStatus(str, Enum):
     COMPLETED = "COMPLETED"
 
 
+class TransactionExpansion(str, Enum):
+    BOOK = "book"
+    USER = "user"
+
+
+class CheckoutStatus(str, Enum):
+    CHECKED_OUT = "CHECKED_OUT"
+    OUT_OF_STOCK = "OUT_OF_STOCK"
+    CREDIT_LIMIT_EXCEEDED = "CREDIT_LIMIT_EXCEEDED"
+    USER_NOT_FOUND = "USER_NOT_FOUND"
+
+
+class StatusChangeOutcome(str, Enum):
+    UPDATED = "UPDATED"
+    UNCHANGED = "UNCHANGED"
+    NOT_FOUND = "NOT_FOUND"
+
+
 class CreateTransactionInput(BaseModel):
     user_id: int = Field(..., description="Primary key - integer id of the user")
     book_id: int = Field(..., description="Primary key - integer id of the book")
+
+
+class CreateTransactionBatchInput(BaseModel):
+    user_id: int = Field(..., description="Primary key - integer id of the user")
+    book_ids: List[int] = Field(
+        ..., min_length=1, max_length=100, description="Primary keys - integer ids of the books to checkout"
+    )
+
+
+class TransactionLoanInput(BaseModel):
+    user_id: int = Field(..., description="Primary key - integer id of the user")
+    book_id: int = Field(..., description="Primary key - integer id of the book")
+
+
+class UpdateTransactionStatusBatchInput(BaseModel):
+    status: TransactionStatus = Field(
+        TransactionStatus.COMPLETED, description="Status to set on the transactions"
+    )
+    transaction_ids: List[int] = Field(
+        [], max_length=1000, description="Primary keys - integer ids of the transactions"
+    )
+    loans: List[TransactionLoanInput] = Field(
+        [], max_length=1000, description="Books scanned with the user who borrowed them, when the id is unknown"
+    )
@@ -0,0 +1,173 @@
+import asyncio
+from os import environ
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from app.entities.job import JobKind, JobStatus
+from app.models.job import Job
+from app.services.job_service import JobLeaseLost, JobService
+from app.utils.logging_utils import logger
+
+JobHandler = Callable[[Job], Awaitable[None]]
+
+
+class JobRunner:
+    """Bounded pool of workers running the background jobs of the job table within the app process.
+
+    Every process started with workers takes part, a job is claimed by one worker at a time. The runner is
+    configured through the following environment variables:
+        - JOB_WORKERS: number of jobs run concurrently by the process, defaults to 2, 0 to run none
+        - JOB_POLL_INTERVAL: seconds between two looks for the jobs submitted to other processes, defaults to 5
+        - JOB_LEASE_TIMEOUT: seconds after which the job of a worker that stopped renewing its lease is claimed
+          again, defaults to 60. The leases are renewed three times within it.
+        - JOB_MAX_ATTEMPTS: times a job is started before it is failed, defaults to 3. A job interrupted by a
+          graceful shutdown is requeued without counting the attempt.
+    """
+
+    handlers: Dict[JobKind, JobHandler] = {}
+    workers: List[asyncio.Task] = []
+    lease_renewal: Optional[asyncio.Task] = None
+    wakeup: Optional[asyncio.Event] = None
+    # id -> job and task of its handler, for the jobs run by this process
+    running: Dict[int, Tuple[Job, asyncio.Task]] = {}
+
+    def __init__(self):
+        raise NotImplementedError(f"JobRunner cannot be instantiated")
+
+    @classmethod
+    def register(cls, kind: JobKind, handler: JobHandler):
+        """Registers the coroutine function running the jobs of a kind, it returns once the job is complete."""
+
+        cls.handlers[kind] = handler
+
+    @classmethod
+    async def start(cls):
+        """Starts the workers, the jobs left RUNNING by a stopped process are resumed once their lease expires."""
+
+        n_workers = int(environ.get("JOB_WORKERS", 2))
+        if n_workers <= 0:
+            logger.info("No job workers started, the jobs are run by other processes")
+            return
+
+        logger.info("Starting %s job worker(s)", n_workers)
+        cls.wakeup = asyncio.Event()
+        cls.workers = [asyncio.create_task(cls.work()) for _ in range(n_workers)]
+        cls.lease_renewal = asyncio.create_task(cls.renew_leases())
+
+    @classmethod
+    async def stop(cls):
+        """Stops the workers, the jobs they were running are requeued and resume from their last checkpoint."""
+
+        tasks = cls.workers + ([cls.lease_renewal] if cls.lease_renewal else [])
+        if not tasks:
+            return
+
+        logger.info("Stopping %s job worker(s)", len(cls.workers))
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        cls.workers, cls.lease_renewal, cls.wakeup = [], None, None
+
+    @classmethod
+    def wake(cls):
+        """Makes an idle worker look for jobs right away, call it after submitting a job."""
+
+        if cls.wakeup:
+            cls.wakeup.set()
+
+    @classmethod
+    def cancel(cls, job_id: int) -> bool:
+        """Stops a job run by this process, its current chunk is rolled back.
+
+        Returns:
+            whether the job was running in this process
+        """
+
+        if job_id not in cls.running:
+            return False
+        cls.running[job_id][1].cancel()
+        return True
+
+    @classmethod
+    async def work(cls):
+        poll_interval = float(environ.get("JOB_POLL_INTERVAL", 5))
+        lease_timeout = float(environ.get("JOB_LEASE_TIMEOUT", 60))
+
+        while True:
+            try:
+                job: Optional[Job] = await JobService().claim_job(lease_timeout)
+            except Exception:
+                logger.exception("Could not claim a job")
+                job = None
+
+            if job is None:
+                try:
+                    await asyncio.wait_for(cls.wakeup.wait(), timeout=poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                cls.wakeup.clear()
+                continue
+
+            await cls.run(job)
+
+    @classmethod
+    async def run(cls, job: Job):
+        max_attempts = int(environ.get("JOB_MAX_ATTEMPTS", 3))
+        handler = cls.handlers.get(job.kind)
+        if job.cancel_requested:
+            await cls.finish(job, JobStatus.CANCELLED)
+            return
+        if handler is None:
+            await cls.finish(job, JobStatus.FAILED, f"No handler for jobs of kind {job.kind.value}")
+            return
+        if job.attempts > max_attempts:
+            await cls.finish(job, JobStatus.FAILED, f"Gave up after {max_attempts} attempts")
+            return
+
+        logger.info("Running %s job %s from %s of %s item(s)", job.kind.value, job.id, job.progress, job.total)
+        task = asyncio.create_task(handler(job))
+        cls.running[job.id] = (job, task)
+        try:
+            # Not awaited directly, the task is only cancelled by a shutdown after it has been waited for
+            await asyncio.wait([task])
+        except asyncio.CancelledError:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+            await JobService().requeue_job(job)
+            raise
+        finally:
+            cls.running.pop(job.id, None)
+
+        if task.cancelled():
+            await cls.finish(job, JobStatus.CANCELLED)
+        elif isinstance(task.exception(), JobLeaseLost):
+            logger.warning("Job %s was claimed by another worker, stopped running it", job.id)
+        elif task.exception():
+            logger.error("Job %s failed", job.id, exc_info=task.exception())
+            await cls.finish(job, JobStatus.FAILED, str(task.exception()) or type(task.exception()).__name__)
+        else:
+            await cls.finish(job, JobStatus.COMPLETED)
+
+    @staticmethod
+    async def finish(job: Job, status: JobStatus, error: Optional[str] = None):
+        try:
+            await JobService().finish_job(job, status, error)
+        except Exception:
+            # Claimed again once its lease expires
+            logger.exception("Could not record the outcome of job %s", job.id)
+
+    @classmethod
+    async def renew_leases(cls):
+        interval = float(environ.get("JOB_LEASE_TIMEOUT", 60)) / 3
+
+        while True:
+            await asyncio.sleep(interval)
+            if not cls.running:
+                continue
+            try:
+                cancel_requested = await JobService().renew_leases([job for job, _ in cls.running.values()])
+            except Exception:
+                logger.exception("Could not renew the leases of the running jobs")
+                continue
+            for job_id, requested in cancel_requested.items():
+                if requested and cls.cancel(job_id):
+                    logger.info("Cancelled job %s", job_id)
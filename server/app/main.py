@@ -1,36 +1,78 @@
+import asyncio
+from os import environ
+
 from dotenv import load_dotenv
-from fastapi import FastAPI
+from fastapi import FastAPI, Response
 from fastapi.middleware.cors import CORSMiddleware
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
+
+# The logging and middleware settings are read at import, before the lifespan loads the .env file
+load_dotenv(dotenv_path=".env")
 
 from app.database import DatabaseConnectionPool
+from app.entities.job import JobKind
+from app.job_runner import JobRunner
 from app.routes import router
-from app.utils.logging_utils import logger
+from app.services.book_import_service import BookImportService
+from app.services.table_version_service import TableVersionService
+from app.services.transaction_service import TransactionService
+from app.utils.compression_utils import CompressionMiddleware
+from app.utils.database_utils import LAST_WRITE_HEADER, ReadYourWritesMiddleware
+from app.utils.logging_utils import CORRELATION_ID_HEADER, CorrelationIdMiddleware, logger
+from app.utils.metrics_utils import MetricsMiddleware
+from app.utils.response_utils import JSONBytesResponse
 
 
 async def database_connection(app: FastAPI):
     logger.info("Initialising database connection pool")
     load_status = load_dotenv(dotenv_path=".env")
-    logger.info(f"Loaded .env file: {load_status}")
+    logger.info("Loaded .env file: %s", load_status)
     await DatabaseConnectionPool.create()
     logger.info("Initialized database connection pool")
+    JobRunner.register(JobKind.BOOK_BATCH, lambda job: BookImportService().import_book_batch(job))
+    JobRunner.register(JobKind.FRAPPE_IMPORT, lambda job: BookImportService().import_frappe_books(job))
+    await JobRunner.start()
+    version_compaction = asyncio.create_task(TableVersionService.compact_periodically())
+    # Right away and then daily, a checkout in a month without a partition would be refused
+    partition_creation = asyncio.create_task(TransactionService.create_partitions_periodically())
 
     yield
 
+    version_compaction.cancel()
+    partition_creation.cancel()
+    # Before the pool is closed, the interrupted jobs are requeued
+    await JobRunner.stop()
     logger.info("Closing database connection pool")
     await DatabaseConnectionPool.close()
 
 
-app = FastAPI(title="lib-next", lifespan=database_connection)
+app = FastAPI(title="lib-next", lifespan=database_connection, default_response_class=JSONBytesResponse)
 app.include_router(router, prefix="/api/v1")
+app.add_middleware(
+    CompressionMiddleware,
+    minimum_size=int(environ.get("COMPRESSION_MINIMUM_SIZE", 1024)),
+    gzip_level=int(environ.get("COMPRESSION_GZIP_LEVEL", 6)),
+    brotli_quality=int(environ.get("COMPRESSION_BROTLI_QUALITY", 4)),
+)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[CORRELATION_ID_HEADER, LAST_WRITE_HEADER],
 )
+app.add_middleware(ReadYourWritesMiddleware, window=float(environ.get("DB_REPLICA_MAX_LAG", 5)))
+app.add_middleware(CorrelationIdMiddleware)
+# Outermost so that the recorded latency includes the other middlewares
+app.add_middleware(MetricsMiddleware)
 
 
 @app.get("/")
 async def root():
     return {"message": "Welcome to Lib-Next"}
+
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
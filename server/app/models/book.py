@@ -1,8 +1,10 @@
-from datetime import datetime
+from datetime import date, datetime
 from typing import List, Optional
 
 from pydantic import BaseModel, Field
 
+from app.entities.book import BookIngestStatus
+
 
 class FrappeBook(BaseModel):
     title: str = Field(..., description="Primary key - title of the book")
@@ -11,7 +13,7 @@ class FrappeBook(BaseModel):
     isbn13: Optional[str] = Field(None, description="ISBN13 of the book")
     language_code: Optional[str] = Field(None, description="Language code of the book")
     num_pages: Optional[int] = Field(None, description="Number of pages in the book")
-    publication_date: Optional[datetime] = Field(
+    publication_date: Optional[date] = Field(
         None, description="Publication date of the book"
     )
     publisher: Optional[str] = Field(None, description="Publisher of the book")
@@ -28,3 +30,23 @@ class Book(FrappeBook):
     updated_at: datetime = Field(
         ..., description="Datetime when the book was last updated"
     )
+
+
+class BookSearchResult(Book):
+    rank: float = Field(
+        ..., description="Relevance of the book to the search query, higher is better"
+    )
+
+
+class BookIngestResult(BaseModel):
+    row: int = Field(..., description="Index of the book in the batch request")
+    status: BookIngestStatus = Field(..., description="Outcome of the ingestion of the book")
+    id: Optional[int] = Field(None, description="Id of the inserted book")
+    error: Optional[str] = Field(None, description="Reason why the book is invalid")
+
+
+class BookBatchResult(BaseModel):
+    count_unique: int = Field(..., description="Number of books inserted")
+    count_duplicates: int = Field(..., description="Number of books already present in the catalog or the batch")
+    count_invalid: int = Field(..., description="Number of books rejected by validation")
+    results: List[BookIngestResult] = Field(..., description="Outcome of every book in request order")
@@ -0,0 +1,24 @@
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from pydantic import BaseModel, Field
+
+from app.entities.job import JobKind, JobStatus
+
+
+class Job(BaseModel):
+    id: int = Field(..., description="Primary key - integer id of the job")
+    kind: JobKind = Field(..., description="Kind of the job")
+    status: JobStatus = Field(JobStatus.QUEUED, description="Status of the job")
+    params: Dict[str, Any] = Field({}, description="Parameters the job was submitted with")
+    total: Optional[int] = Field(None, description="Number of input items, null when not known in advance")
+    progress: int = Field(0, description="Number of input items processed and committed")
+    counts: Dict[str, int] = Field({}, description="Outcome of the processed items, e.g. books inserted")
+    errors: List[Dict[str, Any]] = Field([], description="First errors of the items that could not be processed")
+    error: Optional[str] = Field(None, description="Reason of the failure of the job")
+    cancel_requested: bool = Field(False, description="Whether the job was asked to stop")
+    attempts: int = Field(0, description="Number of times a worker started the job, it resumes after a restart")
+    created_at: datetime = Field(..., description="Datetime when the job was submitted")
+    updated_at: datetime = Field(..., description="Datetime when the job was last updated")
+    started_at: Optional[datetime] = Field(None, description="Datetime when the job was first started")
+    finished_at: Optional[datetime] = Field(None, description="Datetime when the job completed, failed or stopped")
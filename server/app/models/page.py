@@ -0,0 +1,12 @@
+from typing import Generic, List, Optional, TypeVar
+
+from pydantic import BaseModel, Field
+
+T = TypeVar("T")
+
+
+class Page(BaseModel, Generic[T]):
+    items: List[T] = Field(..., description="Records in the current page")
+    next_cursor: Optional[str] = Field(
+        None, description="Opaque cursor for the next page, null if this is the last page"
+    )
@@ -0,0 +1,9 @@
+from datetime import datetime
+
+from pydantic import BaseModel, Field
+
+
+class TableVersion(BaseModel):
+    table_name: str = Field(..., description="Primary key - name of the table")
+    version: int = Field(..., description="Number of statements that have written to the table")
+    updated_at: datetime = Field(..., description="Datetime when the table was last written to")
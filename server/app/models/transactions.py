@@ -1,8 +1,9 @@
 from datetime import datetime
+from typing import List, Optional
 
 from pydantic import BaseModel, Field
 
-from app.entities.transctions import TransactionStatus
+from app.entities.transctions import CheckoutStatus, StatusChangeOutcome, TransactionStatus
 
 
 class Transactions(BaseModel):
@@ -18,3 +19,40 @@ class Transactions(BaseModel):
     updated_at: datetime = Field(
         ..., description="Datetime when the book was last updated"
     )
+
+
+class TransactionBook(BaseModel):
+    id: int = Field(..., description="Primary key - integer id of the book")
+    title: str = Field(..., description="Title of the book")
+    authors: List[str] = Field(..., description="Author(s) of the book")
+    isbn: Optional[str] = Field(None, description="ISBN of the book")
+    isbn13: Optional[str] = Field(None, description="ISBN13 of the book")
+
+
+class TransactionUser(BaseModel):
+    id: int = Field(..., description="Primary key - integer id of the user")
+    name: Optional[str] = Field(None, description="Name of the user")
+    email: str = Field(..., description="Email of the user")
+
+
+class ExpandedTransaction(Transactions):
+    book: Optional[TransactionBook] = Field(None, description="Book borrowed, null unless expanded")
+    user: Optional[TransactionUser] = Field(None, description="User who borrowed the book, null unless expanded")
+
+
+class CheckoutResult(BaseModel):
+    book_id: int = Field(..., description="Primary key - integer id of the book")
+    status: CheckoutStatus = Field(..., description="Outcome of the checkout")
+    transaction: Optional[Transactions] = Field(
+        None, description="Transaction created by the checkout"
+    )
+
+
+class StatusChangeResult(BaseModel):
+    transaction_id: Optional[int] = Field(None, description="Requested id of the transaction")
+    user_id: Optional[int] = Field(None, description="Requested id of the user, when given with a book")
+    book_id: Optional[int] = Field(None, description="Requested id of the book, when given with a user")
+    outcome: StatusChangeOutcome = Field(..., description="Outcome of the status change")
+    transaction: Optional[Transactions] = Field(
+        None, description="Transaction after the status change"
+    )
@@ -13,4 +13,11 @@ class User(BaseModel):
     )
     updated_at: datetime = Field(
         ..., description="Datetime when the user information was last updated"
-    )
\ No newline at end of file
+    )
+
+class UserDues(BaseModel):
+    user_id: int = Field(..., description="Primary key - integer id of the user")
+    email: str = Field(..., description="Email id of the user")
+    name: Optional[str] = Field(None, description="Name of the user")
+    open_loans: int = Field(..., description="Number of books borrowed and not yet returned")
+    total_due: int = Field(..., description="Charge due for the books not yet returned")
@@ -1,4 +1,10 @@
-from app.controllers import book_controller, transaction_controller, user_controller
+from app.controllers import (
+    book_controller,
+    cache_controller,
+    job_controller,
+    transaction_controller,
+    user_controller,
+)
 from fastapi import APIRouter
 
 router = APIRouter()
@@ -7,3 +13,5 @@ router.include_router(book_controller.router, prefix="/books", tags=["book"])
 router.include_router(
     transaction_controller.router, prefix="/transactions", tags=["transaction"]
 )
+router.include_router(cache_controller.router, prefix="/cache", tags=["cache"])
+router.include_router(job_controller.router, prefix="/jobs", tags=["job"])
@@ -0,0 +1,84 @@
+import os
+from typing import Any, Dict, List
+
+from app.database import DatabaseConnectionPool
+from app.models.job import Job
+from app.services.book_service import BookService
+from app.services.frappe_service import FrappeService
+from app.services.job_service import JobService
+from app.utils.logging_utils import logger
+from asyncpg import Pool
+
+
+class BookImportService:
+    """Handlers of the background jobs importing books, registered with app.job_runner.JobRunner.
+
+    The books are imported in chunks of JOB_CHUNK_SIZE, each one committed with the progress of the job so that
+    a job interrupted by a restart resumes after its last committed chunk. At most JOB_MAX_ERRORS errors of the
+    invalid books are kept with the job, all are counted.
+    """
+
+    def __init__(self):
+        self.pool: Pool = DatabaseConnectionPool.get()
+        self.schema: str = os.environ.get("DB_SCHEMA")
+        self.chunk_size: int = int(os.environ.get("JOB_CHUNK_SIZE", 1000))
+        self.max_errors: int = int(os.environ.get("JOB_MAX_ERRORS", 100))
+
+    async def import_book_batch(self, job: Job):
+        """Creates the books submitted with the job, skipping the duplicates, as POST /books/batch does.
+
+        Counts the books inserted, duplicate and invalid, the errors are keyed by the row of the book in the batch.
+        """
+
+        rows: List[Dict[str, Any]] = await JobService().get_job_input(job)
+        logger.info("Importing %s book(s) of job %s from row %s", len(rows), job.id, job.progress)
+
+        for start in range(job.progress, len(rows), self.chunk_size):
+            chunk = rows[start:start + self.chunk_size]
+            books_input, invalid = BookService.validate_book_batch(chunk, first_row=start)
+            await self._import_chunk(job, books_input, invalid, len(chunk))
+
+    async def import_frappe_books(self, job: Job):
+        """Imports books from the Frappe library API, params limit, includes and stock_quantity.
+
+        As GET /books/import/frappe does, limit valid books are fetched unless the API runs out of pages first.
+        The API is paginated, each chunk is a run of whole pages and the progress of the job counts the rows of
+        the pages imported. Counts the books fetched, inserted, duplicate and invalid, the errors are keyed by the
+        position of the book in the import.
+        """
+
+        limit: int = job.params["limit"]
+        includes = job.params.get("includes")
+        stock_quantity: int = job.params.get("stock_quantity", 1)
+        page_size = FrappeService.page_size
+        n_pages = max(self.chunk_size // page_size, 1)
+        logger.info("Importing up to %s Frappe book(s) of job %s from row %s", limit, job.id, job.progress)
+
+        exhausted = False
+        while job.counts.get("fetched", 0) < limit and not exhausted:
+            books, exhausted = await FrappeService().fetch_pages(job.progress // page_size + 1, n_pages, includes)
+            books = books[:limit - job.counts.get("fetched", 0)]
+            chunk = [{**book.model_dump(exclude_none=True), "stock_quantity": stock_quantity} for book in books]
+            books_input, invalid = BookService.validate_book_batch(chunk, first_row=job.counts.get("fetched", 0))
+            job.counts["fetched"] = job.counts.get("fetched", 0) + len(books)
+            await self._import_chunk(job, books_input, invalid, n_pages * page_size)
+
+    async def _import_chunk(
+        self, job: Job, books_input: Dict[int, Dict[str, Any]], invalid: Dict[int, str], n_items: int
+    ):
+        for key in ("inserted", "duplicates", "invalid"):
+            job.counts.setdefault(key, 0)
+
+        async with self.pool.acquire() as connection:
+            async with connection.transaction():
+                logger.debug("Acquired connection and opened transaction to import chunk of job %s", job.id)
+                inserted: Dict[int, int] = await BookService().create_new_book_batch(books_input, connection)
+                job.progress += n_items
+                job.counts["inserted"] += len(inserted)
+                job.counts["duplicates"] += len(books_input) - len(inserted)
+                job.counts["invalid"] += len(invalid)
+                job.errors += [
+                    {"row": row, "error": error} for row, error in invalid.items()
+                ][:max(self.max_errors - len(job.errors), 0)]
+                await JobService().checkpoint(connection, job)
+        logger.info("Job %s imported %s of %s item(s)", job.id, job.progress, job.total)
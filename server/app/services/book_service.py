@@ -1,18 +1,123 @@
-from datetime import datetime
 import os
-from typing import Any, Dict, List
+from typing import Any, AsyncIterator, Dict, Iterable, List, Optional, Tuple
 
 from app.database import DatabaseConnectionPool
-from app.models.book import Book
+from app.entities.book import CreateBookInput
+from app.models.book import Book, BookSearchResult
+from app.models.page import Page
+from app.utils.cache_utils import Cache, CacheRegistry
 from app.utils.deserialization_utils import deserialize_records
+from app.utils.export_utils import EXPORT_CHUNK_SIZE, stream_records
+from app.utils.loader_utils import DataLoader, LoaderRegistry
 from app.utils.logging_utils import logger
-from asyncpg import Pool, Record
-
-
+from app.utils.metrics_utils import instrumented
+from app.utils.pagination_utils import DEFAULT_PAGE_SIZE, decode_cursor, encode_cursor
+from app.utils.statement_utils import StatementRegistry
+from asyncpg import Connection, Pool, Record
+from pydantic import ValidationError
+
+BOOK_STAGING_COLUMNS: List[str] = [
+    "row_number",
+    "title",
+    "authors",
+    "isbn",
+    "isbn13",
+    "language_code",
+    "num_pages",
+    "stock_quantity",
+    "publication_date",
+    "publisher",
+]
+BOOK_STAGING_TABLE = """CREATE TEMPORARY TABLE book_staging (
+        row_number              INT NOT NULL,
+        title                   VARCHAR(255) NOT NULL,
+        authors                 VARCHAR(255)[] NOT NULL,
+        isbn                    VARCHAR(13) NULL,
+        isbn13                  VARCHAR(13) NULL,
+        language_code           VARCHAR(10) NULL,
+        num_pages               INT NULL,
+        stock_quantity          INT NOT NULL,
+        publication_date        DATE NULL,
+        publisher               VARCHAR(255) NULL
+    ) ON COMMIT DROP;"""
+BOOK_STAGING_MERGE = StatementRegistry.register(
+    "book_staging_merge",
+    """WITH inserted AS (
+            INSERT INTO {schema}.book
+            (title, authors, isbn, isbn13, language_code, num_pages, stock_quantity, publication_date, publisher)
+            SELECT title, authors, isbn, isbn13, language_code, num_pages, stock_quantity, publication_date, publisher
+            FROM book_staging
+            ORDER BY row_number
+            ON CONFLICT DO NOTHING
+            RETURNING *
+        ), availability AS (
+            INSERT INTO {schema}.book_availability (book_id, available_quantity)
+            SELECT id, stock_quantity FROM inserted
+        )
+        SELECT DISTINCT ON (i.id) s.row_number, i.id
+        FROM inserted i
+        JOIN book_staging s
+            ON s.title = i.title
+            AND s.authors = i.authors
+            AND s.isbn IS NOT DISTINCT FROM i.isbn
+            AND s.isbn13 IS NOT DISTINCT FROM i.isbn13
+            AND s.language_code IS NOT DISTINCT FROM i.language_code
+            AND s.num_pages IS NOT DISTINCT FROM i.num_pages
+            AND s.stock_quantity = i.stock_quantity
+            AND s.publication_date IS NOT DISTINCT FROM i.publication_date
+            AND s.publisher IS NOT DISTINCT FROM i.publisher
+        ORDER BY i.id, s.row_number;""",
+    prepare_on_init=False,
+)
+BOOK_FIRST_PAGE = StatementRegistry.register(
+    "book_first_page",
+    "SELECT * FROM {schema}.book ORDER BY created_at DESC, id DESC LIMIT $1;",
+)
+BOOK_NEXT_PAGE = StatementRegistry.register(
+    "book_next_page",
+    "SELECT * FROM {schema}.book WHERE (created_at, id) < ($2, $3) "
+    "ORDER BY created_at DESC, id DESC LIMIT $1;",
+)
+BOOK_SEARCH = StatementRegistry.register(
+    "book_search",
+    """WITH q AS (SELECT websearch_to_tsquery('simple', $1) AS tsq)
+        SELECT b.*,
+            ts_rank(to_tsvector('simple', {schema}.book_search_document(title, authors, publisher)), q.tsq)
+                + word_similarity($1, {schema}.book_search_document(title, authors, publisher)) AS rank
+        FROM {schema}.book b, q
+        WHERE to_tsvector('simple', {schema}.book_search_document(title, authors, publisher)) @@ q.tsq
+            OR $1 <% {schema}.book_search_document(title, authors, publisher)
+        ORDER BY rank DESC, b.id
+        LIMIT $2;""",
+)
+BOOK_EXPORT = StatementRegistry.register("book_export", "SELECT * FROM {schema}.book ORDER BY id;")
+BOOK_BY_IDS = StatementRegistry.register(
+    "book_by_ids", "SELECT * FROM {schema}.book WHERE id = ANY($1::int[]);"
+)
+BOOK_AVAILABILITY_INSERT = StatementRegistry.register(
+    "book_availability_insert",
+    "INSERT INTO {schema}.book_availability (book_id, available_quantity) VALUES ($1, $2);",
+)
+BOOK_STOCK_FOR_UPDATE = StatementRegistry.register(
+    "book_stock_for_update", "SELECT stock_quantity FROM {schema}.book WHERE id = $1 FOR UPDATE;"
+)
+BOOK_AVAILABILITY_ADJUST = StatementRegistry.register(
+    "book_availability_adjust",
+    "UPDATE {schema}.book_availability SET available_quantity = available_quantity + $2 WHERE book_id = $1;",
+)
+BOOK_DELETE = StatementRegistry.register(
+    "book_delete", "DELETE FROM {schema}.book WHERE id = $1 RETURNING *;"
+)
+
+
+@instrumented
 class BookService:
     def __init__(self):
         self.pool: Pool = DatabaseConnectionPool.get()
+        self.read_pool: Pool = DatabaseConnectionPool.get(read_only=True)
         self.schema: str = os.environ.get("DB_SCHEMA")
+        self.cache: Cache = CacheRegistry.get("book")
+        self.loader: DataLoader = LoaderRegistry.get("book")
 
     async def create_new_book(self, create_book_input_dict: Dict[str, Any]) -> Book:
         """Creates a new book in the database.
@@ -31,133 +136,251 @@ class BookService:
             book: pydantic model object of the book. See app.models.book.Book for more details.
         """
 
-        keys = [key for key in create_book_input_dict.keys()]
-        key_fields = ", ".join(keys)
-        vals = [f"${x[0]+1}" for x in enumerate(keys)]
-        val_fields = ", ".join(vals)
-
-        logger.info(f"Creating new book: {create_book_input_dict}")
-        query = (
-            f"INSERT INTO {self.schema}.book "
-            f"({key_fields}) "
-            f"VALUES ({val_fields}) RETURNING *;"
-        )
-
-        params = [val for val in create_book_input_dict.values()]
+        logger.info("Creating new book: %s", create_book_input_dict)
+        query, columns = StatementRegistry.insert("book", create_book_input_dict.keys())
+        params = [create_book_input_dict[column] for column in columns]
 
         async with self.pool.acquire() as connection:
             async with connection.transaction():
-                logger.info(
-                    f"Acquired connection and opened transaction to insert new book via query: {query}"
-                )
+                logger.debug("Acquired connection and opened transaction to insert new book via query: %s", query)
                 book_record: Record = await connection.fetchrow(query, *params)
+                await connection.execute(
+                    StatementRegistry.get(BOOK_AVAILABILITY_INSERT),
+                    book_record["id"],
+                    book_record["stock_quantity"],
+                )
 
-        logger.info(
-            f"Book: {create_book_input_dict['title']} successfully inserted in the db"
-        )
+        logger.info("Book: %s successfully inserted in the db", create_book_input_dict['title'])
         return deserialize_records(book_record, Book)
 
-    async def create_new_book_batch(self, create_book_batch_input_dict: List[Dict[str, Any]]) -> Book:
-        """Creates a new book in the database.
+    @staticmethod
+    def validate_book_batch(
+        create_book_batch_input: List[Dict[str, Any]], first_row: int = 0
+    ) -> Tuple[Dict[int, Dict[str, Any]], Dict[int, str]]:
+        """Validates the rows of a bulk ingestion with CreateBookInput.
 
         Args:
-            title: title of the book
-            authors: author(s) of the book
-            isbn: ISBN of the book,
-            isbn13: ISBN13 of the book,
-            lang_code: Language code of the book,
-            num_pages: Number of pages in the book,
-            publication_date: Date of publication,
-            publisher: Publisher of the book
+            create_book_batch_input: books as submitted
+            first_row: row number of the first book, for the books of a chunk of a larger batch
 
         Returns:
-            book: pydantic model object of the book. See app.models.book.Book for more details.
+            books_input: validated books keyed by their row, as taken by create_new_book_batch
+            invalid: validation errors keyed by the row of the invalid books
         """
-        vals = [[val for val in x.values()] for x in create_book_batch_input_dict]
-
-        vals = list((
-            0,
-            x['title'],
-            x['authors'],
-            x['isbn'],
-            x['isbn13'],
-            x['language_code'],
-            x['num_pages'],
-            0,
-            datetime.now(),
-            x['publisher'],
-            datetime.now(),
-            datetime.now()
-        ) for x in create_book_batch_input_dict)
-
-        logger.info(f"Creating new {len(vals)} book(s)")
-        query = f"""INSERT INTO {self.schema}.book 
-        (title, authors, isbn, isbn13, language_code, num_pages, publication_date, publisher)
-        (
-            SELECT r.title, r.authors, r.isbn, r.isbn13, r.language_code, r.num_pages, 
-                    r.publication_date, r.publisher
-            FROM unnest($1::{self.schema}.book[]) as r
-        )
-        ON CONFLICT DO NOTHING
-        RETURNING *;
+
+        books_input: Dict[int, Dict[str, Any]] = {}
+        invalid: Dict[int, str] = {}
+        for row, book_input in enumerate(create_book_batch_input, start=first_row):
+            try:
+                books_input[row] = CreateBookInput.model_validate(book_input).model_dump(exclude_none=True)
+            except ValidationError as e:
+                invalid[row] = "; ".join(f"{'.'.join(map(str, err['loc']))}: {err['msg']}" for err in e.errors())
+        return books_input, invalid
+
+    async def create_new_book_batch(
+        self, create_book_batch_input_dict: Dict[int, Dict[str, Any]], connection: Optional[Connection] = None
+    ) -> Dict[int, int]:
+        """Creates new books in bulk, skipping the ones that are already present.
+
+        The books are streamed with COPY into a temporary staging table and merged into the book table by a
+        single INSERT ... SELECT in the same transaction. Books conflicting with an existing book, or with an
+        earlier book of the same batch, on any unique key are skipped.
+
+        Args:
+            create_book_batch_input_dict: books to create keyed by their row in the request, each with
+                title, authors, isbn, isbn13, language_code, num_pages, stock_quantity, publication_date
+                and publisher
+            connection: connection whose transaction the books are created in, so that they are committed
+                with the other writes of the caller. A connection is acquired from the pool when None.
+
+        Returns:
+            inserted: id of the created book for each inserted row, rows missing from it are duplicates
         """
 
-        async with self.pool.acquire() as connection:
-            async with connection.transaction():
-                logger.info(
-                    f"Acquired connection and opened transaction to insert new book via query: {query}"
+        records = (
+            (
+                row,
+                book["title"],
+                book["authors"],
+                book.get("isbn"),
+                book.get("isbn13"),
+                book.get("language_code"),
+                book.get("num_pages"),
+                book["stock_quantity"],
+                book["publication_date"].date() if book.get("publication_date") else None,
+                book.get("publisher"),
+            )
+            for row, book in create_book_batch_input_dict.items()
+        )
+
+        logger.info("Creating new %s book(s)", len(create_book_batch_input_dict))
+        query = StatementRegistry.get(BOOK_STAGING_MERGE)
+
+        if connection is not None:
+            inserted_records = await self._merge_book_batch(connection, records, query)
+        else:
+            async with self.pool.acquire() as connection:
+                logger.debug(
+                    "Acquired connection and opened transaction to bulk insert books via query: %s", query
                 )
-                book_record: List[Record] = await connection.fetch(query, vals)
+                inserted_records = await self._merge_book_batch(connection, records, query)
 
-        logger.info(
-            f"Book: {len(book_record)} successfully inserted in the db"
-        )
-        return deserialize_records(book_record, Book)
+        logger.info("Book: %s successfully inserted in the db", len(inserted_records))
+        return {record["row_number"]: record["id"] for record in inserted_records}
+
+    @staticmethod
+    async def _merge_book_batch(connection: Connection, records: Iterable[tuple], query: str) -> List[Record]:
+        # A savepoint when the caller already opened a transaction, the staging table is dropped on its commit
+        async with connection.transaction():
+            await connection.execute(BOOK_STAGING_TABLE)
+            await connection.copy_records_to_table("book_staging", records=records, columns=BOOK_STAGING_COLUMNS)
+            await connection.execute("ANALYZE book_staging;")
+            return await connection.fetch(query)
 
+    async def get_all_books(
+        self, limit: int = DEFAULT_PAGE_SIZE, cursor: Optional[str] = None
+    ) -> Page[Book]:
+        """Fetches a page of books from the database, newest first.
 
-    async def get_all_books(self) -> List[Book]:
-        """Fetches all books from the database.
+        Pagination is keyset based on (created_at, id) so every page costs the same irrespective of its depth.
+
+        Args:
+            limit: maximum number of books in the page
+            cursor: opaque cursor returned as next_cursor by the previous page, None for the first page
 
         Returns:
-            books: list of pydantic model objects of the books. See app.models.book.Book for more details.
+            page: page of pydantic model objects of the books. See app.models.book.Book for more details.
+
+        Raises:
+            ValueError: if the cursor is malformed
         """
 
-        query = f"SELECT * FROM {self.schema}.book ORDER BY created_at DESC;"
+        position = decode_cursor(cursor, ("created_at", "id"))
+        params: List[Any] = [limit + 1]
+        query = StatementRegistry.get(BOOK_FIRST_PAGE)
+        if position:
+            query = StatementRegistry.get(BOOK_NEXT_PAGE)
+            params += [position["created_at"], position["id"]]
 
-        async with self.pool.acquire() as connection:
-            logger.info(
-                f"Acquired connection and opened transaction to fetch all books via query: {query}"
-            )
-            books_record: List[Record] = await connection.fetch(query)
+        async with self.read_pool.acquire() as connection:
+            logger.debug("Acquired connection and opened transaction to fetch books via query: %s", query)
+            books_record: List[Record] = await connection.fetch(query, *params)
 
-        logger.info(f"Successfully fetched all books with count: {len(books_record)}")
-        if not books_record:
-            return []
-        return deserialize_records(books_record, Book)
+        logger.info("Successfully fetched books with count: %s", len(books_record))
+        next_cursor = None
+        if len(books_record) > limit:
+            books_record = books_record[:limit]
+            last = books_record[-1]
+            next_cursor = encode_cursor({"created_at": last["created_at"], "id": last["id"]})
+        return Page[Book](items=deserialize_records(books_record, Book), next_cursor=next_cursor)
 
 
-    async def get_book_by_id(self, id: int) -> Book:
-        """Fetches a book with given id from the database.
+    async def search_books(self, search_query: str, limit: int = DEFAULT_PAGE_SIZE) -> List[BookSearchResult]:
+        """Searches books by title, authors and publisher.
+
+        Combines ranked full-text search with trigram word similarity so that partial words and typos
+        still match. Both predicates are served by the GIN indexes on the book search document.
+
+        Args:
+            search_query: free text entered by the user
+            limit: maximum number of books returned
+
+        Returns:
+            books: list of pydantic model objects of the matching books, most relevant first.
+                See app.models.book.BookSearchResult for more details.
+        """
+
+        query = StatementRegistry.get(BOOK_SEARCH)
+
+        async with self.read_pool.acquire() as connection:
+            logger.debug("Acquired connection and opened transaction to search books via query: %s", query)
+            books_record: List[Record] = await connection.fetch(query, search_query, limit)
+
+        logger.info("Found %s books matching: %s", len(books_record), search_query)
+        return deserialize_records(books_record, BookSearchResult)
+
+    def export_books(self, chunk_size: int = EXPORT_CHUNK_SIZE) -> AsyncIterator[List[Record]]:
+        """Streams every book in the database in chunks through a server-side cursor.
+
+        Args:
+            chunk_size: number of books fetched per round trip
+
+        Returns:
+            async iterator over chunks of book records ordered by id
+        """
+
+        query = StatementRegistry.get(BOOK_EXPORT)
+        logger.debug("Streaming all books via query: %s", query)
+        return stream_records(self.read_pool, query, chunk_size=chunk_size)
+
+    async def get_book_by_id(self, id: int, version: Optional[int] = None) -> Book:
+        """Fetches a book with given id, from the cache if present else from the database.
+
+        Lookups of books missing from the cache issued concurrently are fetched with a single query.
 
         Args:
             id:  id of the book
+            version: version of the book table the caller read, the cached book is then only returned if it was
+                loaded at that version. Without it, any cached book is returned.
 
         Returns:
             book: pydantic model object of the book. See app.models.book.Book for more details.
         """
 
-        query = f"SELECT * FROM {self.schema}.book WHERE id = $1;"
-
-        async with self.pool.acquire() as connection:
-            logger.info(
-                f"Acquired connection and opened transaction to fetch book via query: {query}"
-            )
-            book_record: Record = await connection.fetchrow(query, id)
+        cached: Optional[Tuple[Optional[int], Book]] = self.cache.get(id)
+        if cached and (version is None or cached[0] == version):
+            return cached[1]
 
-        if not book_record:
+        # A book loaded before an update or delete of the book finished is not cached
+        generation = self.cache.generation(id)
+        # Lookups only share the loads started at their version, a load started earlier may miss a write
+        book = await self.loader.load((id, version), self._fetch_books)
+        if not book:
             # TODO: handle exceptions in general
             raise Exception(f"Book {id} not found")
-        return deserialize_records(book_record, Book)
+        self.cache.set(id, (version, book), generation)
+        return book
+
+    async def get_books_by_ids(self, ids: List[int], version: Optional[int] = None) -> List[Book]:
+        """Fetches the books with the given ids, from the cache if present else from the database in one query.
+
+        Args:
+            ids: ids of the books
+            version: version of the book table the caller read, see get_book_by_id
+
+        Returns:
+            books: the books found, in the order of their first id in ids. See app.models.book.Book for more details.
+        """
+
+        ids = list(dict.fromkeys(ids))
+        books: Dict[int, Book] = {}
+        for id in ids:
+            cached: Optional[Tuple[Optional[int], Book]] = self.cache.get(id)
+            if cached and (version is None or cached[0] == version):
+                books[id] = cached[1]
+
+        missing: List[int] = [id for id in ids if id not in books]
+        if missing:
+            generations: Dict[int, int] = {id: self.cache.generation(id) for id in missing}
+            fetched: Dict[Tuple[int, Optional[int]], Book] = await self.loader.load_many(
+                [(id, version) for id in missing], self._fetch_books
+            )
+            for (id, _), book in fetched.items():
+                self.cache.set(id, (version, book), generations[id])
+                books[id] = book
+        logger.info("Fetched %s of %s books, %s from the database", len(books), len(ids), len(missing))
+        return [books[id] for id in ids if id in books]
+
+    async def _fetch_books(self, keys: List[Tuple[int, Optional[int]]]) -> Dict[Tuple[int, Optional[int]], Book]:
+        query = StatementRegistry.get(BOOK_BY_IDS)
+        ids: List[int] = list({id for id, _ in keys})
+
+        async with self.pool.acquire() as connection:
+            logger.debug("Acquired connection and opened transaction to fetch %s books via query: %s", len(ids), query)
+            book_records: List[Record] = await connection.fetch(query, ids)
+
+        books: Dict[int, Book] = {book.id: book for book in deserialize_records(book_records, Book)}
+        return {key: books[key[0]] for key in keys if key[0] in books}
 
     async def update_book_by_id(
         self, id: int, update_book_input_dict: Dict[str, Any]
@@ -180,27 +403,26 @@ class BookService:
             book: pydantic model object of the book. See app.models.book.Book for more details.
         """
 
-        logger.info(f"Updating book: {update_book_input_dict}")
+        logger.info("Updating book: %s", update_book_input_dict)
 
-        params: List[Any] = [val for val in update_book_input_dict.values()]
-        key_fields: List[str] = list(
-            map(
-                lambda x: f"{x[1]} = ${x[0] + 2}",
-                enumerate(update_book_input_dict.keys()),
-            )
-        )
-        key_fields.insert(0, "updated_at = NOW()")
-        update_clause: str = ", ".join(key_fields)
-        query = (
-            f"UPDATE {self.schema}.book SET {update_clause} WHERE id = $1 RETURNING *;"
-        )
+        query, columns = StatementRegistry.update("book", update_book_input_dict.keys())
+        params: List[Any] = [update_book_input_dict[column] for column in columns]
 
         async with self.pool.acquire() as connection:
             async with connection.transaction():
-                logger.info(
-                    f"Acquired connection and opened transaction to update book via query: {query}"
-                )
+                logger.debug("Acquired connection and opened transaction to update book via query: %s", query)
+                previous_stock = None
+                if "stock_quantity" in update_book_input_dict:
+                    previous_stock = await connection.fetchval(StatementRegistry.get(BOOK_STOCK_FOR_UPDATE), id)
                 book_record: Record = await connection.fetchrow(query, id, *params)
+                if book_record and previous_stock is not None:
+                    # Copies added or removed from stock change the availability by the same amount
+                    await connection.execute(
+                        StatementRegistry.get(BOOK_AVAILABILITY_ADJUST),
+                        id,
+                        book_record["stock_quantity"] - previous_stock,
+                    )
+        self.cache.invalidate(id)
         if not book_record:
             raise Exception(f"Book {id} not found")
 
@@ -216,14 +438,13 @@ class BookService:
             book: pydantic model object of the book. See app.models.book.Book for more details.
         """
 
-        query = f"DELETE FROM {self.schema}.book WHERE id = $1 RETURNING *;"
+        query = StatementRegistry.get(BOOK_DELETE)
 
         async with self.pool.acquire() as connection:
             async with connection.transaction():
-                logger.info(
-                    f"Acquired connection and opened transaction to delete book via query: {query}"
-                )
+                logger.debug("Acquired connection and opened transaction to delete book via query: %s", query)
                 book_record: Record = await connection.fetchrow(query, id)
+        self.cache.invalidate(id)
         if not book_record:
             raise Exception(f"Book {id} not found")
 
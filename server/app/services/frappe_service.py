@@ -0,0 +1,171 @@
+import asyncio
+from datetime import datetime
+from os import environ
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+import httpx
+from pydantic import ValidationError
+
+from app.models.book import FrappeBook
+from app.utils.logging_utils import logger
+
+
+class FrappeService:
+    page_size: int = 20
+
+    def __init__(self, transport: Optional[httpx.AsyncBaseTransport] = None):
+        self.url: str = environ.get(
+            "FRAPPE_API_URL", "https://frappe.io/api/method/frappe-library"
+        )
+        self.concurrency: int = int(environ.get("FRAPPE_CONCURRENCY", 5))
+        self.timeout: float = float(environ.get("FRAPPE_TIMEOUT", 10))
+        # Replaced by an httpx.MockTransport to run the import offline
+        self.transport: Optional[httpx.AsyncBaseTransport] = transport
+
+    async def fetch_books(self, limit: int, includes: Optional[str] = None) -> List[FrappeBook]:
+        """Imports books from the Frappe library API.
+
+        Pages are fetched concurrently over a pooled async HTTP client, at most FRAPPE_CONCURRENCY at a time
+        and each bounded by FRAPPE_TIMEOUT seconds. Rows are validated into FrappeBook as each page arrives, the
+        invalid ones are skipped. More pages are fetched as long as the pages fetched and in flight may yield
+        fewer than `limit` valid books, until the API runs out of pages. Remaining requests are cancelled as soon
+        as `limit` books are collected or a short page marks the end of the data.
+
+        Args:
+            limit: maximum number of books to import
+            includes: optional filter on the title of the books
+
+        Returns:
+            books: list of pydantic model objects of the books in page order. See app.models.book.FrappeBook.
+
+        Raises:
+            httpx.HTTPError: if a page could not be fetched
+        """
+
+        books, _ = await self._fetch_books(includes, first_page=1, limit=limit)
+        return books[:limit]
+
+    async def fetch_pages(
+        self, first_page: int, n_pages: int, includes: Optional[str] = None
+    ) -> Tuple[List[FrappeBook], bool]:
+        """Fetches the valid books of a run of pages, for imports resuming from a page.
+
+        Args:
+            first_page: first page of the run
+            n_pages: number of pages of the run
+            includes: optional filter on the title of the books
+
+        Returns:
+            books: list of pydantic model objects of the books in page order
+            exhausted: whether the API ran out of pages within the run
+
+        Raises:
+            httpx.HTTPError: if a page could not be fetched
+        """
+
+        return await self._fetch_books(includes, first_page=first_page, max_pages=n_pages)
+
+    async def _fetch_books(
+        self,
+        includes: Optional[str],
+        first_page: int,
+        limit: Optional[int] = None,
+        max_pages: Optional[int] = None,
+    ) -> Tuple[List[FrappeBook], bool]:
+        semaphore = asyncio.Semaphore(self.concurrency)
+        pages: Dict[int, List[FrappeBook]] = {}
+        # Unknown until a short page arrives
+        last_page: Optional[int] = None
+        next_page: int = first_page
+        tasks: Dict[asyncio.Task, int] = {}
+        pending: Set[asyncio.Task] = set()
+
+        def wants_more_pages() -> bool:
+            if last_page is not None and next_page > last_page:
+                return False
+            if max_pages is not None:
+                return next_page < first_page + max_pages
+            expected = sum(len(books) for books in pages.values()) + self.page_size * len(pending)
+            return expected < limit
+
+        async with httpx.AsyncClient(
+            timeout=self.timeout,
+            limits=httpx.Limits(max_connections=self.concurrency),
+            transport=self.transport,
+        ) as client:
+            try:
+                while True:
+                    while wants_more_pages():
+                        task = asyncio.create_task(self._fetch_page(client, semaphore, next_page, includes))
+                        tasks[task] = next_page
+                        pending.add(task)
+                        next_page += 1
+                    if not pending:
+                        break
+
+                    done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                    for task in done:
+                        page, books, n_rows = task.result()
+                        pages[page] = books
+                        if n_rows < self.page_size:
+                            last_page = page if last_page is None else min(last_page, page)
+
+                    if limit is not None and self._count_contiguous(pages, first_page, last_page) >= limit:
+                        break
+                    if last_page is not None:
+                        for task in [t for t in pending if tasks[t] > last_page]:
+                            task.cancel()
+                            pending.discard(task)
+            finally:
+                for task in pending:
+                    task.cancel()
+                await asyncio.gather(*pending, return_exceptions=True)
+
+        books: List[FrappeBook] = []
+        page = first_page
+        while page in pages and (last_page is None or page <= last_page):
+            books += pages[page]
+            page += 1
+        logger.info("Fetched %s books from %s page(s) of the Frappe API", len(books), len(pages))
+        return books, last_page is not None
+
+    async def _fetch_page(
+        self,
+        client: httpx.AsyncClient,
+        semaphore: asyncio.Semaphore,
+        page: int,
+        includes: Optional[str],
+    ) -> Tuple[int, List[FrappeBook], int]:
+        params: Dict[str, Any] = {"page": page}
+        if includes:
+            params["title"] = includes
+
+        async with semaphore:
+            logger.info("Fetching from Frappe API with the following params: %s", params)
+            response = await client.get(self.url, params=params)
+        response.raise_for_status()
+
+        rows: List[dict] = response.json()["message"]
+        return page, self._parse_books(rows), len(rows)
+
+    @staticmethod
+    def _parse_books(rows: List[dict]) -> List[FrappeBook]:
+        books: List[FrappeBook] = []
+        for row in rows:
+            try:
+                item = {k.strip(): v for k, v in row.items() if k.strip() in FrappeBook.model_fields}
+                item["publication_date"] = datetime.strptime(item["publication_date"], "%m/%d/%Y").date()
+                item["authors"] = item["authors"].split("/")
+                books.append(FrappeBook(**item))
+            except (KeyError, ValueError, AttributeError, ValidationError) as e:
+                logger.warning("Skipping invalid Frappe row: %s - %s", row.get('bookID'), e)
+        return books
+
+    @staticmethod
+    def _count_contiguous(pages: Dict[int, List[FrappeBook]], first_page: int, last_page: Optional[int]) -> int:
+        count = 0
+        page = first_page
+        while page in pages and (last_page is None or page <= last_page):
+            count += len(pages[page])
+            page += 1
+        return count
@@ -0,0 +1,226 @@
+import os
+from typing import Any, Dict, List, Optional
+
+from app.database import DatabaseConnectionPool
+from app.entities.job import JobKind, JobStatus
+from app.models.job import Job
+from app.utils.deserialization_utils import deserialize_records
+from app.utils.logging_utils import logger
+from app.utils.metrics_utils import instrumented
+from app.utils.statement_utils import StatementRegistry
+from asyncpg import Connection, Pool, Record
+
+# Every column but input, which can be large and is only read by the worker running the job
+JOB_COLUMNS = (
+    "id, kind, status, params, total, progress, counts, errors, error, cancel_requested, attempts, "
+    "created_at, updated_at, started_at, finished_at"
+)
+
+JOB_INSERT = StatementRegistry.register(
+    "job_insert",
+    f"""INSERT INTO {{schema}}.job (kind, params, input, total) VALUES ($1, $2, $3, $4)
+        RETURNING {JOB_COLUMNS};""",
+)
+JOB_BY_ID = StatementRegistry.register("job_by_id", f"SELECT {JOB_COLUMNS} FROM {{schema}}.job WHERE id = $1;")
+JOB_INPUT = StatementRegistry.register("job_input", "SELECT input FROM {schema}.job WHERE id = $1;")
+# A queued job is cancelled right away, a running one by its worker
+JOB_CANCEL = StatementRegistry.register(
+    "job_cancel",
+    f"""UPDATE {{schema}}.job
+        SET cancel_requested = TRUE,
+            status = CASE WHEN status = 'QUEUED' THEN 'CANCELLED' ELSE status END,
+            input = CASE WHEN status = 'QUEUED' THEN NULL ELSE input END,
+            finished_at = CASE WHEN status = 'QUEUED' THEN NOW() ELSE finished_at END,
+            updated_at = NOW()
+        WHERE id = $1 AND status IN ('QUEUED', 'RUNNING')
+        RETURNING {JOB_COLUMNS};""",
+)
+# The oldest queued job, or running job whose worker stopped renewing its lease
+JOB_CLAIM = StatementRegistry.register(
+    "job_claim",
+    f"""UPDATE {{schema}}.job
+        SET status = 'RUNNING', attempts = attempts + 1, heartbeat_at = NOW(),
+            started_at = COALESCE(started_at, NOW()), updated_at = NOW()
+        WHERE id = (
+            SELECT id FROM {{schema}}.job
+            WHERE status = 'QUEUED'
+                OR (status = 'RUNNING' AND heartbeat_at < NOW() - make_interval(secs => $1))
+            ORDER BY id
+            LIMIT 1
+            FOR UPDATE SKIP LOCKED
+        )
+        RETURNING {JOB_COLUMNS};""",
+)
+# The attempts of a job identify the worker holding its lease, a job claimed again after its lease expired is
+# no longer written to by the previous worker
+JOB_RENEW_LEASES = StatementRegistry.register(
+    "job_renew_leases",
+    """UPDATE {schema}.job j
+        SET heartbeat_at = NOW()
+        FROM unnest($1::int[], $2::int[]) AS l(id, attempts)
+        WHERE j.id = l.id AND j.attempts = l.attempts AND j.status = 'RUNNING'
+        RETURNING j.id, j.cancel_requested;""",
+)
+JOB_CHECKPOINT = StatementRegistry.register(
+    "job_checkpoint",
+    """UPDATE {schema}.job
+        SET progress = $3, counts = $4, errors = $5, heartbeat_at = NOW(), updated_at = NOW()
+        WHERE id = $1 AND attempts = $2 AND status = 'RUNNING'
+        RETURNING id;""",
+)
+JOB_FINISH = StatementRegistry.register(
+    "job_finish",
+    """UPDATE {schema}.job
+        SET status = $3, error = $4, input = NULL, heartbeat_at = NULL, finished_at = NOW(), updated_at = NOW()
+        WHERE id = $1 AND attempts = $2 AND status = 'RUNNING';""",
+)
+# A job interrupted by a graceful stop is resumed without counting the attempt
+JOB_REQUEUE = StatementRegistry.register(
+    "job_requeue",
+    """UPDATE {schema}.job
+        SET status = 'QUEUED', attempts = attempts - 1, heartbeat_at = NULL, updated_at = NOW()
+        WHERE id = $1 AND attempts = $2 AND status = 'RUNNING';""",
+)
+
+
+class JobLeaseLost(Exception):
+    """The job was claimed by another worker after the lease of its worker expired."""
+
+
+@instrumented
+class JobService:
+    def __init__(self):
+        self.pool: Pool = DatabaseConnectionPool.get()
+        self.read_pool: Pool = DatabaseConnectionPool.get(read_only=True)
+        self.schema: str = os.environ.get("DB_SCHEMA")
+
+    async def submit_job(
+        self,
+        kind: JobKind,
+        params: Dict[str, Any],
+        input: Optional[List[Any]] = None,
+        total: Optional[int] = None,
+    ) -> Job:
+        """Queues a new background job, run by the first worker available.
+
+        Args:
+            kind: kind of the job, selecting the handler running it
+            params: parameters of the handler
+            input: items processed by the job, stored with it until it is finished
+            total: number of items to process, if known
+
+        Returns:
+            job: pydantic model object of the queued job. See app.models.job.Job for more details.
+        """
+
+        query = StatementRegistry.get(JOB_INSERT)
+
+        async with self.pool.acquire() as connection:
+            logger.debug("Acquired connection and opened transaction to insert new job via query: %s", query)
+            job_record: Record = await connection.fetchrow(query, kind.value, params, input, total)
+
+        logger.info("Queued %s job %s", kind.value, job_record["id"])
+        return deserialize_records(job_record, Job)
+
+    async def get_job(self, id: int) -> Optional[Job]:
+        """Fetches a job with its progress, counts and errors, None if there is none with the given id."""
+
+        query = StatementRegistry.get(JOB_BY_ID)
+
+        async with self.read_pool.acquire() as connection:
+            logger.debug("Acquired connection and opened transaction to fetch job via query: %s", query)
+            job_record: Optional[Record] = await connection.fetchrow(query, id)
+        return deserialize_records(job_record, Job) if job_record else None
+
+    async def get_job_input(self, job: Job) -> List[Any]:
+        """Fetches the items submitted with a job, empty once the job is finished."""
+
+        query = StatementRegistry.get(JOB_INPUT)
+
+        async with self.pool.acquire() as connection:
+            logger.debug("Acquired connection and opened transaction to fetch job input via query: %s", query)
+            job_input: Optional[List[Any]] = await connection.fetchval(query, job.id)
+        return job_input or []
+
+    async def cancel_job(self, id: int) -> Optional[Job]:
+        """Cancels a job. A queued job is cancelled right away, a running one stops at the latest after the next
+        lease renewal of its worker and keeps the chunks already committed. A finished job is left unchanged.
+
+        Returns:
+            job: pydantic model object of the job, None if there is none with the given id
+        """
+
+        query = StatementRegistry.get(JOB_CANCEL)
+
+        async with self.pool.acquire() as connection:
+            logger.debug("Acquired connection and opened transaction to cancel job via query: %s", query)
+            job_record: Optional[Record] = await connection.fetchrow(query, id)
+            if not job_record:
+                job_record = await connection.fetchrow(StatementRegistry.get(JOB_BY_ID), id)
+        return deserialize_records(job_record, Job) if job_record else None
+
+    async def claim_job(self, lease_timeout: float) -> Optional[Job]:
+        """Marks the next job to run as RUNNING and returns it, None if no job is waiting.
+
+        A RUNNING job whose lease was not renewed for lease_timeout seconds, its worker having stopped, is claimed
+        again and resumes from its progress.
+        """
+
+        query = StatementRegistry.get(JOB_CLAIM)
+
+        async with self.pool.acquire() as connection:
+            logger.debug("Acquired connection and opened transaction to claim a job via query: %s", query)
+            job_record: Optional[Record] = await connection.fetchrow(query, lease_timeout)
+        return deserialize_records(job_record, Job) if job_record else None
+
+    async def renew_leases(self, jobs: List[Job]) -> Dict[int, bool]:
+        """Renews the leases of the jobs run by this process.
+
+        Returns:
+            cancel_requested: whether each job still leased was asked to stop, by id
+        """
+
+        query = StatementRegistry.get(JOB_RENEW_LEASES)
+
+        async with self.pool.acquire() as connection:
+            logger.debug("Acquired connection and opened transaction to renew job leases via query: %s", query)
+            records: List[Record] = await connection.fetch(
+                query, [job.id for job in jobs], [job.attempts for job in jobs]
+            )
+        return {record["id"]: record["cancel_requested"] for record in records}
+
+    async def checkpoint(self, connection: Connection, job: Job):
+        """Saves the progress, counts and errors of a job in the transaction of the connection.
+
+        Committed with the writes of the chunk it follows, a job resuming after a restart starts from the first
+        chunk not committed.
+
+        Raises:
+            JobLeaseLost: if the job was claimed by another worker, the transaction must be rolled back
+        """
+
+        query = StatementRegistry.get(JOB_CHECKPOINT)
+        logger.debug("Saving progress %s of job %s via query: %s", job.progress, job.id, query)
+        updated = await connection.fetchval(query, job.id, job.attempts, job.progress, job.counts, job.errors)
+        if updated is None:
+            raise JobLeaseLost(f"Job {job.id} was claimed by another worker")
+
+    async def finish_job(self, job: Job, status: JobStatus, error: Optional[str] = None):
+        """Records the outcome of a job and drops its input."""
+
+        query = StatementRegistry.get(JOB_FINISH)
+
+        async with self.pool.acquire() as connection:
+            logger.debug("Acquired connection and opened transaction to finish job via query: %s", query)
+            await connection.execute(query, job.id, job.attempts, status.value, error)
+        logger.info("Job %s %s after processing %s item(s)", job.id, status.value.lower(), job.progress)
+
+    async def requeue_job(self, job: Job):
+        """Returns a job interrupted by the shutdown of its worker to the queue, resumed from its progress."""
+
+        query = StatementRegistry.get(JOB_REQUEUE)
+
+        async with self.pool.acquire() as connection:
+            logger.debug("Acquired connection and opened transaction to requeue job via query: %s", query)
+            await connection.execute(query, job.id, job.attempts)
+        logger.info("Job %s requeued at progress %s", job.id, job.progress)
@@ -0,0 +1,125 @@
+import asyncio
+import os
+from typing import Dict, Iterable
+
+from app.database import DatabaseConnectionPool
+from app.models.table_version import TableVersion
+from app.utils.deserialization_utils import deserialize_records
+from app.utils.logging_utils import logger
+from app.utils.statement_utils import StatementRegistry
+from asyncpg import Pool, Record
+
+
+def table_version_query(condition: str) -> str:
+    # The version of a table is the version of its row plus its changes not yet compacted, read in one snapshot
+    # so that a concurrent compaction is seen either entirely or not at all
+    return f"""SELECT
+            v.table_name,
+            v.version + COUNT(c.table_name) AS version,
+            GREATEST(v.updated_at, MAX(c.changed_at)) AS updated_at
+        FROM {{schema}}.table_version v
+        LEFT JOIN {{schema}}.table_version_change c ON c.table_name = v.table_name
+        WHERE {condition}
+        GROUP BY v.table_name, v.version, v.updated_at;"""
+
+
+TABLE_VERSION_BY_NAME = StatementRegistry.register(
+    "table_version_by_name", table_version_query("v.table_name = $1")
+)
+TABLE_VERSION_BY_NAMES = StatementRegistry.register(
+    "table_version_by_names", table_version_query("v.table_name = ANY($1::text[])")
+)
+# Changes inserted after the statement started are left for the next compaction
+TABLE_VERSION_COMPACT = StatementRegistry.register(
+    "table_version_compact",
+    """WITH compacted AS (
+            DELETE FROM {schema}.table_version_change RETURNING table_name, changed_at
+        )
+        UPDATE {schema}.table_version v
+        SET version = v.version + c.changes, updated_at = GREATEST(v.updated_at, c.changed_at)
+        FROM (
+            SELECT table_name, COUNT(*) AS changes, MAX(changed_at) AS changed_at
+            FROM compacted
+            GROUP BY table_name
+        ) c
+        WHERE v.table_name = c.table_name
+        RETURNING c.changes;""",
+)
+
+
+class TableVersionService:
+    def __init__(self):
+        self.pool: Pool = DatabaseConnectionPool.get()
+        self.read_pool: Pool = DatabaseConnectionPool.get(read_only=True)
+        self.schema: str = os.environ.get("DB_SCHEMA")
+
+    async def get_table_version(self, table_name: str) -> TableVersion:
+        """Fetches the version of a table, counting a change recorded by a trigger on every statement writing to it.
+
+        Args:
+            table_name: name of the table, one of book, user and transaction
+
+        Returns:
+            version: pydantic model object of the version. See app.models.table_version.TableVersion for more details.
+        """
+
+        query = StatementRegistry.get(TABLE_VERSION_BY_NAME)
+
+        async with self.read_pool.acquire() as connection:
+            logger.debug("Acquired connection and opened transaction to fetch table version via query: %s", query)
+            version_record: Record = await connection.fetchrow(query, table_name)
+        if not version_record:
+            raise Exception(f"Version of table {table_name} not found")
+        return deserialize_records(version_record, TableVersion)
+
+    async def get_table_versions(self, table_names: Iterable[str]) -> Dict[str, TableVersion]:
+        """Fetches the versions of several tables with a single query, for responses read from all of them.
+
+        Args:
+            table_names: names of the tables, among book, user and transaction
+
+        Returns:
+            versions: pydantic model objects of the versions by table name
+        """
+
+        table_names = list(table_names)
+        query = StatementRegistry.get(TABLE_VERSION_BY_NAMES)
+
+        async with self.read_pool.acquire() as connection:
+            logger.debug("Acquired connection and opened transaction to fetch table versions via query: %s", query)
+            version_records = await connection.fetch(query, table_names)
+        versions: Dict[str, TableVersion] = {
+            version.table_name: version for version in deserialize_records(version_records, TableVersion)
+        }
+        missing = [table_name for table_name in table_names if table_name not in versions]
+        if missing:
+            raise Exception(f"Version of tables {missing} not found")
+        return versions
+
+    async def compact_table_versions(self) -> int:
+        """Folds the changes recorded since the last compaction into the version rows of their tables.
+
+        Only the compaction updates the version rows, the writes to the tables just insert their change, so the
+        count read by get_table_version stays short without serializing the writers on a row lock.
+
+        Returns:
+            number of changes compacted
+        """
+
+        query = StatementRegistry.get(TABLE_VERSION_COMPACT)
+
+        async with self.pool.acquire() as connection:
+            logger.debug("Acquired connection and opened transaction to compact table versions via query: %s", query)
+            compacted = await connection.fetch(query)
+        return sum(record["changes"] for record in compacted)
+
+    @classmethod
+    async def compact_periodically(cls):
+        interval = float(os.environ.get("TABLE_VERSION_COMPACT_INTERVAL", 5))
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                changes = await cls().compact_table_versions()
+                logger.debug("Compacted %s table version change(s)", changes)
+            except Exception:
+                logger.exception("Error while compacting table versions")
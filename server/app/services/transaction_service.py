@@ -1,145 +1,570 @@
+import asyncio
+import itertools
 import os
+from typing import AsyncIterator, Dict, FrozenSet, List, Optional, Tuple, Union
 
 from app.database import DatabaseConnectionPool
-from app.entities.transctions import TransactionStatus
-from app.models.transactions import Transactions
+from app.entities.transctions import CheckoutStatus, StatusChangeOutcome, TransactionExpansion, TransactionStatus
+from app.models.page import Page
+from app.models.transactions import (
+    CheckoutResult,
+    ExpandedTransaction,
+    StatusChangeResult,
+    TransactionBook,
+    Transactions,
+    TransactionUser,
+)
 from app.utils.deserialization_utils import deserialize_records
+from app.utils.export_utils import EXPORT_CHUNK_SIZE, stream_records
 from app.utils.logging_utils import logger
-from asyncpg import Pool
+from app.utils.metrics_utils import instrumented
+from app.utils.pagination_utils import DEFAULT_PAGE_SIZE, decode_cursor, encode_cursor
+from app.utils.statement_utils import StatementRegistry
+from asyncpg import Pool, Record
+
+PENDING: str = TransactionStatus.PENDING.value
+# Loan start dates are summed in the dues ledger as days since the epoch
+EPOCH_DAY: str = "DATE '1970-01-01'"
+TODAY: str = f"(CURRENT_DATE - {EPOCH_DAY})"
+
+TRANSACTION_USER_CHARGE = StatementRegistry.register(
+    "transaction_user_charge",
+    f"""SELECT (open_loans * {TODAY} - loan_start_day_sum) * $1 AS total_due
+        FROM {{schema}}.user_dues
+        WHERE user_id = $2;""",
+)
+TRANSACTION_CHECKOUT = StatementRegistry.register(
+    "transaction_checkout",
+    f"""WITH borrower AS (
+            SELECT id FROM {{schema}}.user WHERE id = $2 FOR UPDATE
+        ), stock AS (
+            SELECT available_quantity FROM {{schema}}.book_availability
+            WHERE book_id = $1
+            AND EXISTS (SELECT 1 FROM borrower)
+            FOR UPDATE
+        ), charge AS (
+            SELECT COALESCE(MAX(open_loans * {TODAY} - loan_start_day_sum), 0) * $3 AS due
+            FROM {{schema}}.user_dues
+            WHERE user_id = $2
+        ), inserted AS (
+            INSERT INTO {{schema}}.transaction (book_id, user_id, status)
+            SELECT $1, borrower.id, '{PENDING}'
+            FROM borrower, stock, charge
+            WHERE stock.available_quantity > 0
+            AND charge.due < $4
+            RETURNING *
+        ), availability AS (
+            UPDATE {{schema}}.book_availability
+            SET available_quantity = available_quantity - 1
+            WHERE book_id = (SELECT book_id FROM inserted)
+        ), dues AS (
+            INSERT INTO {{schema}}.user_dues AS d (user_id, open_loans, loan_start_day_sum)
+            SELECT user_id, 1, DATE(created_at) - {EPOCH_DAY} FROM inserted
+            ON CONFLICT (user_id) DO UPDATE
+            SET open_loans = d.open_loans + EXCLUDED.open_loans,
+                loan_start_day_sum = d.loan_start_day_sum + EXCLUDED.loan_start_day_sum
+        )
+        SELECT
+            EXISTS (SELECT 1 FROM borrower) AS user_exists,
+            (SELECT available_quantity FROM stock) AS available_quantity,
+            (SELECT due FROM charge) AS due,
+            inserted.*
+        FROM (SELECT 1) AS result
+        LEFT JOIN inserted ON TRUE;""",
+)
+# Copies requested more than once are lent while the running count of the book stays within its availability.
+# Transactions of the same book are interchangeable, so inserted rows are matched back to the requested
+# positions by their rank within the book.
+TRANSACTION_CHECKOUT_BATCH = StatementRegistry.register(
+    "transaction_checkout_batch",
+    f"""WITH borrower AS (
+            SELECT id FROM {{schema}}.user WHERE id = $2 FOR UPDATE
+        ), requested AS (
+            SELECT
+                book_id,
+                position,
+                ROW_NUMBER() OVER (PARTITION BY book_id ORDER BY position) AS copy
+            FROM unnest($1::int[]) WITH ORDINALITY AS r(book_id, position)
+        ), stock AS (
+            SELECT book_id, available_quantity FROM {{schema}}.book_availability
+            WHERE book_id = ANY($1::int[])
+            AND EXISTS (SELECT 1 FROM borrower)
+            ORDER BY book_id
+            FOR UPDATE
+        ), charge AS (
+            SELECT COALESCE(MAX(open_loans * {TODAY} - loan_start_day_sum), 0) * $3 AS due
+            FROM {{schema}}.user_dues
+            WHERE user_id = $2
+        ), inserted AS (
+            INSERT INTO {{schema}}.transaction (book_id, user_id, status)
+            SELECT r.book_id, borrower.id, '{PENDING}'
+            FROM requested r
+            JOIN stock s ON s.book_id = r.book_id
+            CROSS JOIN borrower
+            CROSS JOIN charge
+            WHERE r.copy <= s.available_quantity
+            AND charge.due < $4
+            ORDER BY r.position
+            RETURNING *
+        ), availability AS (
+            UPDATE {{schema}}.book_availability a
+            SET available_quantity = a.available_quantity - lent.copies
+            FROM (SELECT book_id, COUNT(*) AS copies FROM inserted GROUP BY book_id) lent
+            WHERE a.book_id = lent.book_id
+        ), dues AS (
+            INSERT INTO {{schema}}.user_dues AS d (user_id, open_loans, loan_start_day_sum)
+            SELECT $2, COUNT(*), SUM(DATE(created_at) - {EPOCH_DAY}) FROM inserted
+            HAVING COUNT(*) > 0
+            ON CONFLICT (user_id) DO UPDATE
+            SET open_loans = d.open_loans + EXCLUDED.open_loans,
+                loan_start_day_sum = d.loan_start_day_sum + EXCLUDED.loan_start_day_sum
+        )
+        SELECT
+            r.book_id,
+            r.copy,
+            EXISTS (SELECT 1 FROM borrower) AS user_exists,
+            s.available_quantity,
+            (SELECT due FROM charge) AS due,
+            i.id,
+            i.user_id,
+            i.status,
+            i.created_at,
+            i.updated_at
+        FROM requested r
+        LEFT JOIN stock s ON s.book_id = r.book_id
+        LEFT JOIN (
+            SELECT *, ROW_NUMBER() OVER (PARTITION BY book_id ORDER BY id) AS copy FROM inserted
+        ) i ON i.book_id = r.book_id AND i.copy = r.copy
+        ORDER BY r.position;""",
+)
+TRANSACTION_PAGE = StatementRegistry.register(
+    "transaction_page",
+    "SELECT * FROM {schema}.transaction WHERE id > $1 ORDER BY id LIMIT $2;",
+)
+TRANSACTION_EXPORT = StatementRegistry.register(
+    "transaction_export", "SELECT * FROM {schema}.transaction ORDER BY id;"
+)
+TRANSACTION_BY_ID = StatementRegistry.register(
+    "transaction_by_id", "SELECT * FROM {schema}.transaction WHERE id = $1;"
+)
+TRANSACTION_UPDATE_STATUS = StatementRegistry.register(
+    "transaction_update_status",
+    f"""WITH previous AS (
+            SELECT id, status FROM {{schema}}.transaction WHERE id = $2 FOR UPDATE
+        ), updated AS (
+            UPDATE {{schema}}.transaction t
+            SET status = $1, updated_at = NOW()
+            FROM previous p
+            WHERE t.id = p.id
+            RETURNING t.*, p.status AS previous_status
+        ), availability AS (
+            UPDATE {{schema}}.book_availability a
+            SET available_quantity = available_quantity + CASE
+                WHEN u.previous_status = '{PENDING}' AND u.status <> '{PENDING}' THEN 1
+                WHEN u.previous_status <> '{PENDING}' AND u.status = '{PENDING}' THEN -1
+                ELSE 0
+            END
+            FROM updated u
+            WHERE a.book_id = u.book_id
+        ), opened_dues AS (
+            INSERT INTO {{schema}}.user_dues AS d (user_id, open_loans, loan_start_day_sum)
+            SELECT u.user_id, 1, DATE(u.created_at) - {EPOCH_DAY}
+            FROM updated u
+            WHERE u.previous_status <> '{PENDING}' AND u.status = '{PENDING}'
+            ON CONFLICT (user_id) DO UPDATE
+            SET open_loans = d.open_loans + EXCLUDED.open_loans,
+                loan_start_day_sum = d.loan_start_day_sum + EXCLUDED.loan_start_day_sum
+        ), closed_dues AS (
+            UPDATE {{schema}}.user_dues d
+            SET open_loans = GREATEST(d.open_loans - 1, 0),
+                loan_start_day_sum = GREATEST(d.loan_start_day_sum - (DATE(u.created_at) - {EPOCH_DAY}), 0)
+            FROM updated u
+            WHERE d.user_id = u.user_id
+            AND u.previous_status = '{PENDING}' AND u.status <> '{PENDING}'
+        )
+        SELECT * FROM updated;""",
+)
+# Transactions are requested by id or by (user_id, book_id). An id requested more than once is reported once, at
+# its first position. The n-th request of a pair resolves to the n-th transaction of the pair not requested by id,
+# those not yet in the target status first. Transaction rows are locked in (book_id, id) order, then availability
+# rows in book_id order, and dues rows are upserted or locked in user_id order so concurrent batches cannot
+# deadlock. Returns of a user without dues leave no row, the dues never go negative.
+TRANSACTION_UPDATE_STATUS_BATCH = StatementRegistry.register(
+    "transaction_update_status_batch",
+    f"""WITH requested_loans AS (
+            SELECT
+                user_id,
+                book_id,
+                position,
+                ROW_NUMBER() OVER (PARTITION BY user_id, book_id ORDER BY position) AS copy
+            FROM unnest($3::int[], $4::int[]) WITH ORDINALITY AS l(user_id, book_id, position)
+        ), loan_candidates AS (
+            SELECT
+                t.id,
+                t.user_id,
+                t.book_id,
+                ROW_NUMBER() OVER (PARTITION BY t.user_id, t.book_id ORDER BY t.status = $1, t.id) AS copy
+            FROM {{schema}}.transaction t
+            WHERE (t.user_id, t.book_id) IN (SELECT user_id, book_id FROM requested_loans)
+            AND t.id <> ALL($2::int[])
+        ), requested AS (
+            SELECT position, id AS transaction_id, NULL::int AS user_id, NULL::int AS book_id
+            FROM (
+                SELECT DISTINCT ON (id) id, position
+                FROM unnest($2::int[]) WITH ORDINALITY AS r(id, position)
+                ORDER BY id, position
+            ) r
+            UNION ALL
+            SELECT cardinality($2::int[]) + l.position, c.id, l.user_id, l.book_id
+            FROM requested_loans l
+            LEFT JOIN loan_candidates c
+            ON c.user_id = l.user_id AND c.book_id = l.book_id AND c.copy = l.copy
+        ), previous AS (
+            SELECT t.*
+            FROM {{schema}}.transaction t
+            WHERE t.id = ANY(ARRAY(SELECT transaction_id FROM requested WHERE transaction_id IS NOT NULL))
+            ORDER BY t.book_id, t.id
+            FOR UPDATE
+        ), locked_availability AS (
+            SELECT a.book_id
+            FROM {{schema}}.book_availability a
+            WHERE a.book_id IN (SELECT book_id FROM previous)
+            ORDER BY a.book_id
+            FOR UPDATE
+        ), updated AS (
+            UPDATE {{schema}}.transaction t
+            SET status = $1, updated_at = NOW()
+            FROM previous p
+            WHERE t.id = p.id
+            AND p.status <> $1
+            RETURNING t.*, p.status AS previous_status
+        ), changed AS (
+            SELECT
+                user_id,
+                book_id,
+                created_at,
+                CASE WHEN status = '{PENDING}' THEN 1 ELSE -1 END AS loans
+            FROM updated
+            WHERE (previous_status = '{PENDING}') <> (status = '{PENDING}')
+        ), availability AS (
+            UPDATE {{schema}}.book_availability a
+            SET available_quantity = a.available_quantity - c.loans
+            FROM (SELECT book_id, SUM(loans) AS loans FROM changed GROUP BY book_id) c
+            JOIN locked_availability l ON l.book_id = c.book_id
+            WHERE a.book_id = c.book_id
+        ), user_changes AS (
+            SELECT user_id, SUM(loans) AS loans, SUM(loans * (DATE(created_at) - {EPOCH_DAY})) AS day_sum
+            FROM changed
+            GROUP BY user_id
+        ), opened_dues AS (
+            INSERT INTO {{schema}}.user_dues AS d (user_id, open_loans, loan_start_day_sum)
+            SELECT user_id, loans, day_sum
+            FROM user_changes
+            WHERE loans > 0
+            ORDER BY user_id
+            ON CONFLICT (user_id) DO UPDATE
+            SET open_loans = d.open_loans + EXCLUDED.open_loans,
+                loan_start_day_sum = d.loan_start_day_sum + EXCLUDED.loan_start_day_sum
+        ), closing_dues AS (
+            SELECT d.user_id
+            FROM {{schema}}.user_dues d
+            WHERE d.user_id IN (SELECT user_id FROM user_changes WHERE loans < 0)
+            ORDER BY d.user_id
+            FOR UPDATE
+        ), closed_dues AS (
+            UPDATE {{schema}}.user_dues d
+            SET open_loans = GREATEST(d.open_loans + c.loans, 0),
+                loan_start_day_sum = GREATEST(d.loan_start_day_sum + c.day_sum, 0)
+            FROM user_changes c
+            JOIN closing_dues l ON l.user_id = c.user_id
+            WHERE d.user_id = c.user_id
+        )
+        SELECT
+            r.transaction_id AS requested_id,
+            r.user_id AS requested_user_id,
+            r.book_id AS requested_book_id,
+            u.id IS NOT NULL AS is_updated,
+            COALESCE(u.id, p.id) AS id,
+            COALESCE(u.user_id, p.user_id) AS user_id,
+            COALESCE(u.book_id, p.book_id) AS book_id,
+            COALESCE(u.status, p.status) AS status,
+            COALESCE(u.created_at, p.created_at) AS created_at,
+            COALESCE(u.updated_at, p.updated_at) AS updated_at
+        FROM requested r
+        LEFT JOIN previous p ON p.id = r.transaction_id
+        LEFT JOIN updated u ON u.id = r.transaction_id
+        ORDER BY r.position;""",
+)
+TRANSACTION_FOR_USER = StatementRegistry.register(
+    "transaction_for_user", "SELECT * FROM {schema}.transaction WHERE user_id = $1;"
+)
+TRANSACTION_FOR_BOOK = StatementRegistry.register(
+    "transaction_for_book", "SELECT * FROM {schema}.transaction WHERE book_id = $1;"
+)
+# Serializes the app processes creating the partitions, creating one waits for the lock of transaction at most
+# the given timeout instead of queueing the checkouts and returns behind it
+TRANSACTION_PARTITIONS_LOCK = StatementRegistry.register(
+    "transaction_partitions_lock",
+    "SELECT pg_advisory_xact_lock(hashtext('transaction_partitions')), set_config('lock_timeout', $1, true);",
+)
+TRANSACTION_CREATE_PARTITIONS = StatementRegistry.register(
+    "transaction_create_partitions",
+    """SELECT {schema}.create_transaction_partitions(
+        CURRENT_DATE, (CURRENT_DATE + make_interval(months => $1))::DATE
+    );""",
+)
+
+# Table alias, model and columns of the rows embedded in the transactions by each expansion. Only these columns
+# are read, selected as <expansion>_<column>.
+EXPANSIONS: Dict[TransactionExpansion, Tuple[str, type, Tuple[str, ...]]] = {
+    TransactionExpansion.BOOK: ("b", TransactionBook, ("title", "authors", "isbn", "isbn13")),
+    TransactionExpansion.USER: ("u", TransactionUser, ("name", "email")),
+}
+
+
+def register_expanded(name: str, clauses: str) -> Dict[FrozenSet[TransactionExpansion], str]:
+    """Registers the statement selecting the transactions matching the clauses for every combination of expansions.
+
+    Each one joins the tables of its expansions to the transactions, so they are read in a single query.
+
+    Args:
+        name: name of the statement without expansions
+        clauses: WHERE, ORDER BY and LIMIT clauses of the statement, the transaction table is aliased t
+
+    Returns:
+        names of the registered statements by set of expansions
+    """
+
+    statements: Dict[FrozenSet[TransactionExpansion], str] = {}
+    for size in range(1, len(EXPANSIONS) + 1):
+        for expansions in itertools.combinations(EXPANSIONS, size):
+            columns = ", ".join(
+                f"{EXPANSIONS[expansion][0]}.{column} AS {expansion.value}_{column}"
+                for expansion in expansions
+                for column in EXPANSIONS[expansion][2]
+            )
+            joins = " ".join(
+                f"JOIN {{schema}}.{expansion.value} {EXPANSIONS[expansion][0]} "
+                f"ON {EXPANSIONS[expansion][0]}.id = t.{expansion.value}_id"
+                for expansion in expansions
+            )
+            statements[frozenset(expansions)] = StatementRegistry.register(
+                f"{name}_with_{'_'.join(expansion.value for expansion in expansions)}",
+                f"SELECT t.*, {columns} FROM {{schema}}.transaction t {joins} {clauses};",
+            )
+    return statements
+
+
+TRANSACTION_PAGE_EXPANDED = register_expanded("transaction_page", "WHERE t.id > $1 ORDER BY t.id LIMIT $2")
+TRANSACTION_FOR_USER_EXPANDED = register_expanded("transaction_for_user", "WHERE t.user_id = $1")
+TRANSACTION_FOR_BOOK_EXPANDED = register_expanded("transaction_for_book", "WHERE t.book_id = $1")
+
+
+def deserialize_expanded(
+    records: List[Record], expand: FrozenSet[TransactionExpansion]
+) -> Union[List[Transactions], List[ExpandedTransaction]]:
+    """Deserializes the records of a transaction query, nesting the columns of each expansion in its model."""
 
+    transactions: List[Transactions] = deserialize_records(records, Transactions)
+    if not expand:
+        return transactions
 
+    expanded: List[ExpandedTransaction] = []
+    for record, transaction in zip(records, transactions):
+        values = dict(vars(transaction))
+        for expansion in expand:
+            _, model, columns = EXPANSIONS[expansion]
+            values[expansion.value] = model.model_construct(
+                id=record[f"{expansion.value}_id"],
+                **{column: record[f"{expansion.value}_{column}"] for column in columns},
+            )
+        expanded.append(ExpandedTransaction.model_construct(**values))
+    return expanded
+
+
+@instrumented
 class TransactionService:
     def __init__(self):
         self.pool: Pool = DatabaseConnectionPool.get()
+        self.read_pool: Pool = DatabaseConnectionPool.get(read_only=True)
         self.schema: str = os.environ.get("DB_SCHEMA")
 
-    async def validate_book_stock(self, book_id) -> bool:
-        """Validates if the book is in stock.
+    async def get_user_due(self, user_id: int) -> int:
+        """Fetches the charge currently due by a user for the books they have not returned.
+
+        The dues ledger keeps the number of open loans of every user and the sum of their start dates
+        (as days since the epoch), so the charge is a primary key read:
+            (open loans * today - sum of loan start days) * charge per day
 
         Args:
-            book_id: id of the book
+            user_id: id of the user
 
         Returns:
-            True if book is in stock else False
+            total charge due by the user, 0 if they have never borrowed a book
         """
-        logger.info(f"Validating book stock for book_id: {book_id}")
-
-        query = f"""
-        WITH book_stock AS (
-            SELECT stock_quantity
-            FROM {self.schema}.book
-            WHERE id = $1
-        ), transaction_stock AS (
-            SELECT COUNT(*)
-            FROM {self.schema}.transaction
-            WHERE book_id = $1
-            AND status = '{TransactionStatus.PENDING.value}'
-        )
-        SELECT (book_stock.stock_quantity - transaction_stock.count) AS stock_count
-            FROM book_stock, transaction_stock;
-"""
+        logger.info("Fetching dues for user_id: %s", user_id)
+
+        query = StatementRegistry.get(TRANSACTION_USER_CHARGE)
 
         async with self.pool.acquire() as connection:
-            logger.info(
-                f"Acquired connection and opened transaction to validate book stock via query: {query}"
+            logger.debug("Acquired connection and opened transaction to fetch user dues via query: %s", query)
+            total_due = await connection.fetchval(
+                query, int(os.environ.get("CHARGE_PER_DAY")), user_id
             )
-            book_stock_count = await connection.fetchrow(query, book_id)
+        return total_due or 0
 
-        logger.info(f"Book stock count: {book_stock_count[0]}")
-        if not book_stock_count[0]:
-            return False
-        return book_stock_count[0] > 0
+    async def checkout(self, user_id: int, book_id: int) -> CheckoutResult:
+        """Lends a book to a user if it is in stock and the user is within their credit limit.
 
-    async def validate_transaction_possible(self, user_id) -> bool:
-        """Validates if the transaction is possible.
-        For example if the user has borrowed books whose charge exceeds the limit.
-        This is done by first counting the number of days the user has borrowed books for.
-        Then multiplying the number of days by the charge per day.
-        Finally checking if the total charge exceeds the limit.
+        The stock check, the credit check, the insert and the availability update run as one statement on one
+        connection. The user row and the availability row of the book are locked, in that order, for the
+        duration of the statement so that concurrent checkouts can never lend more copies than available.
 
         Args:
             user_id: id of the user
+            book_id: id of the book
 
         Returns:
-            True if transaction is possible else False
-        """
-        logger.info(f"Validating transaction for user_id: {user_id}")
-
-        query = f"""
-        SELECT SUM(DATE(NOW()) - DATE(created_at)) * $1 
-            AS BORROW_DAYS FROM 
-        {self.schema}.transaction 
-        WHERE user_id = $2
-        AND status = '{TransactionStatus.PENDING.value}';
+            result: outcome of the checkout with the created transaction.
+                See app.models.transactions.CheckoutResult for more details.
         """
+        logger.info("Checking out book_id: %s for user_id: %s", book_id, user_id)
 
+        query = StatementRegistry.get(TRANSACTION_CHECKOUT)
         async with self.pool.acquire() as connection:
-            logger.info(
-                f"Acquired connection and opened transaction to validate transaction via query: {query}"
+            logger.debug("Acquired connection and opened transaction to checkout book via query: %s", query)
+            checkout_record: Record = await connection.fetchrow(
+                query,
+                book_id,
+                user_id,
+                int(os.environ.get("CHARGE_PER_DAY")),
+                int(os.environ.get("CHARGE_LIMIT")),
             )
-            transaction_possible = await connection.fetchrow(
-                query, int(os.environ.get("CHARGE_PER_DAY")), user_id
-            )
-        if not transaction_possible[0]:
-            return True
-        logger.info(f"Transaction possible: {transaction_possible[0]}")
-        return transaction_possible[0] < int(os.environ.get("CHARGE_LIMIT"))
 
-    async def create_transaction(self, user_id: int, book_id: int):
-        """
-        Creates a new Transaction in the database.
+        checkout: CheckoutResult = self._checkout_result(book_id, checkout_record)
+        logger.info(
+            "Checkout of book_id: %s for user_id: %s finished with status: %s",
+            book_id,
+            user_id,
+            checkout.status.value,
+        )
+        return checkout
+
+    async def checkout_batch(self, user_id: int, book_ids: List[int]) -> List[CheckoutResult]:
+        """Lends several books to a user at once, each of them if it is in stock.
+
+        Works like checkout for every book in a single statement: the credit of the user is checked once, the
+        availability rows of all the books are locked in book_id order and every lendable book is inserted by
+        the same INSERT. A book requested more than once is lent as many times as it has copies available.
 
         Args:
             user_id: id of the user
-            book_id: id of the book
+            book_ids: ids of the books
 
         Returns:
-            book: pydantic model object of the book. See app.models.book.Book for more details.
+            results: outcome of the checkout of each requested book in the order of book_ids.
+                See app.models.transactions.CheckoutResult for more details.
         """
-        logger.info(
-            f"Creating new transaction for book_id: {book_id} and user_id: {user_id}"
-        )
+        logger.info("Checking out book_ids: %s for user_id: %s", book_ids, user_id)
 
-        query = f"""
-        INSERT INTO {self.schema}.transaction
-        (book_id, user_id, status)
-        VALUES ($1, $2, '{TransactionStatus.PENDING.value}')
-        RETURNING *;
-        """
+        query = StatementRegistry.get(TRANSACTION_CHECKOUT_BATCH)
         async with self.pool.acquire() as connection:
-            async with connection.transaction():
-                logger.info(
-                    f"Acquired connection and opened transaction to insert new transaction via query: {query}"
-                )
-                transaction_record = await connection.fetchrow(query, book_id, user_id)
+            logger.debug("Acquired connection and opened transaction to checkout books via query: %s", query)
+            checkout_records: List[Record] = await connection.fetch(
+                query,
+                book_ids,
+                user_id,
+                int(os.environ.get("CHARGE_PER_DAY")),
+                int(os.environ.get("CHARGE_LIMIT")),
+            )
 
+        checkouts: List[CheckoutResult] = [
+            self._checkout_result(record["book_id"], record, record["copy"])
+            for record in checkout_records
+        ]
         logger.info(
-            f"Transaction: {transaction_record} successfully inserted in the db"
+            "Checked out %s of %s books for user_id: %s",
+            sum(c.status == CheckoutStatus.CHECKED_OUT for c in checkouts),
+            len(book_ids),
+            user_id,
+        )
+        return checkouts
+
+    @staticmethod
+    def _checkout_result(book_id: int, checkout_record: Record, copy: int = 1) -> CheckoutResult:
+        if checkout_record["id"] is not None:
+            status = CheckoutStatus.CHECKED_OUT
+        elif not checkout_record["user_exists"]:
+            status = CheckoutStatus.USER_NOT_FOUND
+        elif (checkout_record["available_quantity"] or 0) < copy:
+            status = CheckoutStatus.OUT_OF_STOCK
+        else:
+            status = CheckoutStatus.CREDIT_LIMIT_EXCEEDED
+
+        return CheckoutResult(
+            book_id=book_id,
+            status=status,
+            transaction=deserialize_records(checkout_record, Transactions)
+            if status == CheckoutStatus.CHECKED_OUT
+            else None,
         )
-        return deserialize_records(transaction_record, Transactions)
 
-    async def get_all_transactions(self):
+    async def get_all_transactions(
+        self,
+        limit: int = DEFAULT_PAGE_SIZE,
+        cursor: Optional[str] = None,
+        expand: FrozenSet[TransactionExpansion] = frozenset(),
+    ) -> Union[Page[Transactions], Page[ExpandedTransaction]]:
         """
-        Gets all transactions.
+        Gets a page of transactions ordered by id.
+
+        Pagination is keyset based on id so every page costs the same irrespective of its depth.
+
+        Args:
+            limit: maximum number of transactions in the page
+            cursor: opaque cursor returned as next_cursor by the previous page, None for the first page
+            expand: book and / or user, embeds them in the transactions, read with the same query
 
         Returns:
-            transactions: list of pydantic model objects of the transactions. See app.models.transactions.Transactions for more details.
+            page: page of pydantic model objects of the transactions. See app.models.transactions.Transactions and
+                app.models.transactions.ExpandedTransaction for more details.
+
+        Raises:
+            ValueError: if the cursor is malformed
         """
-        logger.info(f"Getting all transactions")
+        logger.info("Getting transactions page of size: %s", limit)
+
+        position = decode_cursor(cursor, ("id",))
+        after_id: int = position["id"] if position else 0
+
+        query = StatementRegistry.get(TRANSACTION_PAGE_EXPANDED[expand] if expand else TRANSACTION_PAGE)
+        async with self.read_pool.acquire() as connection:
+            logger.debug("Acquired connection and opened transaction to get transactions via query: %s", query)
+            transaction_records = await connection.fetch(query, after_id, limit + 1)
+
+        logger.info("Transactions: %s successfully fetched from the db", len(transaction_records))
+        next_cursor = None
+        if len(transaction_records) > limit:
+            transaction_records = transaction_records[:limit]
+            next_cursor = encode_cursor({"id": transaction_records[-1]["id"]})
+        return Page[ExpandedTransaction if expand else Transactions](
+            items=deserialize_expanded(transaction_records, expand),
+            next_cursor=next_cursor,
+        )
 
-        query = f"""
-        SELECT * FROM {self.schema}.transaction ORDER BY id;
+    def export_transactions(self, chunk_size: int = EXPORT_CHUNK_SIZE) -> AsyncIterator[List[Record]]:
         """
-        async with self.pool.acquire() as connection:
-            logger.info(
-                f"Acquired connection and opened transaction to get all transactions via query: {query}"
-            )
-            transaction_records = await connection.fetch(query)
+        Streams the whole transaction ledger in chunks through a server-side cursor.
 
-        logger.info(
-            f"Transactions: {len(transaction_records)} successfully fetched from the db"
-        )
-        return deserialize_records(transaction_records, Transactions)
+        Args:
+            chunk_size: number of transactions fetched per round trip
+
+        Returns:
+            async iterator over chunks of transaction records ordered by id
+        """
+        query = StatementRegistry.get(TRANSACTION_EXPORT)
+        logger.debug("Streaming all transactions via query: %s", query)
+        return stream_records(self.read_pool, query, chunk_size=chunk_size)
 
     async def get_transaction(self, transaction_id: int):
         """
@@ -151,21 +576,14 @@ class TransactionService:
         Returns:
             transaction: pydantic model object of the transaction. See app.models.transactions.Transactions for more details.
         """
-        logger.info(f"Getting transaction with id: {transaction_id}")
+        logger.info("Getting transaction with id: %s", transaction_id)
 
-        query = f"""
-        SELECT * FROM {self.schema}.transaction
-        WHERE id = $1
-        """
-        async with self.pool.acquire() as connection:
-            logger.info(
-                f"Acquired connection and opened transaction to get transaction via query: {query}"
-            )
+        query = StatementRegistry.get(TRANSACTION_BY_ID)
+        async with self.read_pool.acquire() as connection:
+            logger.debug("Acquired connection and opened transaction to get transaction via query: %s", query)
             transaction_record = await connection.fetchrow(query, transaction_id)
 
-        logger.info(
-            f"Transaction: {transaction_record} successfully fetched from the db"
-        )
+        logger.info("Transaction with id: %s found in the db: %s", transaction_id, transaction_record is not None)
         return deserialize_records(transaction_record, Transactions)
 
     async def update_transaction_status(
@@ -181,76 +599,172 @@ class TransactionService:
         Returns:
             transaction: pydantic model object of the transaction. See app.models.transactions.Transactions for more details.
         """
-        logger.info(f"Updating transaction with id: {transaction_id}")
+        logger.info("Updating transaction with id: %s", transaction_id)
 
-        query = f"""
-        UPDATE {self.schema}.transaction
-        SET status = $1, updated_at = NOW()
-        WHERE id = $2
-        RETURNING *;
-        """
+        query = StatementRegistry.get(TRANSACTION_UPDATE_STATUS)
         async with self.pool.acquire() as connection:
             async with connection.transaction():
-                logger.info(
-                    f"Acquired connection and opened transaction to update transaction via query: {query}"
+                logger.debug(
+                    "Acquired connection and opened transaction to update transaction via query: %s", query
                 )
                 transaction_record = await connection.fetchrow(
                     query, status.value, transaction_id
                 )
 
-        logger.info(f"Transaction: {transaction_record} successfully updated in the db")
+        logger.info("Transaction with id: %s updated in the db: %s", transaction_id, transaction_record is not None)
         return deserialize_records(transaction_record, Transactions)
 
-    async def get_all_transactions_for_user(self, user_id: int):
+    async def update_transaction_status_batch(
+        self,
+        status: TransactionStatus,
+        transaction_ids: List[int],
+        loans: List[Tuple[int, int]],
+    ) -> List[StatusChangeResult]:
+        """Updates the status of many transactions in a single statement.
+
+        Transactions can be given by id or, when only the book and its borrower are known, as (user_id, book_id)
+        pairs. A pair resolves to a transaction of the user for the book that is not yet in the requested status
+        if there is one. Transactions already in the requested status are left untouched. An id given more than once
+        is updated and reported once.
+
+        Args:
+            status: status to set on the transactions
+            transaction_ids: ids of the transactions
+            loans: (user_id, book_id) pairs of the transactions
+
+        Returns:
+            results: outcome of each requested transaction, first those requested by id then those requested by
+                pair, each in the order of the request. See app.models.transactions.StatusChangeResult for more details.
+        """
+        logger.info(
+            "Updating %s transactions by id and %s by user and book to status: %s",
+            len(transaction_ids),
+            len(loans),
+            status.value,
+        )
+
+        query = StatementRegistry.get(TRANSACTION_UPDATE_STATUS_BATCH)
+        async with self.pool.acquire() as connection:
+            logger.debug("Acquired connection and opened transaction to update transactions via query: %s", query)
+            transaction_records: List[Record] = await connection.fetch(
+                query,
+                status.value,
+                transaction_ids,
+                [user_id for user_id, _ in loans],
+                [book_id for _, book_id in loans],
+            )
+
+        results: List[StatusChangeResult] = []
+        for record in transaction_records:
+            if record["id"] is None:
+                outcome = StatusChangeOutcome.NOT_FOUND
+            elif record["is_updated"]:
+                outcome = StatusChangeOutcome.UPDATED
+            else:
+                outcome = StatusChangeOutcome.UNCHANGED
+            results.append(
+                StatusChangeResult(
+                    transaction_id=record["requested_id"] or record["id"],
+                    user_id=record["requested_user_id"],
+                    book_id=record["requested_book_id"],
+                    outcome=outcome,
+                    transaction=deserialize_records(record, Transactions)
+                    if outcome != StatusChangeOutcome.NOT_FOUND
+                    else None,
+                )
+            )
+
+        logger.info(
+            "Updated %s of %s transactions",
+            sum(r.outcome == StatusChangeOutcome.UPDATED for r in results),
+            len(results),
+        )
+        return results
+
+    async def get_all_transactions_for_user(
+        self, user_id: int, expand: FrozenSet[TransactionExpansion] = frozenset()
+    ) -> Union[List[Transactions], List[ExpandedTransaction]]:
         """
         Gets all transactions for a user.
 
         Args:
             user_id: id of the user
+            expand: book and / or user, embeds them in the transactions, read with the same query
 
         Returns:
-            transactions: list of pydantic model objects of the transactions. See app.models.transactions.Transactions for more details.
+            transactions: list of pydantic model objects of the transactions. See app.models.transactions.Transactions
+                and app.models.transactions.ExpandedTransaction for more details.
         """
-        logger.info(f"Getting all transactions for user_id: {user_id}")
+        logger.info("Getting all transactions for user_id: %s", user_id)
 
-        query = f"""
-        SELECT * FROM {self.schema}.transaction
-        WHERE user_id = $1
-        """
-        async with self.pool.acquire() as connection:
-            logger.info(
-                f"Acquired connection and opened transaction to get all transactions for user via query: {query}"
+        query = StatementRegistry.get(TRANSACTION_FOR_USER_EXPANDED[expand] if expand else TRANSACTION_FOR_USER)
+        async with self.read_pool.acquire() as connection:
+            logger.debug(
+                "Acquired connection and opened transaction to get all transactions for user via query: %s", query
             )
             transaction_records = await connection.fetch(query, user_id)
 
-        logger.info(
-            f"Transactions: {transaction_records} successfully fetched from the db"
-        )
-        return deserialize_records(transaction_records, Transactions)
+        logger.info("Transactions: %s successfully fetched from the db", len(transaction_records))
+        return deserialize_expanded(transaction_records, expand)
 
-    async def get_all_transactions_for_book(self, book_id: int):
+    async def get_all_transactions_for_book(
+        self, book_id: int, expand: FrozenSet[TransactionExpansion] = frozenset()
+    ) -> Union[List[Transactions], List[ExpandedTransaction]]:
         """
         Gets all transactions for a book.
 
         Args:
             book_id: id of the book
+            expand: book and / or user, embeds them in the transactions, read with the same query
 
         Returns:
-            transactions: list of pydantic model objects of the transactions. See app.models.transactions.Transactions for more details.
+            transactions: list of pydantic model objects of the transactions. See app.models.transactions.Transactions
+                and app.models.transactions.ExpandedTransaction for more details.
         """
-        logger.info(f"Getting all transactions for book_id: {book_id}")
+        logger.info("Getting all transactions for book_id: %s", book_id)
 
-        query = f"""
-        SELECT * FROM {self.schema}.transaction
-        WHERE book_id = $1
-        """
-        async with self.pool.acquire() as connection:
-            logger.info(
-                f"Acquired connection and opened transaction to get all transactions for book via query: {query}"
+        query = StatementRegistry.get(TRANSACTION_FOR_BOOK_EXPANDED[expand] if expand else TRANSACTION_FOR_BOOK)
+        async with self.read_pool.acquire() as connection:
+            logger.debug(
+                "Acquired connection and opened transaction to get all transactions for book via query: %s", query
             )
             transaction_records = await connection.fetch(query, book_id)
 
-        logger.info(
-            f"Transactions: {transaction_records} successfully fetched from the db"
-        )
-        return deserialize_records(transaction_records, Transactions)
+        logger.info("Transactions: %s successfully fetched from the db", len(transaction_records))
+        return deserialize_expanded(transaction_records, expand)
+
+    async def create_transaction_partitions(self, months_ahead: int) -> int:
+        """Creates the missing monthly partitions of transaction from the current month to months_ahead months ahead.
+
+        A checkout in a month without a partition is refused, the default partition only holds the transactions
+        created before the monthly partitions.
+
+        Args:
+            months_ahead: number of months after the current one to create the partitions of
+
+        Returns:
+            number of partitions created
+        """
+
+        query = StatementRegistry.get(TRANSACTION_CREATE_PARTITIONS)
+        async with self.pool.acquire() as connection:
+            async with connection.transaction():
+                logger.debug("Acquired connection and opened transaction to create partitions via query: %s", query)
+                await connection.execute(
+                    StatementRegistry.get(TRANSACTION_PARTITIONS_LOCK),
+                    os.environ.get("MIGRATION_LOCK_TIMEOUT", "5s"),
+                )
+                return await connection.fetchval(query, months_ahead)
+
+    @classmethod
+    async def create_partitions_periodically(cls):
+        months_ahead = int(os.environ.get("TRANSACTION_PARTITION_MONTHS_AHEAD", 3))
+        interval = float(os.environ.get("TRANSACTION_PARTITION_INTERVAL", 86400))
+        while True:
+            try:
+                created = await cls().create_transaction_partitions(months_ahead)
+                if created:
+                    logger.info("Created %s transaction partition(s)", created)
+            except Exception:
+                logger.exception("Error while creating transaction partitions")
+            await asyncio.sleep(interval)
@@ -1,17 +1,76 @@
 import os
-from typing import Dict, Tuple, List
+from typing import Dict, Optional, Tuple, List
 
 from app.database import DatabaseConnectionPool
-from app.models.user import User
+from app.models.page import Page
+from app.models.user import User, UserDues
+from app.utils.cache_utils import Cache, CacheRegistry
 from app.utils.deserialization_utils import deserialize_records
+from app.utils.loader_utils import DataLoader, LoaderRegistry
 from app.utils.logging_utils import logger
+from app.utils.metrics_utils import instrumented
+from app.utils.pagination_utils import DEFAULT_PAGE_SIZE, decode_cursor, encode_cursor
+from app.utils.statement_utils import StatementRegistry
 from asyncpg import Pool, Record
 
+USER_INSERT = StatementRegistry.register(
+    "user_insert", "INSERT INTO {schema}.user (name, email) VALUES ($1, $2) RETURNING *;"
+)
+USER_PAGE = StatementRegistry.register(
+    "user_page", "SELECT * FROM {schema}.user WHERE id > $1 ORDER BY id LIMIT $2;"
+)
+USER_BY_IDS = StatementRegistry.register(
+    "user_by_ids", "SELECT * FROM {schema}.user WHERE id = ANY($1::int[]);"
+)
+USER_DELETE = StatementRegistry.register(
+    "user_delete", "DELETE FROM {schema}.user WHERE id = $1 RETURNING *;"
+)
+# The due of a user is (open_loans * today - loan_start_day_sum) * charge per day, so among users with the
+# same number of open loans the largest dues are the smallest sums. The top N are found by walking the few
+# distinct open loan counts with a loose index scan and taking the first N entries of each from the index.
+# The open_loans > 0 predicates are repeated so that the planner can use the partial index.
+USER_TOP_DUES = StatementRegistry.register(
+    "user_top_dues",
+    """WITH RECURSIVE loan_counts AS (
+            SELECT MIN(open_loans) AS open_loans FROM {schema}.user_dues WHERE open_loans > 0
+            UNION ALL
+            SELECT (
+                SELECT MIN(d.open_loans) FROM {schema}.user_dues d
+                WHERE d.open_loans > 0 AND d.open_loans > loan_counts.open_loans
+            )
+            FROM loan_counts
+            WHERE loan_counts.open_loans IS NOT NULL
+        ), candidates AS (
+            SELECT
+                d.user_id,
+                d.open_loans,
+                (d.open_loans * (CURRENT_DATE - DATE '1970-01-01') - d.loan_start_day_sum) * $1 AS total_due
+            FROM loan_counts
+            CROSS JOIN LATERAL (
+                SELECT user_id, open_loans, loan_start_day_sum
+                FROM {schema}.user_dues
+                WHERE open_loans > 0 AND open_loans = loan_counts.open_loans
+                ORDER BY loan_start_day_sum, user_id
+                LIMIT $2
+            ) d
+            ORDER BY total_due DESC, d.user_id
+            LIMIT $2
+        )
+        SELECT c.user_id, u.email, u.name, c.open_loans, c.total_due
+        FROM candidates c
+        JOIN {schema}.user u ON u.id = c.user_id
+        ORDER BY c.total_due DESC, c.user_id;""",
+)
+
 
+@instrumented
 class UserService:
     def __init__(self):
         self.pool: Pool = DatabaseConnectionPool.get()
+        self.read_pool: Pool = DatabaseConnectionPool.get(read_only=True)
         self.schema: str = os.environ.get("DB_SCHEMA")
+        self.cache: Cache = CacheRegistry.get("user")
+        self.loader: DataLoader = LoaderRegistry.get("user")
 
     async def create_new_user(self, email: str, name: str = "No-Name") -> User:
         """Creates a new user in the database.
@@ -24,44 +83,56 @@ class UserService:
             user: pydantic model object of the user. See app.models.user.User for more details.
         """
 
-        logger.info(f"Creating new user: {email}")
-        query = (
-            f"INSERT INTO {self.schema}.user (name, email) "
-            f"VALUES ($1, $2) RETURNING *;"
-        )
+        logger.info("Creating new user: %s", email)
+        query = StatementRegistry.get(USER_INSERT)
 
         params: Tuple[str, str] = (name, email.lower())
 
         async with self.pool.acquire() as connection:
             async with connection.transaction():
-                logger.info(
-                    f"Acquired connection and opened transaction to insert new user via query: {query}"
-                )
+                logger.debug("Acquired connection and opened transaction to insert new user via query: %s", query)
                 user_record: Record = await connection.fetchrow(query, *params)
 
-        logger.info(f"User: {email} successfully inserted in the db")
+        logger.info("User: %s successfully inserted in the db", email)
         return deserialize_records(user_record, User)
 
-    async def get_all_users(self) -> List[User]:
-        """Fetches all users from the database.
+    async def get_all_users(
+        self, limit: int = DEFAULT_PAGE_SIZE, cursor: Optional[str] = None
+    ) -> Page[User]:
+        """Fetches a page of users from the database ordered by id.
+
+        Pagination is keyset based on id so every page costs the same irrespective of its depth.
+
+        Args:
+            limit: maximum number of users in the page
+            cursor: opaque cursor returned as next_cursor by the previous page, None for the first page
 
         Returns:
-            users: list of pydantic model objects of the users. See app.models.user.User for more details.
+            page: page of pydantic model objects of the users. See app.models.user.User for more details.
+
+        Raises:
+            ValueError: if the cursor is malformed
         """
 
-        query = f"SELECT * FROM {self.schema}.user ORDER BY id;"
+        position = decode_cursor(cursor, ("id",))
+        after_id: int = position["id"] if position else 0
 
-        async with self.pool.acquire() as connection:
-            logger.info(
-                f"Acquired connection and opened transaction to fetch all users via query: {query}"
-            )
-            user_records: list[Record] = await connection.fetch(query)
-        if not user_records:
-            return []
-        return deserialize_records(user_records, User)
+        query = StatementRegistry.get(USER_PAGE)
+
+        async with self.read_pool.acquire() as connection:
+            logger.debug("Acquired connection and opened transaction to fetch users via query: %s", query)
+            user_records: list[Record] = await connection.fetch(query, after_id, limit + 1)
+
+        next_cursor = None
+        if len(user_records) > limit:
+            user_records = user_records[:limit]
+            next_cursor = encode_cursor({"id": user_records[-1]["id"]})
+        return Page[User](items=deserialize_records(user_records, User), next_cursor=next_cursor)
 
     async def get_user_by_id(self, id: int) -> User:
-        """Fetches a user with given id from the database.
+        """Fetches a user with given id, from the cache if present else from the database.
+
+        Lookups of users missing from the cache issued concurrently are fetched with a single query.
 
         Args:
             id:  id of the user
@@ -70,17 +141,27 @@ class UserService:
             user: pydantic model object of the user. See app.models.user.User for more details.
         """
 
-        query = f"SELECT * FROM {self.schema}.user WHERE id = $1;"
+        user: Optional[User] = self.cache.get(id)
+        if user:
+            return user
 
-        async with self.pool.acquire() as connection:
-            logger.info(
-                f"Acquired connection and opened transaction to fetch uuser via query: {query}"
-            )
-            user_record: Record = await connection.fetchrow(query, id)
-        if not user_record:
+        # A user loaded before an update or delete of the user finished is not cached
+        generation = self.cache.generation(id)
+        user = await self.loader.load(id, self._fetch_users)
+        if not user:
             # TODO: handle exceptions in general
             raise Exception(f"User {id} not found")
-        return deserialize_records(user_record, User)
+        self.cache.set(id, user, generation)
+        return user
+
+    async def _fetch_users(self, ids: List[int]) -> Dict[int, User]:
+        query = StatementRegistry.get(USER_BY_IDS)
+
+        async with self.pool.acquire() as connection:
+            logger.debug("Acquired connection and opened transaction to fetch %s users via query: %s", len(ids), query)
+            user_records: List[Record] = await connection.fetch(query, ids)
+
+        return {user.id: user for user in deserialize_records(user_records, User)}
 
     async def update_user_by_id(self, id: int, update_user_input_dict: Dict[str, str]) -> User:
         """Updates a user with given id from the database.
@@ -94,25 +175,14 @@ class UserService:
             user: pydantic model object of the user. See app.models.user.User for more details.
         """
 
-        params: List[str] = [val for val in update_user_input_dict.values()]
-        key_fields: List[str] = list(
-            map(
-                lambda x: f"{x[1]} = ${x[0] + 2}",
-                enumerate(update_user_input_dict.keys()),
-            )
-        )
-        key_fields.insert(0, "updated_at = NOW()")
-        update_clause: str = ", ".join(key_fields)
-        query = (
-            f"UPDATE {self.schema}.user SET {update_clause} WHERE id = $1 RETURNING *;"
-        )
+        query, columns = StatementRegistry.update("user", update_user_input_dict.keys())
+        params: List[str] = [update_user_input_dict[column] for column in columns]
 
         async with self.pool.acquire() as connection:
             async with connection.transaction():
-                logger.info(
-                    f"Acquired connection and opened transaction to update user via query: {query}"
-                )
+                logger.debug("Acquired connection and opened transaction to update user via query: %s", query)
                 user_record: Record = await connection.fetchrow(query, id, *params)
+        self.cache.invalidate(id)
         if not user_record:
             raise Exception(f"User {id} not found")
 
@@ -128,17 +198,39 @@ class UserService:
             user: pydantic model object of the user. See app.models.user.User for more details.
         """
 
-        query = f"DELETE FROM {self.schema}.user WHERE id = $1 RETURNING *;"
+        query = StatementRegistry.get(USER_DELETE)
 
         async with self.pool.acquire() as connection:
             async with connection.transaction():
-                logger.info(
-                    f"Acquired connection and opened transaction to delete user via query: {query}"
-                )
+                logger.debug("Acquired connection and opened transaction to delete user via query: %s", query)
                 user_record: Record = await connection.fetchrow(query, id)
+        self.cache.invalidate(id)
 
-        logger.info(f"User: {id} successfully deleted from the db")
+        logger.info("User: %s successfully deleted from the db", id)
         if not user_record:
             raise Exception(f"User {id} not found")
 
         return deserialize_records(user_record, User)
+
+    async def get_top_dues(self, top: int) -> List[UserDues]:
+        """Fetches the users with the largest charge due for the books they have not returned.
+
+        Reads the dues ledger through the user_dues_open_loans_idx index, so the cost depends on the number of
+        distinct open loan counts and on top, not on the number of users.
+
+        Args:
+            top: number of users to fetch
+
+        Returns:
+            dues: pydantic model objects of the dues ordered by the charge due, largest first.
+                See app.models.user.UserDues for more details.
+        """
+
+        query = StatementRegistry.get(USER_TOP_DUES)
+
+        async with self.read_pool.acquire() as connection:
+            logger.debug("Acquired connection and opened transaction to fetch top user dues via query: %s", query)
+            dues_records: List[Record] = await connection.fetch(
+                query, int(os.environ.get("CHARGE_PER_DAY")), top
+            )
+        return deserialize_records(dues_records, UserDues)
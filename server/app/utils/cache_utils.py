@@ -0,0 +1,194 @@
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from os import environ
+from typing import Any, Dict, Hashable, Optional, Tuple
+
+from app.utils.logging_utils import logger
+
+
+class Cache(ABC):
+    """Interface of the in-process caches placed in front of the service reads."""
+
+    @abstractmethod
+    def get(self, key: Hashable) -> Optional[Any]:
+        """Returns the cached value for the key, None on a miss."""
+
+    @abstractmethod
+    def generation(self, key: Hashable) -> int:
+        """Returns the generation of the key, changed by every invalidation of the key."""
+
+    @abstractmethod
+    def set(self, key: Hashable, value: Any, generation: Optional[int] = None) -> None:
+        """Stores the value against the key.
+
+        Args:
+            key: key of the value
+            value: value to store
+            generation: generation of the key read before loading the value, the value is discarded when the key
+                was invalidated since
+        """
+
+    @abstractmethod
+    def invalidate(self, key: Hashable) -> None:
+        """Removes the key from the cache if present and changes its generation."""
+
+    @abstractmethod
+    def clear(self) -> None:
+        """Removes every key from the cache and changes the generation of every key."""
+
+    @abstractmethod
+    def stats(self) -> Dict[str, Any]:
+        """Returns the counters of the cache."""
+
+
+class NullCache(Cache):
+    """Cache that never stores anything, used when caching is disabled."""
+
+    def __init__(self):
+        self.misses: int = 0
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        self.misses += 1
+        return None
+
+    def generation(self, key: Hashable) -> int:
+        return 0
+
+    def set(self, key: Hashable, value: Any, generation: Optional[int] = None) -> None:
+        pass
+
+    def invalidate(self, key: Hashable) -> None:
+        pass
+
+    def clear(self) -> None:
+        pass
+
+    def stats(self) -> Dict[str, Any]:
+        return {"enabled": False, "misses": self.misses}
+
+
+class LRUCache(Cache):
+    """Size bounded least recently used cache whose entries expire after a TTL.
+
+    Not thread safe, meant to be used from the event loop only. The generations of the last max_size invalidated
+    keys are kept, the other keys share the generation of the last key forgotten so that a forgotten invalidation
+    still discards the values loaded before it.
+    """
+
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size: int = max_size
+        self.ttl: float = ttl
+        self.entries: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+        self.hits: int = 0
+        self.misses: int = 0
+        self.evictions: int = 0
+        self.expirations: int = 0
+        self.invalidations: int = 0
+        self.discarded: int = 0
+        self.generations: "OrderedDict[Hashable, int]" = OrderedDict()
+        self.last_generation: int = 0
+        self.forgotten_generation: int = 0
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        expires_at, value = entry
+        if expires_at <= time.monotonic():
+            del self.entries[key]
+            self.expirations += 1
+            self.misses += 1
+            return None
+
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def generation(self, key: Hashable) -> int:
+        return self.generations.get(key, self.forgotten_generation)
+
+    def set(self, key: Hashable, value: Any, generation: Optional[int] = None) -> None:
+        if generation is not None and generation != self.generation(key):
+            self.discarded += 1
+            return
+
+        self.entries[key] = (time.monotonic() + self.ttl, value)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, key: Hashable) -> None:
+        if self.entries.pop(key, None) is not None:
+            self.invalidations += 1
+
+        self.last_generation += 1
+        self.generations[key] = self.last_generation
+        self.generations.move_to_end(key)
+        while len(self.generations) > self.max_size:
+            _, self.forgotten_generation = self.generations.popitem(last=False)
+
+    def clear(self) -> None:
+        self.entries.clear()
+        self.last_generation += 1
+        self.generations.clear()
+        self.forgotten_generation = self.last_generation
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "enabled": True,
+            "size": len(self.entries),
+            "max_size": self.max_size,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "invalidations": self.invalidations,
+            "discarded": self.discarded,
+        }
+
+
+class CacheRegistry:
+    """Holds the shared named caches, services are instantiated per request so the caches live here."""
+
+    caches: Dict[str, Cache] = {}
+
+    def __init__(self):
+        raise NotImplementedError(f"CacheRegistry cannot be instantiated")
+
+    @classmethod
+    def get(cls, name: str) -> Cache:
+        """Returns the cache with the given name, creating it on first use.
+
+        The cache is configured through the following environment variables:
+            - CACHE_ENABLED: set to false to disable caching, defaults to true
+            - CACHE_MAX_SIZE: maximum number of entries per cache, defaults to 10000
+            - CACHE_TTL: seconds after which an entry expires, defaults to 300
+        """
+
+        if name not in cls.caches:
+            if environ.get("CACHE_ENABLED", "true").lower() == "false":
+                cls.caches[name] = NullCache()
+            else:
+                cls.caches[name] = LRUCache(
+                    max_size=int(environ.get("CACHE_MAX_SIZE", 10000)),
+                    ttl=float(environ.get("CACHE_TTL", 300)),
+                )
+            logger.info("Initialised %s for: %s", type(cls.caches[name]).__name__, name)
+        return cls.caches[name]
+
+    @classmethod
+    def register(cls, name: str, cache: Cache):
+        """Replaces the cache with the given name, for plugging in a different implementation."""
+
+        cls.caches[name] = cache
+
+    @classmethod
+    def stats(cls) -> Dict[str, Dict[str, Any]]:
+        return {name: cache.stats() for name, cache in cls.caches.items()}
@@ -0,0 +1,100 @@
+from typing import Dict, Optional
+
+import anyio.to_thread
+import brotli
+from starlette.datastructures import Headers
+# Internals of starlette, pinned in requirements.txt
+from starlette.middleware.gzip import GZipMiddleware, GZipResponder, IdentityResponder
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+# Preferred first when the client accepts several with the same quality
+SUPPORTED_ENCODINGS = ("br", "gzip")
+
+
+def negotiate_encoding(accept_encoding: str) -> Optional[str]:
+    """Picks the supported content encoding with the highest quality in an Accept-Encoding header.
+
+    Args:
+        accept_encoding: value of the Accept-Encoding header, e.g. "gzip, deflate, br;q=0.9"
+
+    Returns:
+        "br", "gzip" or None if the client accepts neither
+    """
+
+    qualities: Dict[str, float] = {}
+    for entry in accept_encoding.lower().split(","):
+        coding, _, parameters = entry.strip().partition(";")
+        quality = 1.0
+        name, _, value = parameters.strip().partition("=")
+        if name.strip() == "q":
+            try:
+                quality = float(value)
+            except ValueError:
+                quality = 0.0
+        qualities[coding.strip()] = quality
+
+    def quality_of(encoding: str) -> float:
+        return qualities.get(encoding, qualities.get("*", 0.0))
+
+    accepted = [encoding for encoding in SUPPORTED_ENCODINGS if quality_of(encoding) > 0]
+    return max(accepted, key=quality_of, default=None)
+
+
+class BrotliResponder(IdentityResponder):
+    content_encoding = "br"
+
+    def __init__(self, app: ASGIApp, minimum_size: int, quality: int, thread_minimum_size: int):
+        super().__init__(app, minimum_size)
+        self.compressor = brotli.Compressor(quality=quality)
+        self.thread_minimum_size = thread_minimum_size
+
+    async def apply_compression(self, body: bytes, *, more_body: bool) -> bytes:
+        if len(body) >= self.thread_minimum_size:
+            # Compressing large bodies inline would block the event loop
+            return await anyio.to_thread.run_sync(self._compress_body, body, more_body)
+        return self._compress_body(body, more_body)
+
+    def _compress_body(self, body: bytes, more_body: bool) -> bytes:
+        if more_body:
+            return self.compressor.process(body) + self.compressor.flush()
+        return self.compressor.process(body) + self.compressor.finish()
+
+
+class CompressionMiddleware(GZipMiddleware):
+    """Compresses responses with brotli or gzip, whichever the client prefers in its Accept-Encoding.
+
+    Responses smaller than minimum_size and already encoded responses are sent as is. Streaming responses are
+    compressed chunk by chunk.
+    """
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        minimum_size: int = 1024,
+        gzip_level: int = 6,
+        brotli_quality: int = 4,
+        thread_minimum_size: int = 128 * 1024,
+    ):
+        super().__init__(
+            app, minimum_size=minimum_size, compresslevel=gzip_level, thread_minimum_size=thread_minimum_size
+        )
+        self.brotli_quality = brotli_quality
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        encoding = negotiate_encoding(Headers(scope=scope).get("Accept-Encoding", ""))
+        if encoding == "br":
+            responder = BrotliResponder(self.app, self.minimum_size, self.brotli_quality, self.thread_minimum_size)
+        elif encoding == "gzip":
+            responder = GZipResponder(
+                self.app,
+                self.minimum_size,
+                compresslevel=self.compresslevel,
+                thread_minimum_size=self.thread_minimum_size,
+            )
+        else:
+            responder = IdentityResponder(self.app, self.minimum_size)
+        await responder(scope, receive, send)
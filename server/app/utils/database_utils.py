@@ -1,4 +1,16 @@
+import time
+from contextvars import ContextVar
+from dataclasses import dataclass
+from http.cookies import CookieError, SimpleCookie
 from os import environ
+from typing import Any, List, Optional
+
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+LAST_WRITE_COOKIE = "last_write"
+LAST_WRITE_HEADER = "X-Last-Write"
+SAFE_METHODS = ("GET", "HEAD", "OPTIONS")
 
 
 def generate_dsn() -> str:
@@ -20,3 +32,103 @@ def generate_dsn() -> str:
     host = environ.get("DB_HOST")
     port = environ.get("DB_PORT")
     return f"{driver}://{user}:{password}@{host}:{port}/{database}"
+
+
+def generate_replica_dsns() -> List[str]:
+    """Returns the DSNs of the read replicas, none by default.
+
+    DB_REPLICA_URLS lists complete DSNs separated by commas. Otherwise DB_REPLICA_HOSTS lists host:port pairs
+    separated by commas, connected to with the driver, credentials and database of the primary.
+    """
+
+    urls = environ.get("DB_REPLICA_URLS", "")
+    if urls.strip():
+        return [url.strip() for url in urls.split(",") if url.strip()]
+
+    hosts = environ.get("DB_REPLICA_HOSTS", "")
+    driver = environ.get("DB_DRIVER")
+    user = environ.get("DB_USER")
+    password = environ.get("DB_PASSWORD")
+    database = environ.get("DB_NAME")
+
+    dsns = []
+    for address in hosts.split(","):
+        if not address.strip():
+            continue
+        host, _, port = address.strip().partition(":")
+        dsns.append(f"{driver}://{user}:{password}@{host}:{port or environ.get('DB_PORT')}/{database}")
+    return dsns
+
+
+@dataclass
+class RequestRouting:
+    """Where the queries of the request being handled are sent.
+
+    primary_only is set for requests that write and for clients that wrote recently, whose reads must see their
+    writes. replica is the replica serving the other reads, chosen on the first read so that every read of the
+    request sees the same snapshot.
+    """
+
+    primary_only: bool = False
+    replica: Optional[Any] = None
+
+
+request_routing: ContextVar[Optional[RequestRouting]] = ContextVar("request_routing", default=None)
+
+
+class ReadYourWritesMiddleware:
+    """Keeps the reads of a client that just wrote on the primary, the replicas may not have replayed the write yet.
+
+    Requests other than GET, HEAD and OPTIONS are writes, all of their queries go to the primary. A successful write
+    returns its time in the X-Last-Write header and a cookie, the reads of requests carrying either younger than
+    window seconds go to the primary as well. Cross-origin clients echo the header, browsers only send the cookie
+    along cross-origin requests made with credentials.
+    """
+
+    def __init__(self, app: ASGIApp, window: float):
+        self.app = app
+        self.window = window
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        writes = scope["method"] not in SAFE_METHODS
+        routing = RequestRouting(primary_only=writes or self.wrote_recently(scope))
+
+        async def send_with_last_write(message: Message) -> None:
+            if writes and message["type"] == "http.response.start" and message["status"] < 400:
+                last_write = f"{time.time():.3f}"
+                headers = MutableHeaders(scope=message)
+                headers[LAST_WRITE_HEADER] = last_write
+                headers.append(
+                    "Set-Cookie",
+                    f"{LAST_WRITE_COOKIE}={last_write}; Max-Age={int(self.window) + 1}; Path=/; HttpOnly; SameSite=Lax",
+                )
+            await send(message)
+
+        token = request_routing.set(routing)
+        try:
+            await self.app(scope, receive, send_with_last_write)
+        finally:
+            request_routing.reset(token)
+
+    def wrote_recently(self, scope: Scope) -> bool:
+        header = LAST_WRITE_HEADER.lower().encode("latin-1")
+        for name, value in scope["headers"]:
+            try:
+                if name == header:
+                    last_write = float(value)
+                elif name == b"cookie":
+                    cookie = SimpleCookie()
+                    cookie.load(value.decode("latin-1"))
+                    last_write = float(cookie[LAST_WRITE_COOKIE].value)
+                else:
+                    continue
+            except (CookieError, KeyError, ValueError):
+                continue
+            # A time in the future is not one of ours, it would keep the reads of the client on the primary
+            if 0 <= time.time() - last_write < self.window:
+                return True
+        return False
@@ -1,26 +1,90 @@
-from typing import List, Type, TypeVar, Union
+from enum import Enum
+from functools import lru_cache
+from os import environ
+from typing import Any, Callable, List, Mapping, Optional, Tuple, Type, TypeVar, Union
 
 from asyncpg import Record
+from pydantic import BaseModel
 
 T = TypeVar("T")
 
+_set_attribute = object.__setattr__
 
-def deserialize_records(results: Union[Record, List[Record]], dataclass: Type[T]) -> Union[T, List[T]]:
+
+def deserialize_records(
+    results: Union[Record, List[Record]], dataclass: Type[T], validate: Optional[bool] = None
+) -> Union[T, List[T]]:
     """Deserializes one or a list of database records into objects of the provided class type.
 
     if a single record is provided, the returned value is a single class object.
     If a list of records is provided, the returned value is a list of class objects.
 
+    Records coming from our own typed schema are trusted by default: the model is built directly from the
+    record values without running pydantic validation, only enum columns are coerced. Set the environment
+    variable STRICT_DESERIALIZATION to true, or pass validate=True, to fully validate every record.
+
     Args:
         results: one or more database records
         dataclass: class into which the records are to be deserialized
+        validate: whether to run pydantic validation, defaults to STRICT_DESERIALIZATION
     """
 
-    def parse_record(entry: Record):
-        record_dict = {k: v for k, v in entry.items()}
-        return dataclass(**record_dict)
+    if validate is None:
+        validate = environ.get("STRICT_DESERIALIZATION", "false").lower() == "true"
 
     if isinstance(results, Record):
-        return parse_record(results)
+        return _record_parser(dataclass, results, validate)(results)
+
+    if len(results) == 0:
+        return []
+    parse_record = _record_parser(dataclass, results[0], validate)
+    return [parse_record(x) for x in results]
+
+
+def _record_parser(
+    dataclass: Type[T], sample: Mapping[str, Any], validate: bool
+) -> Callable[[Mapping[str, Any]], T]:
+    """Returns the function building a model from a record, resolved once for all records of a query."""
+
+    if validate:
+        return lambda entry: dataclass.model_validate(dict(entry))
+
+    field_names, converters = _model_layout(dataclass)
+    columns = frozenset(sample.keys())
+    if not columns.issuperset(field_names):
+        # Record does not cover every field, let pydantic apply defaults and report missing ones
+        return lambda entry: dataclass.model_validate(dict(entry))
+
+    if columns == frozenset(field_names):
+        copy_values = dict
+    else:
+        copy_values = lambda entry: {name: entry[name] for name in field_names}
+
+    new_instance = dataclass.__new__
+
+    def construct(entry: Mapping[str, Any]) -> T:
+        values = copy_values(entry)
+        for name, converter in converters:
+            if values[name] is not None:
+                values[name] = converter(values[name])
+
+        instance = new_instance(dataclass)
+        _set_attribute(instance, "__dict__", values)
+        _set_attribute(instance, "__pydantic_fields_set__", set(field_names))
+        _set_attribute(instance, "__pydantic_extra__", None)
+        _set_attribute(instance, "__pydantic_private__", None)
+        return instance
+
+    return construct
+
+
+@lru_cache(maxsize=None)
+def _model_layout(dataclass: Type[BaseModel]) -> Tuple[Tuple[str, ...], Tuple[Tuple[str, Callable], ...]]:
+    """Returns the field names of the model and the converters of the enum fields asyncpg returns as text."""
 
-    return list(map(lambda x: parse_record(x), results))
\ No newline at end of file
+    converters = tuple(
+        (name, field.annotation)
+        for name, field in dataclass.model_fields.items()
+        if isinstance(field.annotation, type) and issubclass(field.annotation, Enum)
+    )
+    return tuple(dataclass.model_fields), converters
@@ -0,0 +1,56 @@
+from datetime import timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Dict
+
+from starlette.requests import Request
+
+from app.models.table_version import TableVersion
+
+
+def validators(version: TableVersion, *etag_parts: str) -> Dict[str, str]:
+    """Builds the ETag and Last-Modified headers of a response rendered from a table at a version.
+
+    Args:
+        version: version of the table the response is read from
+        etag_parts: anything else the response depends on, e.g. the current date. Last-Modified is left out
+            when given, the table version alone does not date the response then.
+
+    Returns:
+        headers: validator headers of the response, with Cache-Control asking clients to revalidate every time
+    """
+
+    etag = "-".join([version.table_name, str(version.version), *etag_parts])
+    headers = {"ETag": f'W/"{etag}"', "Cache-Control": "no-cache"}
+    if not etag_parts:
+        headers["Last-Modified"] = format_datetime(version.updated_at.astimezone(timezone.utc), usegmt=True)
+    return headers
+
+
+def is_not_modified(request: Request, headers: Dict[str, str]) -> bool:
+    """Evaluates the If-None-Match or, when absent, the If-Modified-Since header of a request.
+
+    Args:
+        request: the conditional GET request
+        headers: validator headers of the current response, see validators
+
+    Returns:
+        True if the client copy is still current and a 304 can be sent instead of the response
+    """
+
+    if_none_match = request.headers.get("If-None-Match")
+    if if_none_match is not None:
+        # Weak comparison, the W/ prefix is ignored
+        etag = headers["ETag"].removeprefix("W/")
+        tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+        return "*" in tags or etag in tags
+
+    if_modified_since = request.headers.get("If-Modified-Since")
+    if if_modified_since is None or "Last-Modified" not in headers:
+        return False
+    try:
+        since = parsedate_to_datetime(if_modified_since)
+    except (TypeError, ValueError):
+        return False
+    if since.tzinfo is None:
+        since = since.replace(tzinfo=timezone.utc)
+    return parsedate_to_datetime(headers["Last-Modified"]) <= since
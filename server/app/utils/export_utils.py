@@ -0,0 +1,91 @@
+import csv
+import io
+import json
+from datetime import date, datetime
+from enum import Enum
+from typing import Any, AsyncIterator, List
+
+from asyncpg import Pool, Record
+
+from app.entities.export import ExportFormat
+
+EXPORT_CHUNK_SIZE: int = 5000
+
+MEDIA_TYPES = {
+    ExportFormat.NDJSON: "application/x-ndjson",
+    ExportFormat.CSV: "text/csv",
+}
+
+
+async def stream_records(
+    pool: Pool, query: str, *args: Any, chunk_size: int = EXPORT_CHUNK_SIZE
+) -> AsyncIterator[List[Record]]:
+    """Streams the result of a query in chunks through a server-side cursor.
+
+    The connection is held for the lifetime of the iteration, only one chunk is ever materialised in memory.
+
+    Args:
+        pool: connection pool to acquire the connection from
+        query: SELECT query to open the cursor on
+        args: query parameters
+        chunk_size: number of records fetched per round trip
+    """
+
+    async with pool.acquire() as connection:
+        async with connection.transaction(readonly=True):
+            cursor = await connection.cursor(query, *args)
+            while True:
+                records: List[Record] = await cursor.fetch(chunk_size)
+                if not records:
+                    break
+                yield records
+
+
+def _to_json_value(value: Any) -> Any:
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, Enum):
+        return value.value
+    return str(value)
+
+
+def _to_csv_value(value: Any) -> Any:
+    if value is None:
+        return ""
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, list):
+        return "/".join(str(x) for x in value)
+    return value
+
+
+def encode_ndjson(records: List[Record]) -> bytes:
+    """Encodes records as newline delimited JSON, one object per line."""
+
+    lines = [json.dumps(dict(record.items()), default=_to_json_value) for record in records]
+    return ("\n".join(lines) + "\n").encode()
+
+
+def encode_csv(records: List[Record], include_header: bool) -> bytes:
+    """Encodes records as CSV rows. Array columns are joined with '/' as in the Frappe API."""
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if include_header:
+        writer.writerow(records[0].keys())
+    writer.writerows([_to_csv_value(v) for v in record.values()] for record in records)
+    return buffer.getvalue().encode()
+
+
+async def encode_export(
+    chunks: AsyncIterator[List[Record]], export_format: ExportFormat
+) -> AsyncIterator[bytes]:
+    """Encodes a stream of record chunks into the bytes of the requested export format."""
+
+    include_header = True
+    async for records in chunks:
+        if export_format == ExportFormat.CSV:
+            yield encode_csv(records, include_header)
+            include_header = False
+        else:
+            yield encode_ndjson(records)
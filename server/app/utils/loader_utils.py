@@ -0,0 +1,119 @@
+import asyncio
+from os import environ
+from typing import Any, Awaitable, Callable, Dict, Hashable, Iterable, List, Optional, Set
+
+from app.utils.logging_utils import logger
+from app.utils.metrics_utils import LOADER_BATCH_SIZE
+
+BatchLoad = Callable[[List[Hashable]], Awaitable[Dict[Hashable, Any]]]
+
+
+class DataLoader:
+    """Coalesces the lookups by key issued concurrently into batched fetches.
+
+    The keys requested while the event loop runs the ready callbacks, or within batch_delay seconds of the first
+    one, are fetched together by a single call of the batch load function, up to max_batch_size keys per call.
+    Lookups of a key already being fetched share its result. Nothing is cached once a batch completes.
+
+    Not thread safe, meant to be used from the event loop only.
+    """
+
+    def __init__(self, name: str, batch_delay: float, max_batch_size: int):
+        self.name: str = name
+        self.batch_delay: float = batch_delay
+        self.max_batch_size: int = max_batch_size
+        self.batch_size = LOADER_BATCH_SIZE.labels(name)
+        # key -> future of its value, from the time it is requested until its batch completes
+        self.futures: Dict[Hashable, asyncio.Future] = {}
+        self.pending: List[Hashable] = []
+        self.pending_load: Optional[BatchLoad] = None
+        self.dispatches: Set[asyncio.Task] = set()
+
+    async def load(self, key: Hashable, batch_load: BatchLoad) -> Optional[Any]:
+        """Returns the value of the key, None if the batch load function found none.
+
+        Services are instantiated per request, so the function fetching the keys is passed by every caller. The
+        one of the first lookup of a batch fetches every key of the batch.
+        """
+
+        future = self.futures.get(key)
+        if future is None:
+            future = asyncio.get_running_loop().create_future()
+            self.futures[key] = future
+            self.schedule(key, batch_load)
+        # A cancelled caller must not cancel the lookup of the other callers of the key
+        return await asyncio.shield(future)
+
+    async def load_many(self, keys: Iterable[Hashable], batch_load: BatchLoad) -> Dict[Hashable, Any]:
+        """Returns the values of the keys found, batched with the other lookups of the same tick."""
+
+        keys = list(dict.fromkeys(keys))
+        values = await asyncio.gather(*(self.load(key, batch_load) for key in keys))
+        return {key: value for key, value in zip(keys, values) if value is not None}
+
+    def schedule(self, key: Hashable, batch_load: BatchLoad):
+        if not self.pending:
+            self.pending_load = batch_load
+            loop = asyncio.get_running_loop()
+            if self.batch_delay > 0:
+                loop.call_later(self.batch_delay, self.dispatch)
+            else:
+                loop.call_soon(self.dispatch)
+        self.pending.append(key)
+        if len(self.pending) >= self.max_batch_size:
+            self.dispatch()
+
+    def dispatch(self):
+        # The scheduled call of a batch dispatched early as full finds nothing pending, or the keys of the next one
+        if not self.pending:
+            return
+        keys, batch_load = self.pending, self.pending_load
+        self.pending, self.pending_load = [], None
+        task = asyncio.get_running_loop().create_task(self.fetch(keys, batch_load))
+        self.dispatches.add(task)
+        task.add_done_callback(self.dispatches.discard)
+
+    async def fetch(self, keys: List[Hashable], batch_load: BatchLoad):
+        self.batch_size.observe(len(keys))
+        logger.debug("Loading a batch of %s %s", len(keys), self.name)
+        try:
+            values = await batch_load(keys)
+        except Exception as e:
+            for key in keys:
+                future = self.futures.pop(key)
+                if not future.done():
+                    future.set_exception(e)
+                # Retrieved here so that a lookup abandoned by all its callers is not reported as never retrieved
+                future.exception()
+            return
+        for key in keys:
+            future = self.futures.pop(key)
+            if not future.done():
+                future.set_result(values.get(key))
+
+
+class LoaderRegistry:
+    """Holds the shared named loaders, services are instantiated per request so the loaders live here."""
+
+    loaders: Dict[str, DataLoader] = {}
+
+    def __init__(self):
+        raise NotImplementedError(f"LoaderRegistry cannot be instantiated")
+
+    @classmethod
+    def get(cls, name: str) -> DataLoader:
+        """Returns the loader with the given name, creating it on first use.
+
+        The loader is configured through the following environment variables:
+            - LOADER_BATCH_DELAY: seconds to wait for more lookups before fetching a batch, defaults to 0, the
+              batch is then fetched on the next iteration of the event loop
+            - LOADER_MAX_BATCH_SIZE: maximum number of keys fetched per batch, defaults to 500
+        """
+
+        if name not in cls.loaders:
+            cls.loaders[name] = DataLoader(
+                name,
+                batch_delay=float(environ.get("LOADER_BATCH_DELAY", 0)),
+                max_batch_size=int(environ.get("LOADER_MAX_BATCH_SIZE", 500)),
+            )
+        return cls.loaders[name]
@@ -1,15 +1,193 @@
+import atexit
+import json
 import logging
+import queue
+import random
 import sys
+import uuid
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from os import environ
+from typing import Any, Dict, Optional, Tuple
 
-logger = logging.getLogger()
-logger.setLevel(logging.INFO)
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+CORRELATION_ID_HEADER = "X-Request-ID"
+
+correlation_id: ContextVar[Optional[str]] = ContextVar("correlation_id", default=None)
+
+# Attributes of every LogRecord, anything else on a record was passed through extra=
+RECORD_ATTRIBUTES = frozenset(vars(logging.makeLogRecord({}))) | {"message", "asctime", "correlation_id"}
+
+
+class JSONFormatter(logging.Formatter):
+    """Formats a record as one JSON object per line.
+
+    Fields passed with extra= are added to the object as is, values that are not JSON types are converted with str.
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry: Dict[str, Any] = {
+            "timestamp": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "location": f"{record.filename}:{record.lineno}",
+            "message": record.getMessage(),
+        }
+        if getattr(record, "correlation_id", None):
+            entry["correlation_id"] = record.correlation_id
+        for key, value in vars(record).items():
+            if key not in RECORD_ATTRIBUTES:
+                entry[key] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        if record.stack_info:
+            entry["stack"] = self.formatStack(record.stack_info)
+        return json.dumps(entry, default=str)
+
+
+class CorrelationIdFilter(logging.Filter):
+    """Stamps every record with the correlation id of the request being handled, None outside of requests."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.correlation_id = correlation_id.get()
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """Thins out records below WARNING, warnings and errors always pass.
+
+    A record is kept with probability sample_rate. At most rate_limit records per second are then kept from each
+    call site, the number dropped in between is reported as "suppressed" on the next record kept from that site.
+    """
+
+    def __init__(self, sample_rate: float = 1.0, rate_limit: int = 0):
+        super().__init__()
+        self.sample_rate = sample_rate
+        self.rate_limit = rate_limit
+        # call site -> (start of the current one second window, records kept in it, records dropped since last kept)
+        self.windows: Dict[Tuple[str, int], Tuple[float, int, int]] = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+        if self.sample_rate < 1.0 and random.random() >= self.sample_rate:
+            return False
+        if self.rate_limit <= 0:
+            return True
+
+        site = (record.pathname, record.lineno)
+        window_start, kept, suppressed = self.windows.get(site, (record.created, 0, 0))
+        if record.created - window_start >= 1.0:
+            window_start, kept = record.created, 0
+        if kept >= self.rate_limit:
+            self.windows[site] = (window_start, kept, suppressed + 1)
+            return False
+        if suppressed:
+            record.suppressed = suppressed
+        self.windows[site] = (window_start, kept + 1, 0)
+        return True
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    """Hands records over to the listener thread without formatting them.
+
+    The message is formatted by the listener, so the arguments of a log call must not be mutated afterwards.
+    Records are dropped instead of blocking the caller when the queue is full, the number dropped is reported
+    with the next record that fits.
+    """
 
-formatter = logging.Formatter(
-    "[%(asctime)s] [%(filename)s:%(lineno)d] %(levelname)s - %(message)s",
-    "%d-%m %H:%M:%S",
-)
-handler = logging.StreamHandler(sys.stdout)
-handler.setLevel(logging.INFO)
-handler.setFormatter(formatter)
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped: int = 0
 
-logger.addHandler(handler)
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        if self.dropped:
+            record.dropped = self.dropped
+        try:
+            self.queue.put_nowait(record)
+            self.dropped = 0
+        except queue.Full:
+            self.dropped += 1
+
+
+class CorrelationIdMiddleware:
+    """Assigns a correlation id to every request, logged with each record emitted while handling it.
+
+    The id of the X-Request-ID request header is reused when present so that it can be traced across services,
+    a new one is generated otherwise. It is returned in the X-Request-ID response header.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        request_id = None
+        for name, value in scope["headers"]:
+            if name == b"x-request-id":
+                request_id = value.decode("latin-1")[:128]
+                break
+        request_id = request_id or uuid.uuid4().hex
+
+        async def send_with_id(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                MutableHeaders(scope=message)[CORRELATION_ID_HEADER] = request_id
+            await send(message)
+
+        token = correlation_id.set(request_id)
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            correlation_id.reset(token)
+
+
+def configure_logging() -> QueueListener:
+    """Routes the records of the root logger through a queue to a thread writing them to stdout.
+
+    Configured from the environment:
+        - LOG_LEVEL: minimum level logged, INFO by default
+        - LOG_FORMAT: json (default) or text
+        - LOG_SAMPLE_RATE: fraction of the records below WARNING kept, 1 by default
+        - LOG_RATE_LIMIT: records below WARNING kept per second per call site, 0 (unlimited) by default
+        - LOG_QUEUE_SIZE: records waiting to be written before new ones are dropped, 10000 by default
+
+    Returns:
+        the started listener, stopped at interpreter exit after writing the records still queued
+    """
+
+    if environ.get("LOG_FORMAT", "json").lower() == "text":
+        formatter = logging.Formatter(
+            "[%(asctime)s] [%(filename)s:%(lineno)d] [%(correlation_id)s] %(levelname)s - %(message)s",
+            "%d-%m %H:%M:%S",
+        )
+    else:
+        formatter = JSONFormatter()
+    stream_handler = logging.StreamHandler(sys.stdout)
+    stream_handler.setFormatter(formatter)
+
+    queue_handler = NonBlockingQueueHandler(queue.Queue(int(environ.get("LOG_QUEUE_SIZE", 10000))))
+    queue_handler.addFilter(
+        SamplingFilter(float(environ.get("LOG_SAMPLE_RATE", 1.0)), int(environ.get("LOG_RATE_LIMIT", 0)))
+    )
+    queue_handler.addFilter(CorrelationIdFilter())
+
+    root = logging.getLogger()
+    root.setLevel(environ.get("LOG_LEVEL", "INFO").upper())
+    root.addHandler(queue_handler)
+
+    listener = QueueListener(queue_handler.queue, stream_handler)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
+
+
+logger = logging.getLogger()
+listener = configure_logging()
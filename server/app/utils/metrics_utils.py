@@ -0,0 +1,212 @@
+import functools
+import inspect
+import time
+from typing import Any, Callable, Dict, Iterator, Optional, TypeVar
+
+from asyncpg import Connection, Pool
+from prometheus_client import Counter, Gauge, Histogram
+from prometheus_client.core import GaugeMetricFamily
+from prometheus_client.registry import Collector
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+# Finer than the default buckets at the low end, most queries and pool acquisitions take a few milliseconds
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+SERVICE_METHOD_SECONDS = Histogram(
+    "service_method_duration_seconds",
+    "Latency of service method calls",
+    ["service", "method"],
+    buckets=LATENCY_BUCKETS,
+)
+SERVICE_METHOD_IN_FLIGHT = Gauge(
+    "service_method_in_flight", "Service method calls currently running", ["service", "method"]
+)
+SERVICE_METHOD_ERRORS = Counter(
+    "service_method_errors", "Service method calls that raised", ["service", "method", "exception"]
+)
+
+DB_POOL_ACQUIRE_SECONDS = Histogram(
+    "db_pool_acquire_duration_seconds",
+    "Time spent waiting for a connection from the pool",
+    ["pool"],
+    buckets=LATENCY_BUCKETS,
+)
+DB_POOL_ACQUIRE_WAITING = Gauge("db_pool_acquire_waiting", "Callers currently waiting for a connection", ["pool"])
+DB_POOL_ACQUIRE_ERRORS = Counter(
+    "db_pool_acquire_errors", "Failed attempts to acquire a connection from the pool", ["pool", "exception"]
+)
+DB_POOL_CONNECTION_HELD_SECONDS = Histogram(
+    "db_pool_connection_held_seconds",
+    "Time a connection is held before being released to the pool",
+    ["pool"],
+    buckets=LATENCY_BUCKETS,
+)
+DB_REPLICA_HEALTHY = Gauge("db_replica_healthy", "Whether the replica passed its last health check", ["pool"])
+DB_REPLICA_LAG_SECONDS = Gauge("db_replica_lag_seconds", "Replication lag measured by the last health check", ["pool"])
+
+LOADER_BATCH_SIZE = Histogram(
+    "loader_batch_size",
+    "Keys fetched per batch by the lookup loaders",
+    ["loader"],
+    buckets=(1, 2, 5, 10, 25, 50, 100, 250, 500, 1000),
+)
+
+HTTP_REQUEST_SECONDS = Histogram(
+    "http_request_duration_seconds", "Latency of HTTP requests", ["method", "route", "status"]
+)
+HTTP_REQUESTS_IN_FLIGHT = Gauge("http_requests_in_flight", "HTTP requests currently being handled")
+
+ServiceClass = TypeVar("ServiceClass", bound=type)
+
+
+def instrumented(cls: ServiceClass) -> ServiceClass:
+    """Records the latency, concurrency and errors of every public coroutine method of a service class.
+
+    Methods returning async iterators are not wrapped, the work happens while the caller iterates.
+    """
+
+    for name, attribute in list(vars(cls).items()):
+        if name.startswith("_") or not inspect.iscoroutinefunction(attribute):
+            continue
+        setattr(cls, name, _timed(cls.__name__, name, attribute))
+    return cls
+
+
+def _timed(service: str, method: str, function: Callable[..., Any]) -> Callable[..., Any]:
+    seconds = SERVICE_METHOD_SECONDS.labels(service, method)
+    in_flight = SERVICE_METHOD_IN_FLIGHT.labels(service, method)
+
+    @functools.wraps(function)
+    async def wrapper(*args: Any, **kwargs: Any) -> Any:
+        in_flight.inc()
+        start = time.perf_counter()
+        try:
+            return await function(*args, **kwargs)
+        except Exception as e:
+            SERVICE_METHOD_ERRORS.labels(service, method, type(e).__name__).inc()
+            raise
+        finally:
+            seconds.observe(time.perf_counter() - start)
+            in_flight.dec()
+
+    return wrapper
+
+
+class InstrumentedAcquireContext:
+    def __init__(self, pool: "InstrumentedPool", timeout: Optional[float]):
+        self.instrumented = pool
+        self.pool = pool.pool
+        self.timeout = timeout
+        self.connection: Optional[Connection] = None
+        self.acquired_at = 0.0
+
+    async def __aenter__(self) -> Connection:
+        self.instrumented.waiting.inc()
+        start = time.perf_counter()
+        try:
+            self.connection = await self.pool.acquire(timeout=self.timeout)
+        except Exception as e:
+            DB_POOL_ACQUIRE_ERRORS.labels(self.instrumented.name, type(e).__name__).inc()
+            raise
+        finally:
+            self.instrumented.waiting.dec()
+            self.instrumented.acquire_seconds.observe(time.perf_counter() - start)
+        self.acquired_at = time.perf_counter()
+        return self.connection
+
+    async def __aexit__(self, *exc_info: Any):
+        try:
+            await self.pool.release(self.connection)
+        finally:
+            self.instrumented.held_seconds.observe(time.perf_counter() - self.acquired_at)
+            self.connection = None
+
+
+class InstrumentedPool:
+    """Connection pool recording how long callers wait for a connection and how long they hold it.
+
+    Only `async with pool.acquire()` is instrumented, every other attribute is the one of the wrapped pool.
+    """
+
+    def __init__(self, pool: Pool, name: str):
+        self.pool = pool
+        self.name = name
+        self.waiting = DB_POOL_ACQUIRE_WAITING.labels(name)
+        self.acquire_seconds = DB_POOL_ACQUIRE_SECONDS.labels(name)
+        self.held_seconds = DB_POOL_CONNECTION_HELD_SECONDS.labels(name)
+
+    def acquire(self, *, timeout: Optional[float] = None) -> InstrumentedAcquireContext:
+        return InstrumentedAcquireContext(self, timeout)
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.pool, name)
+
+
+class PoolCollector(Collector):
+    """Reports the size of the connection pools at scrape time."""
+
+    def __init__(self, get_pools: Callable[[], Dict[str, Pool]]):
+        self.get_pools = get_pools
+
+    def collect(self) -> Iterator[GaugeMetricFamily]:
+        pools = self.get_pools()
+        if not pools:
+            return
+        families = {
+            "get_size": GaugeMetricFamily("db_pool_connections", "Open connections in the pool", labels=["pool"]),
+            "get_idle_size": GaugeMetricFamily(
+                "db_pool_idle_connections", "Idle connections in the pool", labels=["pool"]
+            ),
+            "get_min_size": GaugeMetricFamily("db_pool_min_connections", "Minimum size of the pool", labels=["pool"]),
+            "get_max_size": GaugeMetricFamily("db_pool_max_connections", "Maximum size of the pool", labels=["pool"]),
+        }
+        for name, pool in pools.items():
+            for method, family in families.items():
+                family.add_metric([name], getattr(pool, method)())
+        yield from families.values()
+
+
+def route_template(scope: Scope) -> str:
+    """Returns the path of a handled request with its path parameters in place of their values.
+
+    Included routers only know the part of the path after their prefix, the template is rebuilt from the full
+    path instead, e.g. /api/v1/books/{id}. Requests that matched no route are "unmatched" so that arbitrary paths
+    do not create new series.
+    """
+
+    if scope.get("route") is None:
+        return "unmatched"
+    parameters = {str(value): name for name, value in scope.get("path_params", {}).items()}
+    return "/".join(
+        f"{{{parameters[segment]}}}" if segment in parameters else segment for segment in scope["path"].split("/")
+    )
+
+
+class MetricsMiddleware:
+    """Records the latency of every HTTP request per method, route template and status code."""
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+
+        async def send_with_status(message: Message) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        HTTP_REQUESTS_IN_FLIGHT.inc()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            HTTP_REQUEST_SECONDS.labels(scope["method"], route_template(scope), str(status)).observe(
+                time.perf_counter() - start
+            )
+            HTTP_REQUESTS_IN_FLIGHT.dec()
@@ -0,0 +1,53 @@
+import base64
+import json
+from datetime import datetime
+from typing import Any, Dict, Iterable, Optional
+
+DEFAULT_PAGE_SIZE: int = 50
+MAX_PAGE_SIZE: int = 500
+
+
+def encode_cursor(position: Dict[str, Any]) -> str:
+    """Encodes the keyset position of the last row of a page into an opaque cursor.
+
+    Datetime values are serialized as ISO 8601 strings and restored by decode_cursor.
+
+    Args:
+        position: mapping of the ordering columns to their values for the last row of the page
+    """
+
+    payload = {
+        k: {"dt": v.isoformat()} if isinstance(v, datetime) else v
+        for k, v in position.items()
+    }
+    raw = json.dumps(payload, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: Optional[str], keys: Iterable[str]) -> Optional[Dict[str, Any]]:
+    """Decodes a cursor produced by encode_cursor back into the keyset position.
+
+    Args:
+        cursor: opaque cursor string received from the client
+        keys: keyset columns the position must hold
+
+    Raises:
+        ValueError: if the cursor is malformed or misses any of the keys
+    """
+
+    if not cursor:
+        return None
+
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        payload = json.loads(raw)
+        position = {
+            k: datetime.fromisoformat(v["dt"]) if isinstance(v, dict) else v
+            for k, v in payload.items()
+        }
+    except (ValueError, TypeError, KeyError, AttributeError) as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
+
+    if any(key not in position for key in keys):
+        raise ValueError(f"Invalid cursor: {cursor}")
+    return position
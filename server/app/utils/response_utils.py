@@ -0,0 +1,55 @@
+import functools
+import inspect
+from typing import Any, Callable
+
+from fastapi.datastructures import DefaultPlaceholder
+from fastapi.responses import JSONResponse
+from fastapi.routing import APIRoute
+from pydantic_core import to_json
+from starlette.responses import Response
+
+
+class JSONBytesResponse(JSONResponse):
+    """JSON response rendered by pydantic-core.
+
+    Serializes pydantic models, datetimes, dates and enums natively, so the content does not need to be converted to
+    plain python objects first. The output is the same compact UTF-8 JSON as JSONResponse.
+    """
+
+    def render(self, content: Any) -> bytes:
+        return to_json(content)
+
+
+class JSONRoute(APIRoute):
+    """Route returning the result of its endpoint as a JSONBytesResponse.
+
+    FastAPI converts the result of an endpoint without a response model to plain python objects with
+    jsonable_encoder before rendering it, which costs far more than the rendering itself for lists of models.
+    The endpoint is wrapped so that its result is rendered directly instead. Endpoints with a response model,
+    or returning a Response, are left to FastAPI. Headers set on an injected Response parameter are not carried
+    over, return a Response to set headers.
+    """
+
+    def __init__(self, path: str, endpoint: Callable[..., Any], **kwargs: Any):
+        # Routes are copied with their endpoint when a router is included in another one
+        endpoint = getattr(endpoint, "unwrapped", endpoint)
+        if inspect.iscoroutinefunction(endpoint):
+            endpoint = self.render_directly(endpoint)
+        super().__init__(path, endpoint, **kwargs)
+
+    def render_directly(self, endpoint: Callable[..., Any]) -> Callable[..., Any]:
+        @functools.wraps(endpoint)
+        async def wrapper(*args: Any, **kwargs: Any) -> Any:
+            content = await endpoint(*args, **kwargs)
+            if isinstance(content, Response) or self.response_model is not None:
+                return content
+
+            response_class = self.response_class
+            if isinstance(response_class, DefaultPlaceholder):
+                response_class = response_class.value
+            if not issubclass(response_class, JSONBytesResponse):
+                return content
+            return response_class(content, status_code=self.status_code or 200)
+
+        wrapper.unwrapped = endpoint
+        return wrapper
@@ -0,0 +1,126 @@
+from os import environ
+from typing import Dict, Iterable, List, Tuple
+
+from app.utils.logging_utils import logger
+
+# Column order of the tables, dynamic INSERT / UPDATE shapes always list their columns in this order so that
+# the same column set always produces the same statement text
+TABLE_COLUMNS: Dict[str, Tuple[str, ...]] = {
+    "book": (
+        "title",
+        "authors",
+        "isbn",
+        "isbn13",
+        "language_code",
+        "num_pages",
+        "stock_quantity",
+        "publication_date",
+        "publisher",
+    ),
+    "user": ("name", "email"),
+}
+
+
+class StatementRegistry:
+    """Central registry of the SQL statements executed by the services.
+
+    Static statements are registered once at import time as templates where `{schema}` is substituted with
+    DB_SCHEMA on first use. They are prepared on every new pool connection by DatabaseConnectionPool.
+    Dynamic INSERT / UPDATE shapes are compiled once per column set and prepared on first use per connection.
+    Since asyncpg caches prepared statements by query text, returning the exact same text for a given shape
+    is what lets every later execution skip parsing and planning.
+    """
+
+    templates: Dict[str, str] = {}
+    prepare_on_init: Dict[str, bool] = {}
+    statements: Dict[str, str] = {}
+    dynamic_statements: Dict[Tuple[str, str, Tuple[str, ...]], str] = {}
+
+    def __init__(self):
+        raise NotImplementedError(f"StatementRegistry cannot be instantiated")
+
+    @classmethod
+    def register(cls, name: str, template: str, prepare_on_init: bool = True) -> str:
+        """Registers a statement template under the given name and returns the name.
+
+        Statements referencing temporary tables cannot be prepared on a fresh connection and should pass
+        prepare_on_init=False, they are prepared on first use instead.
+
+        Raises:
+            ValueError: if a different template is already registered under the name
+        """
+
+        if cls.templates.get(name, template) != template:
+            raise ValueError(f"Statement {name} is already registered")
+        cls.templates[name] = template
+        cls.prepare_on_init[name] = prepare_on_init
+        return name
+
+    @classmethod
+    def get(cls, name: str) -> str:
+        """Returns the text of a registered statement."""
+
+        statement = cls.statements.get(name)
+        if statement is None:
+            statement = cls.templates[name].replace("{schema}", environ.get("DB_SCHEMA"))
+            cls.statements[name] = statement
+        return statement
+
+    @classmethod
+    def all(cls) -> Iterable[str]:
+        """Returns the text of every registered static statement to prepare on a new connection."""
+
+        return [cls.get(name) for name in cls.templates if cls.prepare_on_init[name]]
+
+    @classmethod
+    def insert(cls, table: str, columns: Iterable[str]) -> Tuple[str, List[str]]:
+        """Returns the INSERT ... RETURNING * statement for a column set and the order its parameters bind in.
+
+        Raises:
+            ValueError: if a column does not belong to the table
+        """
+
+        ordered = cls._order_columns(table, columns)
+        key = ("insert", table, ordered)
+        statement = cls.dynamic_statements.get(key)
+        if statement is None:
+            placeholders = ", ".join(f"${i + 1}" for i in range(len(ordered)))
+            statement = (
+                f"INSERT INTO {environ.get('DB_SCHEMA')}.{table} "
+                f"({', '.join(ordered)}) VALUES ({placeholders}) RETURNING *;"
+            )
+            cls.dynamic_statements[key] = statement
+            logger.info("Compiled new %s insert shape: %s", table, ordered)
+        return statement, list(ordered)
+
+    @classmethod
+    def update(cls, table: str, columns: Iterable[str]) -> Tuple[str, List[str]]:
+        """Returns the UPDATE ... WHERE id = $1 RETURNING * statement for a column set.
+
+        The id binds as the first parameter followed by the columns in the returned order.
+
+        Raises:
+            ValueError: if a column does not belong to the table
+        """
+
+        ordered = cls._order_columns(table, columns)
+        key = ("update", table, ordered)
+        statement = cls.dynamic_statements.get(key)
+        if statement is None:
+            assignments = ["updated_at = NOW()"] + [f"{c} = ${i + 2}" for i, c in enumerate(ordered)]
+            statement = (
+                f"UPDATE {environ.get('DB_SCHEMA')}.{table} "
+                f"SET {', '.join(assignments)} WHERE id = $1 RETURNING *;"
+            )
+            cls.dynamic_statements[key] = statement
+            logger.info("Compiled new %s update shape: %s", table, ordered)
+        return statement, list(ordered)
+
+    @staticmethod
+    def _order_columns(table: str, columns: Iterable[str]) -> Tuple[str, ...]:
+        table_columns = TABLE_COLUMNS[table]
+        columns = set(columns)
+        unknown = columns.difference(table_columns)
+        if unknown:
+            raise ValueError(f"Unknown {table} column(s): {sorted(unknown)}")
+        return tuple(c for c in table_columns if c in columns)
@@ -0,0 +1,132 @@
+#!/usr/bin/python3
+"""Concurrency benchmark of the checkout flow against the database configured in .env.
+
+Creates throwaway books with a few copies each and one user per request, then fires all checkouts at once through
+TransactionService.checkout, spread evenly over the books. With one book the checkouts contend on its availability
+row, with as many books as checkouts they share no row of their own and only contend on what every write touches.
+Reports how many copies were lent out, the p50/p99 latency and the throughput. Everything created by the benchmark
+is deleted afterwards.
+
+    python -m benchmarks.checkout_benchmark [concurrent_checkouts] [copies_per_book] [books]
+"""
+
+import asyncio
+import logging
+import os
+import statistics
+import sys
+import time
+import uuid
+from typing import Awaitable, Callable, List, Tuple
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from app.database import DatabaseConnectionPool
+from app.entities.transctions import CheckoutStatus
+from app.services.book_service import BookService
+from app.services.transaction_service import TransactionService
+from app.services.user_service import UserService
+from app.utils.logging_utils import logger
+
+
+async def checkout(user_id: int, book_id: int) -> bool:
+    result = await TransactionService().checkout(user_id, book_id)
+    return result.status == CheckoutStatus.CHECKED_OUT
+
+
+async def timed(flow: Callable[[int, int], Awaitable[bool]], user_id: int, book_id: int) -> Tuple[bool, float]:
+    start = time.perf_counter()
+    lent = await flow(user_id, book_id)
+    return lent, time.perf_counter() - start
+
+
+async def reset(book_ids: List[int], copies: int):
+    schema = os.environ.get("DB_SCHEMA")
+    async with DatabaseConnectionPool.get().acquire() as connection:
+        await connection.execute(f"DELETE FROM {schema}.transaction WHERE book_id = ANY($1::int[]);", book_ids)
+        await connection.execute(
+            f"UPDATE {schema}.book_availability SET available_quantity = $2 WHERE book_id = ANY($1::int[]);",
+            book_ids,
+            copies,
+        )
+
+
+async def run(
+    name: str, flow: Callable[[int, int], Awaitable[bool]], user_ids: List[int], book_ids: List[int], copies: int
+):
+    await reset(book_ids, copies)
+    start = time.perf_counter()
+    outcomes = await asyncio.gather(
+        *(timed(flow, user_id, book_ids[i % len(book_ids)]) for i, user_id in enumerate(user_ids))
+    )
+    elapsed = time.perf_counter() - start
+
+    schema = os.environ.get("DB_SCHEMA")
+    async with DatabaseConnectionPool.get().acquire() as connection:
+        available = await connection.fetchval(
+            f"SELECT SUM(available_quantity) FROM {schema}.book_availability WHERE book_id = ANY($1::int[]);",
+            book_ids,
+        )
+
+    lent = sum(1 for is_lent, _ in outcomes if is_lent)
+    stock = copies * len(book_ids)
+    latencies = sorted(latency * 1000 for _, latency in outcomes)
+    p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+    print(
+        f"{name:<10}{len(book_ids):>7}{lent:>8}{stock:>8}{available:>11}{'yes' if lent > stock else 'no':>10}"
+        f"{statistics.median(latencies):>10.1f}{p99:>10.1f}{len(outcomes) / elapsed:>10.0f}"
+    )
+
+
+async def main(concurrent_checkouts: int, copies: int, n_books: int):
+    logger.setLevel(logging.WARNING)
+    await DatabaseConnectionPool.create()
+
+    run_id = uuid.uuid4().hex[:8]
+    books = [
+        await BookService().create_new_book(
+            {
+                "title": f"Checkout benchmark {run_id}-{i}",
+                "authors": ["Benchmark"],
+                "isbn": f"{run_id}-{i}",
+                "isbn13": f"{run_id}-{i}",
+                "language_code": "eng",
+                "num_pages": 1,
+                "stock_quantity": copies,
+                "publisher": "Benchmark",
+            }
+        )
+        for i in range(n_books)
+    ]
+    book_ids = [book.id for book in books]
+    users = [
+        await UserService().create_new_user(f"checkout-{run_id}-{i}@example.com", "Benchmark")
+        for i in range(concurrent_checkouts)
+    ]
+    user_ids = [user.id for user in users]
+
+    try:
+        print(
+            f"{'flow':<10}{'books':>7}{'lent':>8}{'copies':>8}{'available':>11}{'oversold':>10}"
+            f"{'p50 ms':>10}{'p99 ms':>10}{'per s':>10}"
+        )
+        await run("checkout", checkout, user_ids, book_ids, copies)
+    finally:
+        schema = os.environ.get("DB_SCHEMA")
+        async with DatabaseConnectionPool.get().acquire() as connection:
+            await connection.execute(f"DELETE FROM {schema}.transaction WHERE book_id = ANY($1::int[]);", book_ids)
+            await connection.execute(f"DELETE FROM {schema}.user WHERE id = ANY($1::int[]);", user_ids)
+            await connection.execute(f"DELETE FROM {schema}.book WHERE id = ANY($1::int[]);", book_ids)
+        await DatabaseConnectionPool.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(
+        main(
+            int(sys.argv[1]) if len(sys.argv) > 1 else 200,
+            int(sys.argv[2]) if len(sys.argv) > 2 else 1,
+            int(sys.argv[3]) if len(sys.argv) > 3 else 1,
+        )
+    )
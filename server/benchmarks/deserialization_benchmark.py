@@ -0,0 +1,86 @@
+#!/usr/bin/python3
+"""Micro-benchmark of deserialize_records for the Book, User and Transactions models.
+
+Compares the original per-record dict copy + model __init__, full validation and the trusted fast path.
+Runs offline on synthetic rows shaped like the asyncpg records of each table.
+
+    python -m benchmarks.deserialization_benchmark [n_rows]
+"""
+
+import sys
+import time
+from datetime import date, datetime
+from typing import Any, Callable, Dict, List
+
+from app.models.book import Book
+from app.models.transactions import Transactions
+from app.models.user import User
+from app.utils.deserialization_utils import deserialize_records
+
+
+def book_row(i: int) -> Dict[str, Any]:
+    return {
+        "id": i,
+        "title": f"Harry Potter and the Half-Blood Prince {i}",
+        "authors": ["J.K. Rowling", "Mary GrandPré"],
+        "isbn": "0439785960",
+        "isbn13": "9780439785969",
+        "language_code": "eng",
+        "num_pages": 652,
+        "stock_quantity": 3,
+        "publication_date": date(2006, 9, 16),
+        "publisher": "Scholastic Inc.",
+        "created_at": datetime.now(),
+        "updated_at": datetime.now(),
+    }
+
+
+def user_row(i: int) -> Dict[str, Any]:
+    return {
+        "id": i,
+        "name": f"User {i}",
+        "email": f"user{i}@example.com",
+        "created_at": datetime.now(),
+        "updated_at": datetime.now(),
+    }
+
+
+def transaction_row(i: int) -> Dict[str, Any]:
+    return {
+        "id": i,
+        "user_id": i % 1000,
+        "book_id": i % 5000,
+        "status": "PENDING" if i % 3 else "COMPLETED",
+        "created_at": datetime.now(),
+        "updated_at": datetime.now(),
+    }
+
+
+def baseline(rows: List[Dict[str, Any]], dataclass) -> list:
+    # Original implementation of deserialize_records
+    return list(map(lambda x: dataclass(**{k: v for k, v in x.items()}), rows))
+
+
+def rows_per_second(fn: Callable[[], Any], n_rows: int, repeat: int = 3) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return n_rows / best
+
+
+def main(n_rows: int):
+    print(f"{'model':<14}{'baseline':>14}{'validated':>14}{'trusted':>14}{'speedup':>10}  (rows/s)")
+    for dataclass, make_row in ((Book, book_row), (User, user_row), (Transactions, transaction_row)):
+        rows = [make_row(i) for i in range(n_rows)]
+        before = rows_per_second(lambda: baseline(rows, dataclass), n_rows)
+        validated = rows_per_second(lambda: deserialize_records(rows, dataclass, validate=True), n_rows)
+        trusted = rows_per_second(lambda: deserialize_records(rows, dataclass, validate=False), n_rows)
+        print(
+            f"{dataclass.__name__:<14}{before:>14,.0f}{validated:>14,.0f}{trusted:>14,.0f}{trusted / before:>9.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100_000)
@@ -0,0 +1,388 @@
+#!/usr/bin/python3
+"""End-to-end load test of lib-next against the database configured in .env.
+
+Starts the app with uvicorn, or uses the server at --url, seeds users and books through the API and then has
+--concurrency virtual users drive a library workload for --duration seconds: browsing the catalog, looking up
+books (revalidating with their ETag like a browser), checking out and returning books, querying dues and
+importing batches of books. Popular books are looked up and borrowed far more often than the rest.
+
+Reports the throughput and the p50/p95/p99 latency of every endpoint. Exits with status 1 when a latency budget
+or the error rate is exceeded, e.g.
+
+    python -m benchmarks.load_test --duration 60 --concurrency 32 --budget "*:p99=250" \\
+        --budget "POST /api/v1/transactions:p95=100"
+
+Everything created by the load test is deleted afterwards unless --keep is passed.
+"""
+
+import argparse
+import asyncio
+import itertools
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+import uuid
+from collections import defaultdict
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+import asyncpg
+import httpx
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from app.utils.database_utils import generate_dsn
+
+API = "/api/v1"
+
+# Relative frequency of every action of a virtual user
+WORKLOAD: Dict[str, int] = {
+    "browse": 30,
+    "lookup": 30,
+    "checkout": 12,
+    "return": 10,
+    "dues": 10,
+    "top_dues": 3,
+    "import": 2,
+}
+
+PERCENTILES = {"p50": 0.50, "p95": 0.95, "p99": 0.99}
+
+# Messages of the requests the library refuses under load by design, counted apart from the errors
+REFUSALS = ("Book is not in stock", "User has to settle their credit first")
+
+
+@dataclass
+class EndpointStats:
+    latencies: List[float] = field(default_factory=list)
+    errors: int = 0
+    refusals: int = 0
+
+    def percentile(self, quantile: float) -> float:
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * quantile))] if ordered else 0.0
+
+
+@dataclass
+class Budget:
+    endpoint: str
+    percentile: str
+    milliseconds: float
+
+    @classmethod
+    def parse(cls, value: str) -> "Budget":
+        key, _, milliseconds = value.rpartition("=")
+        endpoint, _, percentile = key.rpartition(":")
+        if not endpoint or percentile not in PERCENTILES:
+            raise argparse.ArgumentTypeError(f"Expected ENDPOINT:p50|p95|p99=MS, got {value}")
+        return cls(endpoint, percentile, float(milliseconds))
+
+
+class LoadTest:
+    def __init__(self, client: httpx.AsyncClient, run_id: str):
+        self.client = client
+        self.run_id = run_id
+        self.stats: Dict[str, EndpointStats] = defaultdict(EndpointStats)
+        self.recording = False
+        self.user_ids: List[int] = []
+        self.book_ids: List[int] = []
+        # Zipf-like popularity, the first books are borrowed and looked up far more often
+        self.book_weights: List[float] = []
+        self.book_numbers = itertools.count()
+
+    async def request(
+        self, endpoint: str, method: str, url: str, expect: Optional[str] = None, **kwargs
+    ) -> Optional[httpx.Response]:
+        """Sends a request, recording its latency and whether it failed once the warmup is over.
+
+        The controllers answer most failures with a 200 and a {"message": ...} body, or null, so these count as
+        errors too, unless the message is one of REFUSALS. expect is the key the JSON object answered by a write
+        must hold, e.g. the id of the created row.
+        """
+
+        start = time.perf_counter()
+        try:
+            response = await self.client.request(method, url, **kwargs)
+        except httpx.HTTPError:
+            response = None
+        elapsed = time.perf_counter() - start
+        if self.recording:
+            stats = self.stats[endpoint]
+            stats.latencies.append(elapsed)
+            outcome = self.outcome(response, expect)
+            if outcome == "error":
+                stats.errors += 1
+            elif outcome == "refused":
+                stats.refusals += 1
+        return response
+
+    @staticmethod
+    def outcome(response: Optional[httpx.Response], expect: Optional[str]) -> str:
+        if response is None or response.status_code >= 400:
+            return "error"
+        if response.status_code != 200 or "json" not in response.headers.get("content-type", ""):
+            return "ok"
+        try:
+            body = response.json()
+        except ValueError:
+            return "error"
+        if isinstance(body, dict) and "message" in body:
+            return "refused" if body["message"] in REFUSALS else "error"
+        if expect is not None and not (isinstance(body, dict) and body.get(expect) is not None):
+            return "error"
+        return "ok"
+
+    def new_books(self, count: int) -> List[Dict]:
+        books = []
+        for _ in range(count):
+            i = next(self.book_numbers)
+            books.append(
+                {
+                    "title": f"Load test {self.run_id} volume {i}",
+                    "authors": [f"Author {i % 997}", f"Co-author {i % 89}"][: 1 + i % 2],
+                    "isbn": f"{self.run_id}{i:05d}",
+                    "isbn13": f"{self.run_id}{i:05d}",
+                    "language_code": random.choice(["eng", "en-US", "spa", "fre", "ger"]),
+                    "num_pages": random.randint(80, 1200),
+                    "stock_quantity": random.randint(1, 5),
+                    "publisher": f"Publisher {i % 31}",
+                }
+            )
+        return books
+
+    async def import_books(self, count: int) -> List[int]:
+        response = await self.request(
+            "POST /api/v1/books/batch", "POST", f"{API}/books/batch", expect="results", json=self.new_books(count)
+        )
+        if response is None or response.status_code >= 400:
+            return []
+        return [result["id"] for result in response.json().get("results", []) if result.get("id")]
+
+    async def seed(self, users: int, books: int):
+        for start in range(0, books, 100):
+            self.book_ids += await self.import_books(min(100, books - start))
+        self.book_weights = [1 / (rank + 1) for rank in range(len(self.book_ids))]
+
+        async def create_user(i: int) -> Optional[int]:
+            response = await self.request(
+                "POST /api/v1/users",
+                "POST",
+                f"{API}/users",
+                expect="id",
+                json={"email": f"load-{self.run_id}-{i}@example.com", "name": f"Reader {i}"},
+            )
+            return response.json().get("id") if response is not None and response.status_code < 400 else None
+
+        for start in range(0, users, 50):
+            created = await asyncio.gather(*(create_user(i) for i in range(start, min(users, start + 50))))
+            self.user_ids += [user_id for user_id in created if user_id]
+        if not self.user_ids or not self.book_ids:
+            raise RuntimeError("Could not seed users and books, is the database schema up to date?")
+
+    def popular_book(self) -> int:
+        return random.choices(self.book_ids, self.book_weights)[0]
+
+    async def virtual_user(self, deadline: float):
+        etags: Dict[int, str] = {}
+        loans: List[int] = []
+
+        async def browse():
+            response = await self.request("GET /api/v1/books", "GET", f"{API}/books", params={"limit": 20})
+            if response is None or response.status_code != 200:
+                return
+            cursor = response.json().get("next_cursor")
+            if cursor and random.random() < 0.5:
+                await self.request("GET /api/v1/books", "GET", f"{API}/books", params={"limit": 20, "cursor": cursor})
+
+        async def lookup():
+            book_id = self.popular_book()
+            headers = {"If-None-Match": etags[book_id]} if book_id in etags else {}
+            response = await self.request("GET /api/v1/books/{id}", "GET", f"{API}/books/{book_id}", headers=headers)
+            if response is not None and "etag" in response.headers:
+                etags[book_id] = response.headers["etag"]
+
+        async def checkout():
+            response = await self.request(
+                "POST /api/v1/transactions",
+                "POST",
+                f"{API}/transactions",
+                expect="id",
+                json={"user_id": random.choice(self.user_ids), "book_id": self.popular_book()},
+            )
+            if response is not None and response.status_code < 400:
+                transaction = response.json()
+                if isinstance(transaction, dict) and "id" in transaction:
+                    loans.append(transaction["id"])
+
+        async def return_book():
+            if not loans:
+                await checkout()
+                return
+            transaction_id = loans.pop(random.randrange(len(loans)))
+            await self.request(
+                "PATCH /api/v1/transactions/{transaction_id}",
+                "PATCH",
+                f"{API}/transactions/{transaction_id}",
+                expect="id",
+                params={"status": "COMPLETED"},
+            )
+
+        async def dues():
+            user_id = random.choice(self.user_ids)
+            await self.request("GET /api/v1/transactions/users/{user_id}", "GET", f"{API}/transactions/users/{user_id}")
+
+        async def top_dues():
+            await self.request("GET /api/v1/users/dues", "GET", f"{API}/users/dues", params={"top": 10})
+
+        async def import_batch():
+            self.book_ids += await self.import_books(25)
+            self.book_weights += [1 / (rank + 1) for rank in range(len(self.book_weights), len(self.book_ids))]
+
+        actions: Dict[str, Callable[[], Awaitable[None]]] = {
+            "browse": browse,
+            "lookup": lookup,
+            "checkout": checkout,
+            "return": return_book,
+            "dues": dues,
+            "top_dues": top_dues,
+            "import": import_batch,
+        }
+        names = list(WORKLOAD)
+        weights = [WORKLOAD[name] for name in names]
+        while time.perf_counter() < deadline:
+            await actions[random.choices(names, weights)[0]]()
+
+    async def run(self, concurrency: int, warmup: float, duration: float) -> float:
+        start = time.perf_counter()
+        deadline = start + warmup + duration
+        workers = [asyncio.create_task(self.virtual_user(deadline)) for _ in range(concurrency)]
+        await asyncio.sleep(warmup)
+        self.recording = True
+        recording_start = time.perf_counter()
+        await asyncio.gather(*workers)
+        return time.perf_counter() - recording_start
+
+    async def cleanup(self):
+        schema = os.environ.get("DB_SCHEMA")
+        connection = await asyncpg.connect(dsn=generate_dsn())
+        try:
+            await connection.execute(
+                f"DELETE FROM {schema}.transaction WHERE user_id = ANY($1::int[]) OR book_id = ANY($2::int[]);",
+                self.user_ids,
+                self.book_ids,
+            )
+            await connection.execute(f"DELETE FROM {schema}.user WHERE id = ANY($1::int[]);", self.user_ids)
+            await connection.execute(f"DELETE FROM {schema}.book WHERE id = ANY($1::int[]);", self.book_ids)
+        finally:
+            await connection.close()
+
+
+def report(stats: Dict[str, EndpointStats], elapsed: float, budgets: List[Budget], max_error_rate: float) -> bool:
+    print(
+        f"{'endpoint':<46}{'requests':>9}{'errors':>8}{'refused':>9}{'req/s':>9}"
+        + "".join(f"{name + ' ms':>10}" for name in PERCENTILES)
+        + f"{'max ms':>10}"
+    )
+    total = EndpointStats()
+    for endpoint in sorted(stats):
+        endpoint_stats = stats[endpoint]
+        total.latencies += endpoint_stats.latencies
+        total.errors += endpoint_stats.errors
+        total.refusals += endpoint_stats.refusals
+    for endpoint, endpoint_stats in sorted(stats.items()) + [("total", total)]:
+        print(
+            f"{endpoint:<46}{len(endpoint_stats.latencies):>9}{endpoint_stats.errors:>8}{endpoint_stats.refusals:>9}"
+            f"{len(endpoint_stats.latencies) / elapsed:>9.1f}"
+            + "".join(f"{endpoint_stats.percentile(q) * 1000:>10.1f}" for q in PERCENTILES.values())
+            + f"{max(endpoint_stats.latencies, default=0) * 1000:>10.1f}"
+        )
+
+    passed = True
+    for budget in budgets:
+        endpoints = sorted(stats) if budget.endpoint == "*" else [budget.endpoint]
+        for endpoint in endpoints:
+            if endpoint not in stats:
+                print(f"Budget {budget.endpoint}:{budget.percentile}: no request to {endpoint}")
+                passed = False
+                continue
+            measured = stats[endpoint].percentile(PERCENTILES[budget.percentile]) * 1000
+            if measured > budget.milliseconds:
+                print(f"Over budget: {endpoint} {budget.percentile} {measured:.1f} ms > {budget.milliseconds:.1f} ms")
+                passed = False
+    error_rate = total.errors / len(total.latencies) if total.latencies else 1.0
+    if error_rate > max_error_rate:
+        print(f"Error rate {error_rate:.2%} over {max_error_rate:.2%}")
+        passed = False
+    return passed
+
+
+def start_server(workers: int) -> Tuple[subprocess.Popen, str]:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(port), "--workers", str(workers)],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    return server, f"http://127.0.0.1:{port}"
+
+
+async def wait_until_ready(client: httpx.AsyncClient, timeout: float = 30):
+    deadline = time.perf_counter() + timeout
+    while True:
+        try:
+            if (await client.get("/")).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        if time.perf_counter() > deadline:
+            raise TimeoutError("Server did not start")
+        await asyncio.sleep(0.2)
+
+
+async def main(args: argparse.Namespace) -> bool:
+    server, url = (None, args.url) if args.url else start_server(args.workers)
+    run_id = uuid.uuid4().hex[:8]
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    try:
+        async with httpx.AsyncClient(base_url=url, limits=limits, timeout=30) as client:
+            await wait_until_ready(client)
+            load_test = LoadTest(client, run_id)
+            try:
+                print(f"Seeding {args.users} users and {args.books} books for run {run_id}")
+                await load_test.seed(args.users, args.books)
+                print(
+                    f"Running {args.concurrency} virtual users for {args.duration:.0f} s after {args.warmup:.0f} s "
+                    f"of warmup against {url}"
+                )
+                elapsed = await load_test.run(args.concurrency, args.warmup, args.duration)
+                return report(load_test.stats, elapsed, args.budget, args.max_error_rate)
+            finally:
+                if not args.keep:
+                    await load_test.cleanup()
+    finally:
+        if server:
+            server.terminate()
+            server.wait()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="End-to-end load test of lib-next")
+    parser.add_argument("--url", help="server to test, by default the app is started with uvicorn")
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn workers of the started app")
+    parser.add_argument("--concurrency", type=int, default=16, help="virtual users")
+    parser.add_argument("--duration", type=float, default=30, help="seconds measured")
+    parser.add_argument("--warmup", type=float, default=5, help="seconds run before measuring")
+    parser.add_argument("--users", type=int, default=200, help="users seeded")
+    parser.add_argument("--books", type=int, default=1000, help="books seeded")
+    parser.add_argument(
+        "--budget", type=Budget.parse, action="append", default=[], help="ENDPOINT:p50|p95|p99=MS, * for every endpoint"
+    )
+    parser.add_argument("--max-error-rate", type=float, default=0.01, help="fraction of requests allowed to fail")
+    parser.add_argument("--keep", action="store_true", help="keep the seeded and created rows")
+    sys.exit(0 if asyncio.run(main(parser.parse_args())) else 1)
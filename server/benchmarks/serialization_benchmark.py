@@ -0,0 +1,65 @@
+#!/usr/bin/python3
+"""Benchmark of the response rendering of the book, user and transaction list endpoints.
+
+Compares FastAPI's default jsonable_encoder + JSONResponse with JSONBytesResponse rendering the models directly,
+and the bytes on the wire of the rendered page uncompressed, with gzip and with brotli at the levels used by
+CompressionMiddleware. Runs offline on synthetic pages shaped like the responses of the endpoints.
+
+    python -m benchmarks.serialization_benchmark [n_items]
+"""
+
+import gzip
+import sys
+import time
+from typing import Any, Callable
+
+import brotli
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+from app.models.book import Book
+from app.models.page import Page
+from app.models.transactions import Transactions
+from app.models.user import User
+from app.utils.deserialization_utils import deserialize_records
+from app.utils.response_utils import JSONBytesResponse
+from benchmarks.deserialization_benchmark import book_row, transaction_row, user_row
+
+
+def milliseconds(fn: Callable[[], Any], repeat: int = 5) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+
+def main(n_items: int):
+    print(
+        f"{'page':<14}{'default ms':>12}{'bytes ms':>10}{'speedup':>9}"
+        f"{'raw KiB':>10}{'gzip KiB':>10}{'gzip ms':>9}{'br KiB':>9}{'br ms':>8}"
+    )
+    for dataclass, make_row in ((Book, book_row), (User, user_row), (Transactions, transaction_row)):
+        items = deserialize_records([make_row(i) for i in range(n_items)], dataclass, validate=True)
+        page = Page[dataclass](items=items, next_cursor="eyJpZCI6IDUwMH0=")
+
+        default = milliseconds(lambda: JSONResponse(jsonable_encoder(page)).body)
+        direct = milliseconds(lambda: JSONBytesResponse(page).body)
+
+        body = JSONBytesResponse(page).body
+        assert body == JSONResponse(jsonable_encoder(page)).body
+        gzipped = gzip.compress(body, compresslevel=6)
+        gzip_time = milliseconds(lambda: gzip.compress(body, compresslevel=6))
+        brotlied = brotli.compress(body, quality=4)
+        brotli_time = milliseconds(lambda: brotli.compress(body, quality=4))
+
+        print(
+            f"{dataclass.__name__:<14}{default:>12.1f}{direct:>10.1f}{default / direct:>8.1f}x"
+            f"{len(body) / 1024:>10.0f}{len(gzipped) / 1024:>10.0f}{gzip_time:>9.1f}"
+            f"{len(brotlied) / 1024:>9.0f}{brotli_time:>8.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 500)
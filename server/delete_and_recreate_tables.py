@@ -8,6 +8,8 @@ import time
 import asyncpg
 from dotenv import load_dotenv
 
+from migrate import upgrade
+
 
 async def drop_all_tables_if_present(connection):
     query = f"""SELECT tablename FROM pg_tables WHERE schemaname = '{schema_name}';"""
@@ -46,8 +48,8 @@ async def create_user_table(connection):
         id              SERIAL PRIMARY KEY,
         name            VARCHAR(64) NULL,
         email           VARCHAR(64) UNIQUE NOT NULL,
-        created_at      TIMESTAMP NOT NULL DEFAULT NOW()
-        updated_at      TIMESTAMP NOT NULL DEFAULT NOW(),
+        created_at      TIMESTAMP NOT NULL DEFAULT NOW(),
+        updated_at      TIMESTAMP NOT NULL DEFAULT NOW()
     );"""
 
     print(f"Executing query: {query}")
@@ -161,6 +163,10 @@ async def rebuild_schema():
     await create_book_table(connection)
     await create_tranasction_table(connection)
 
+    # The ledger tables, the indexes and every later schema change are versioned migrations
+    print(f"Applying migrations in schema: {schema_name}")
+    await upgrade(connection, schema_name)
+
     await connection.close()
     print(f"Closed connection")
 
@@ -0,0 +1,177 @@
+#!/usr/bin/python3
+"""Creates the upcoming monthly partitions of transaction and moves old COMPLETED transactions to the archive.
+
+Run it daily, e.g. from cron. The app creates the upcoming partitions as well, at startup and daily. Transactions created before the archival cutoff are moved to transaction_archive
+in batches, each one committed on its own so that checkouts and returns are never blocked for long. The
+partitions entirely older than the cutoff are then dropped, unless they still hold PENDING transactions.
+Archived transactions stay queryable through the transaction_history view.
+
+    python maintain_transactions.py [--months-ahead 3] [--archive-after-days 365] [--batch-size 10000]
+"""
+
+import argparse
+import asyncio
+import os
+import re
+from datetime import datetime, timedelta
+
+import asyncpg
+from dotenv import load_dotenv
+
+COLUMNS = "id, user_id, book_id, status, created_at, updated_at"
+PARTITION_UPPER_BOUND = re.compile(r"TO \('([^']+)'\)")
+
+
+async def create_partitions(connection, schema_name: str, months_ahead: int) -> int:
+    """Creates the monthly partitions from the current month to months_ahead months from now.
+
+    Returns:
+        number of partitions created
+    """
+
+    query = f"""SELECT {schema_name}.create_transaction_partitions(
+        CURRENT_DATE, (CURRENT_DATE + make_interval(months => $1))::DATE
+    );"""
+    print(f"Executing query: {query}")
+    return await connection.fetchval(query, months_ahead)
+
+
+async def archive_transactions(connection, schema_name: str, before: datetime, batch_size: int) -> int:
+    """Moves the COMPLETED transactions created before the cutoff to transaction_archive, batch_size at a time.
+
+    A transaction returned to PENDING while its batch runs is left in place.
+
+    Returns:
+        number of transactions archived
+    """
+
+    query = f"""WITH batch AS (
+        SELECT id, created_at FROM {schema_name}.transaction
+        WHERE id > $3 AND created_at < $1 AND status = 'COMPLETED'
+        ORDER BY id
+        LIMIT $2
+    ), moved AS (
+        DELETE FROM {schema_name}.transaction t
+        USING batch b
+        WHERE t.id = b.id AND t.created_at = b.created_at AND t.status = 'COMPLETED'
+        RETURNING t.*
+    ), archived AS (
+        INSERT INTO {schema_name}.transaction_archive ({COLUMNS})
+        SELECT {COLUMNS} FROM moved
+    )
+    SELECT (SELECT MAX(id) FROM batch) AS last_id, (SELECT COUNT(*) FROM moved) AS archived;"""
+    print(f"Executing query: {query}")
+
+    last_id, archived = 0, 0
+    while True:
+        result = await connection.fetchrow(query, before, batch_size, last_id)
+        if result["last_id"] is None:
+            return archived
+        last_id = result["last_id"]
+        archived += result["archived"]
+        print(f"Archived {archived} transaction(s) up to id {last_id}")
+
+
+async def drop_archived_partitions(connection, schema_name: str, before: datetime) -> int:
+    """Drops the monthly partitions entirely older than the cutoff.
+
+    Their remaining COMPLETED transactions are archived. Partitions still holding PENDING transactions are kept,
+    the default partition only takes the rows created before the monthly partitions. Detaching a partition
+    briefly locks out every query of the transaction table.
+
+    Returns:
+        number of partitions dropped
+    """
+
+    query = f"""SELECT c.relname AS name, pg_get_expr(c.relpartbound, c.oid) AS bound
+    FROM pg_inherits i
+    JOIN pg_class c ON c.oid = i.inhrelid
+    WHERE i.inhparent = '{schema_name}.transaction'::regclass;"""
+    print(f"Executing query: {query}")
+    partitions = await connection.fetch(query)
+
+    dropped = 0
+    for partition in partitions:
+        upper_bound = PARTITION_UPPER_BOUND.search(partition["bound"])
+        if not upper_bound or datetime.fromisoformat(upper_bound.group(1)) > before:
+            continue
+
+        name = f"{schema_name}.{partition['name']}"
+        pending_query = f"SELECT EXISTS (SELECT 1 FROM {name} WHERE status <> 'COMPLETED');"
+        if await connection.fetchval(pending_query):
+            print(f"Keeping partition {name}, it holds PENDING transactions")
+            continue
+
+        # Checked again once detached, a transaction may have been returned to PENDING in the meantime
+        transaction = connection.transaction()
+        await transaction.start()
+        try:
+            query = f"ALTER TABLE {schema_name}.transaction DETACH PARTITION {name};"
+            print(f"Executing query: {query}")
+            await connection.execute(query)
+            if await connection.fetchval(pending_query):
+                print(f"Keeping partition {name}, it holds PENDING transactions")
+                await transaction.rollback()
+                continue
+            for query in (
+                f"""INSERT INTO {schema_name}.transaction_archive ({COLUMNS})
+                SELECT {COLUMNS} FROM {name} WHERE status = 'COMPLETED';""",
+                f"DROP TABLE {name};",
+            ):
+                print(f"Executing query: {query}")
+                await connection.execute(query)
+        except Exception:
+            await transaction.rollback()
+            raise
+        await transaction.commit()
+        dropped += 1
+    return dropped
+
+
+async def create_connection():
+    # No command timeout, the first archival of a large table takes long. DDL waiting on a lock gives up after the
+    # lock timeout instead of queueing all the traffic on the table behind it.
+    return await asyncpg.connect(
+        host=os.environ.get("DB_HOST"),
+        port=os.environ.get("DB_PORT"),
+        database=os.environ.get("DB_NAME"),
+        user=os.environ.get("DB_USER"),
+        password=os.environ.get("DB_PASSWORD"),
+        timeout=int(os.environ.get("CONNECTION_TIMEOUT", 10)),
+        command_timeout=None,
+        server_settings={"lock_timeout": os.environ.get("MIGRATION_LOCK_TIMEOUT", "5s")},
+    )
+
+
+async def main(months_ahead: int, archive_after_days: int, batch_size: int):
+    connection = await create_connection()
+
+    print(f"Creating transaction partitions in schema: {schema_name}")
+    created = await create_partitions(connection, schema_name, months_ahead)
+    print(f"Created {created} partition(s)")
+
+    before = datetime.now() - timedelta(days=archive_after_days)
+    print(f"Archiving the transactions completed and created before {before} in schema: {schema_name}")
+    archived = await archive_transactions(connection, schema_name, before, batch_size)
+    print(f"Archived {archived} transaction(s)")
+    dropped = await drop_archived_partitions(connection, schema_name, before)
+    print(f"Dropped {dropped} partition(s)")
+
+    await connection.close()
+    print("Closed connection")
+
+
+if __name__ == "__main__":
+    load_dotenv()
+
+    schema_name = os.environ.get("DB_SCHEMA")
+
+    parser = argparse.ArgumentParser(description="Creates transaction partitions and archives old transactions")
+    parser.add_argument("--months-ahead", type=int, default=3, help="months of partitions to create in advance")
+    parser.add_argument(
+        "--archive-after-days", type=int, default=365, help="age of the completed transactions to archive"
+    )
+    parser.add_argument("--batch-size", type=int, default=10000, help="transactions archived per statement")
+    arguments = parser.parse_args()
+
+    asyncio.run(main(arguments.months_ahead, arguments.archive_after_days, arguments.batch_size))
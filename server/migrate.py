@@ -0,0 +1,241 @@
+#!/usr/bin/python3
+"""Versioned schema migrations.
+
+Migrations are the python files of the migrations directory named <version>_<name>.py, applied in version order.
+Each one defines
+    UP: list of statements applying the migration, a nested list is a group of statements run in one transaction
+    DOWN: list of statements reverting it, likewise
+    TRANSACTIONAL: whether the statements run in one transaction, default True. Set it to False for statements
+        that cannot run in a transaction block, like CREATE INDEX CONCURRENTLY. Every statement then commits on its
+        own. If one of them fails the statements before it stay applied and the migration is resumed by the next
+        `up`, so they must be idempotent (IF NOT EXISTS). The index left INVALID by a failed or interrupted
+        concurrent build is dropped, both when the build fails and before it is run again. Statements that have to
+        apply together, like swapping a table for another, are grouped in a nested list.
+`{schema}` in the statements is substituted with the DB_SCHEMA. Applied versions are tracked in the
+schema_migrations table of the schema.
+
+    python migrate.py status
+    python migrate.py up [--target VERSION]
+    python migrate.py down --target VERSION
+"""
+
+import argparse
+import asyncio
+import importlib.util
+import os
+import re
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, List, Optional, Union
+
+import asyncpg
+from dotenv import load_dotenv
+
+MIGRATIONS_DIRECTORY = Path(__file__).parent / "migrations"
+MIGRATION_FILE_PATTERN = re.compile(r"^(\d+)_(\w+)\.py$")
+CONCURRENT_INDEX_PATTERN = re.compile(
+    r"^\s*CREATE\s+(?:UNIQUE\s+)?INDEX\s+CONCURRENTLY\s+(?:IF\s+NOT\s+EXISTS\s+)?(\w+)", re.IGNORECASE
+)
+
+
+@dataclass
+class Migration:
+    version: int
+    name: str
+    up: List[Union[str, List[str]]]
+    down: List[Union[str, List[str]]]
+    transactional: bool
+
+
+def load_migrations() -> List[Migration]:
+    migrations: List[Migration] = []
+    for path in sorted(MIGRATIONS_DIRECTORY.iterdir()):
+        match = MIGRATION_FILE_PATTERN.match(path.name)
+        if not match:
+            continue
+        spec = importlib.util.spec_from_file_location(f"migrations.{path.stem}", path)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        migrations.append(
+            Migration(
+                version=int(match.group(1)),
+                name=match.group(2),
+                up=module.UP,
+                down=module.DOWN,
+                transactional=getattr(module, "TRANSACTIONAL", True),
+            )
+        )
+
+    versions = [migration.version for migration in migrations]
+    if len(versions) != len(set(versions)):
+        raise ValueError(f"Duplicate migration versions in {MIGRATIONS_DIRECTORY}: {versions}")
+    return sorted(migrations, key=lambda migration: migration.version)
+
+
+async def applied_versions(connection, schema_name: str) -> Dict[int, str]:
+    query = f"""CREATE TABLE IF NOT EXISTS {schema_name}.schema_migrations (
+        version                 INT PRIMARY KEY,
+        name                    VARCHAR(255) NOT NULL,
+        applied_at              TIMESTAMP NOT NULL DEFAULT NOW()
+    );"""
+    await connection.execute(query)
+    records = await connection.fetch(f"SELECT version, name FROM {schema_name}.schema_migrations;")
+    return {record["version"]: record["name"] for record in records}
+
+
+async def execute_statements(connection, schema_name: str, statements: List[str]):
+    for statement in statements:
+        query = statement.replace("{schema}", schema_name)
+        print(f"Executing query: {query}")
+        await connection.execute(query)
+
+
+async def drop_invalid_index(connection, schema_name: str, statement: str):
+    # A failed CREATE INDEX CONCURRENTLY leaves an INVALID index behind that IF NOT EXISTS would then keep
+    match = CONCURRENT_INDEX_PATTERN.match(statement)
+    if not match:
+        return
+    query = """SELECT NOT i.indisvalid
+        FROM pg_index i
+        JOIN pg_class c ON c.oid = i.indexrelid
+        JOIN pg_namespace n ON n.oid = c.relnamespace
+        WHERE n.nspname = $1 AND c.relname = $2;"""
+    if await connection.fetchval(query, schema_name, match.group(1)):
+        await execute_statements(connection, schema_name, [f"DROP INDEX CONCURRENTLY {{schema}}.{match.group(1)};"])
+
+
+async def apply(
+    connection, schema_name: str, migration: Migration, statements: List[Union[str, List[str]]], revert: bool
+):
+    if revert:
+        record_query = f"DELETE FROM {schema_name}.schema_migrations WHERE version = $1;"
+        record_args = (migration.version,)
+    else:
+        record_query = f"INSERT INTO {schema_name}.schema_migrations (version, name) VALUES ($1, $2);"
+        record_args = (migration.version, migration.name)
+
+    if migration.transactional:
+        async with connection.transaction():
+            for statement in statements:
+                group = statement if isinstance(statement, list) else [statement]
+                await execute_statements(connection, schema_name, group)
+            await connection.execute(record_query, *record_args)
+        return
+
+    for statement in statements:
+        if isinstance(statement, list):
+            try:
+                async with connection.transaction():
+                    await execute_statements(connection, schema_name, statement)
+            except Exception:
+                print(f"Migration {migration.version} failed, run it again to resume it")
+                raise
+            continue
+
+        await drop_invalid_index(connection, schema_name, statement)
+        try:
+            await execute_statements(connection, schema_name, [statement])
+        except Exception:
+            # The statements before it stay applied, objects that existed before the migration are left untouched
+            print(f"Migration {migration.version} failed, run it again to resume it")
+            try:
+                await drop_invalid_index(connection, schema_name, statement)
+            except Exception as e:
+                print(f"Could not drop the index left invalid, the next run drops it: {e}")
+            raise
+    await connection.execute(record_query, *record_args)
+
+
+async def upgrade(connection, schema_name: str, target: Optional[int] = None) -> int:
+    """Applies the pending migrations up to and including the target version, all of them if no target.
+
+    Returns:
+        number of migrations applied
+    """
+
+    await connection.execute("SELECT pg_advisory_lock(hashtext('schema_migrations'));")
+    try:
+        applied = await applied_versions(connection, schema_name)
+        pending = [
+            migration
+            for migration in load_migrations()
+            if migration.version not in applied and (target is None or migration.version <= target)
+        ]
+        for migration in pending:
+            print(f"Applying migration {migration.version:04d}_{migration.name}")
+            await apply(connection, schema_name, migration, migration.up, revert=False)
+    finally:
+        await connection.execute("SELECT pg_advisory_unlock(hashtext('schema_migrations'));")
+    return len(pending)
+
+
+async def downgrade(connection, schema_name: str, target: int) -> int:
+    """Reverts the applied migrations newer than the target version, newest first.
+
+    Returns:
+        number of migrations reverted
+    """
+
+    await connection.execute("SELECT pg_advisory_lock(hashtext('schema_migrations'));")
+    try:
+        applied = await applied_versions(connection, schema_name)
+        reverted = [
+            migration
+            for migration in reversed(load_migrations())
+            if migration.version in applied and migration.version > target
+        ]
+        for migration in reverted:
+            print(f"Reverting migration {migration.version:04d}_{migration.name}")
+            await apply(connection, schema_name, migration, migration.down, revert=True)
+    finally:
+        await connection.execute("SELECT pg_advisory_unlock(hashtext('schema_migrations'));")
+    return len(reverted)
+
+
+async def create_connection():
+    # No command timeout, concurrent index builds on large tables take longer than any request. DDL waiting on a
+    # lock gives up after the lock timeout instead of queueing all the traffic on the table behind it.
+    return await asyncpg.connect(
+        host=os.environ.get("DB_HOST"),
+        port=os.environ.get("DB_PORT"),
+        database=os.environ.get("DB_NAME"),
+        user=os.environ.get("DB_USER"),
+        password=os.environ.get("DB_PASSWORD"),
+        timeout=int(os.environ.get("CONNECTION_TIMEOUT", 10)),
+        command_timeout=None,
+        server_settings={"lock_timeout": os.environ.get("MIGRATION_LOCK_TIMEOUT", "5s")},
+    )
+
+
+async def main(command: str, target: Optional[int]):
+    connection = await create_connection()
+
+    if command == "status":
+        applied = await applied_versions(connection, schema_name)
+        for migration in load_migrations():
+            state = "applied" if migration.version in applied else "pending"
+            print(f"{migration.version:>6}  {migration.name:<40}{state}")
+    elif command == "up":
+        count = await upgrade(connection, schema_name, target)
+        print(f"Applied {count} migration(s) in schema: {schema_name}")
+    else:
+        count = await downgrade(connection, schema_name, target)
+        print(f"Reverted {count} migration(s) in schema: {schema_name}")
+
+    await connection.close()
+    print(f"Closed connection")
+
+
+if __name__ == "__main__":
+    load_dotenv()
+
+    schema_name = os.environ.get("DB_SCHEMA")
+
+    parser = argparse.ArgumentParser(description="Applies and reverts versioned schema migrations")
+    parser.add_argument("command", choices=["status", "up", "down"])
+    parser.add_argument("--target", type=int, default=None, help="version to migrate up or down to")
+    arguments = parser.parse_args()
+    if arguments.command == "down" and arguments.target is None:
+        parser.error("down requires --target, use --target -1 to revert every migration")
+
+    asyncio.run(main(arguments.command, arguments.target))
@@ -0,0 +1,46 @@
+"""Ledger tables maintained by the services on every checkout, return and stock edit, backfilled from the books
+and their PENDING transactions.
+
+book_availability holds the copies of each book not lent out, user_dues the open loans of each user and the
+sum of their start dates in days since the epoch, only users with open loans get a row. Version 0 so that the ledgers exist before the
+indexes of 0001. Tables created by an earlier delete_and_recreate_tables.py are kept, only their missing rows
+are backfilled. Checkouts and returns wait on the lock of the transaction table until the backfill commits,
+run reconcile_availability.py once the services maintaining the ledgers are deployed to catch up with the
+writes of the previous version.
+"""
+
+UP = [
+    """CREATE TABLE IF NOT EXISTS {schema}.book_availability (
+        book_id                 INT PRIMARY KEY,
+        available_quantity      INT NOT NULL DEFAULT 0,
+        CONSTRAINT              book_availability_book_id_fk FOREIGN KEY (book_id) REFERENCES {schema}.book (id) ON DELETE CASCADE
+    );""",
+    """CREATE TABLE IF NOT EXISTS {schema}.user_dues (
+        user_id                 INT PRIMARY KEY,
+        open_loans              INT NOT NULL DEFAULT 0,
+        loan_start_day_sum      BIGINT NOT NULL DEFAULT 0,
+        CONSTRAINT              user_dues_user_id_fk FOREIGN KEY (user_id) REFERENCES {schema}.user (id) ON DELETE CASCADE
+    );""",
+    "LOCK TABLE {schema}.user, {schema}.book, {schema}.transaction IN SHARE MODE;",
+    """INSERT INTO {schema}.book_availability (book_id, available_quantity)
+    SELECT b.id, b.stock_quantity - COALESCE(t.pending, 0)
+    FROM {schema}.book b
+    LEFT JOIN (
+        SELECT book_id, COUNT(*) AS pending
+        FROM {schema}.transaction
+        WHERE status = 'PENDING'
+        GROUP BY book_id
+    ) t ON t.book_id = b.id
+    ON CONFLICT (book_id) DO NOTHING;""",
+    """INSERT INTO {schema}.user_dues (user_id, open_loans, loan_start_day_sum)
+    SELECT user_id, COUNT(*), SUM(DATE(created_at) - DATE '1970-01-01')
+    FROM {schema}.transaction
+    WHERE status = 'PENDING'
+    GROUP BY user_id
+    ON CONFLICT (user_id) DO NOTHING;""",
+]
+
+DOWN = [
+    "DROP TABLE IF EXISTS {schema}.user_dues;",
+    "DROP TABLE IF EXISTS {schema}.book_availability;",
+]
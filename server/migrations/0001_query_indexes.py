@@ -0,0 +1,28 @@
+"""Indexes every filter and sort of the queries of BookService, UserService and TransactionService.
+
+    book                (created_at DESC, id DESC)  keyset pagination of GET /books
+    transaction         (user_id, status)           transactions and open loans of a user, scanned returns
+    transaction         (book_id, status)           transactions and open loans of a book
+    user_dues           (open_loans, ...)           GET /users/dues
+Lookups by id, email, isbn and (title, authors) use the primary key and unique constraint indexes.
+"""
+
+TRANSACTIONAL = False
+
+UP = [
+    """CREATE INDEX CONCURRENTLY IF NOT EXISTS book_created_at_id_idx
+    ON {schema}.book (created_at DESC, id DESC);""",
+    """CREATE INDEX CONCURRENTLY IF NOT EXISTS transaction_user_id_status_idx
+    ON {schema}.transaction (user_id, status);""",
+    """CREATE INDEX CONCURRENTLY IF NOT EXISTS transaction_book_id_status_idx
+    ON {schema}.transaction (book_id, status);""",
+    """CREATE INDEX CONCURRENTLY IF NOT EXISTS user_dues_open_loans_idx
+    ON {schema}.user_dues (open_loans, loan_start_day_sum, user_id) WHERE open_loans > 0;""",
+]
+
+DOWN = [
+    "DROP INDEX CONCURRENTLY IF EXISTS {schema}.user_dues_open_loans_idx;",
+    "DROP INDEX CONCURRENTLY IF EXISTS {schema}.transaction_book_id_status_idx;",
+    "DROP INDEX CONCURRENTLY IF EXISTS {schema}.transaction_user_id_status_idx;",
+    "DROP INDEX CONCURRENTLY IF EXISTS {schema}.book_created_at_id_idx;",
+]
@@ -0,0 +1,25 @@
+"""Full text and trigram indexes of GET /books/search.
+
+book_search_document is an immutable wrapper so the concatenated document can be used in expression indexes.
+"""
+
+TRANSACTIONAL = False
+
+UP = [
+    """CREATE OR REPLACE FUNCTION {schema}.book_search_document(
+        title VARCHAR, authors VARCHAR[], publisher VARCHAR
+    ) RETURNS TEXT
+    LANGUAGE SQL IMMUTABLE PARALLEL SAFE
+    AS $$ SELECT title || ' ' || array_to_string(authors, ' ') || ' ' || COALESCE(publisher, '') $$;""",
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm;",
+    """CREATE INDEX CONCURRENTLY IF NOT EXISTS book_search_tsv_idx
+    ON {schema}.book USING GIN (to_tsvector('simple', {schema}.book_search_document(title, authors, publisher)));""",
+    """CREATE INDEX CONCURRENTLY IF NOT EXISTS book_search_trgm_idx
+    ON {schema}.book USING GIN ({schema}.book_search_document(title, authors, publisher) gin_trgm_ops);""",
+]
+
+DOWN = [
+    "DROP INDEX CONCURRENTLY IF EXISTS {schema}.book_search_trgm_idx;",
+    "DROP INDEX CONCURRENTLY IF EXISTS {schema}.book_search_tsv_idx;",
+    "DROP FUNCTION IF EXISTS {schema}.book_search_document(VARCHAR, VARCHAR[], VARCHAR);",
+]
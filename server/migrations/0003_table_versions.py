@@ -0,0 +1,43 @@
+"""Table level versions of book, user and transaction, the validators of the conditional GET endpoints.
+
+Every statement writing to one of the tables bumps its version in the same transaction, so a version is never
+visible before the change it stands for.
+"""
+
+UP = [
+    """CREATE TABLE IF NOT EXISTS {schema}.table_version (
+        table_name              VARCHAR(64) PRIMARY KEY,
+        version                 BIGINT NOT NULL DEFAULT 0,
+        updated_at              TIMESTAMPTZ NOT NULL DEFAULT NOW()
+    );""",
+    """INSERT INTO {schema}.table_version (table_name)
+    VALUES ('book'), ('user'), ('transaction')
+    ON CONFLICT (table_name) DO NOTHING;""",
+    """CREATE OR REPLACE FUNCTION {schema}.bump_table_version() RETURNS TRIGGER
+    LANGUAGE plpgsql
+    AS $$
+    BEGIN
+        UPDATE {schema}.table_version
+        SET version = version + 1, updated_at = NOW()
+        WHERE table_name = TG_TABLE_NAME;
+        RETURN NULL;
+    END;
+    $$;""",
+    """CREATE TRIGGER book_version_trigger
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON {schema}.book
+    FOR EACH STATEMENT EXECUTE FUNCTION {schema}.bump_table_version();""",
+    """CREATE TRIGGER user_version_trigger
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON {schema}.user
+    FOR EACH STATEMENT EXECUTE FUNCTION {schema}.bump_table_version();""",
+    """CREATE TRIGGER transaction_version_trigger
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON {schema}.transaction
+    FOR EACH STATEMENT EXECUTE FUNCTION {schema}.bump_table_version();""",
+]
+
+DOWN = [
+    "DROP TRIGGER IF EXISTS transaction_version_trigger ON {schema}.transaction;",
+    "DROP TRIGGER IF EXISTS user_version_trigger ON {schema}.user;",
+    "DROP TRIGGER IF EXISTS book_version_trigger ON {schema}.book;",
+    "DROP FUNCTION IF EXISTS {schema}.bump_table_version();",
+    "DROP TABLE IF EXISTS {schema}.table_version;",
+]
@@ -0,0 +1,166 @@
+"""Partitions transaction by month of created_at and adds the archive of old COMPLETED transactions.
+
+The existing table becomes the DEFAULT partition without copying its rows. It is constrained to the rows created
+before the second month after the migration, so that creating the monthly partitions from then on does not scan
+it, and keeps them until they are archived. create_transaction_partitions creates the monthly partitions from
+that month on, the app creates the upcoming ones at startup and daily, maintain_transactions.py moves old
+COMPLETED transactions to transaction_archive. transaction_history is the union of both. A transaction created
+in a month without a partition is refused, so the partitions have to be created ahead of time.
+
+A partitioned table can only be unique on columns including the partition key, the primary key becomes
+(id, created_at). The ids are still unique, they are drawn from the same sequence. Its index is built and the
+constraint validated without blocking writes, the tables are then swapped in one transaction holding its locks
+only for catalog changes.
+"""
+
+TRANSACTIONAL = False
+
+UP = [
+    """CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS transaction_default_pkey
+    ON {schema}.transaction (id, created_at);""",
+    # Bounded by a literal, a CHECK constraint cannot call now()
+    """DO $$
+    BEGIN
+        IF NOT EXISTS (
+            SELECT 1 FROM pg_constraint
+            WHERE conrelid = '{schema}.transaction'::regclass AND conname = 'transaction_default_created_at_check'
+        ) THEN
+            EXECUTE format(
+                'ALTER TABLE {schema}.transaction ADD CONSTRAINT transaction_default_created_at_check '
+                'CHECK (created_at < %L) NOT VALID',
+                date_trunc('month', LOCALTIMESTAMP) + INTERVAL '2 months'
+            );
+        END IF;
+    END;
+    $$;""",
+    # Scans the table without blocking writes, only a validated constraint spares the scans of the partitioning
+    "ALTER TABLE {schema}.transaction VALIDATE CONSTRAINT transaction_default_created_at_check;",
+    [
+        "ALTER TABLE {schema}.transaction RENAME TO transaction_default;",
+        # The index built above becomes the primary key of the default partition, attached to the primary key of
+        # the partitioned table instead of being built again
+        "ALTER TABLE {schema}.transaction_default DROP CONSTRAINT transaction_pkey;",
+        """ALTER TABLE {schema}.transaction_default
+        ADD CONSTRAINT transaction_default_pkey PRIMARY KEY USING INDEX transaction_default_pkey;""",
+        """ALTER INDEX IF EXISTS {schema}.transaction_user_id_status_idx
+        RENAME TO transaction_default_user_id_status_idx;""",
+        """ALTER INDEX IF EXISTS {schema}.transaction_book_id_status_idx
+        RENAME TO transaction_default_book_id_status_idx;""",
+        "DROP TRIGGER IF EXISTS transaction_version_trigger ON {schema}.transaction_default;",
+        """CREATE TABLE {schema}.transaction (
+            id                      INT NOT NULL DEFAULT nextval('{schema}.transaction_id_seq'),
+            user_id                 INT NOT NULL,
+            book_id                 INT NOT NULL,
+            status                  {schema}.transaction_status NOT NULL DEFAULT 'PENDING',
+            created_at              TIMESTAMP NOT NULL DEFAULT NOW(),
+            updated_at              TIMESTAMP NOT NULL DEFAULT NOW(),
+            CONSTRAINT              transaction_pkey PRIMARY KEY (id, created_at),
+            CONSTRAINT              transaction_mapping_user_id_fk FOREIGN KEY (user_id) REFERENCES {schema}.user (id),
+            CONSTRAINT              transaction_mapping_book_id_fk FOREIGN KEY (book_id) REFERENCES {schema}.book (id)
+        ) PARTITION BY RANGE (created_at);""",
+        "ALTER SEQUENCE {schema}.transaction_id_seq OWNED BY {schema}.transaction.id;",
+        "ALTER TABLE {schema}.transaction_default ALTER COLUMN id DROP DEFAULT;",
+        "ALTER TABLE {schema}.transaction ATTACH PARTITION {schema}.transaction_default DEFAULT;",
+        # The indexes of the default partition are attached to these instead of being built again
+        "CREATE INDEX transaction_user_id_status_idx ON {schema}.transaction (user_id, status);",
+        "CREATE INDEX transaction_book_id_status_idx ON {schema}.transaction (book_id, status);",
+        """CREATE TRIGGER transaction_version_trigger
+        AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON {schema}.transaction
+        FOR EACH STATEMENT EXECUTE FUNCTION {schema}.bump_table_version();""",
+        """CREATE TABLE {schema}.transaction_archive (
+            id                      INT PRIMARY KEY,
+            user_id                 INT NOT NULL,
+            book_id                 INT NOT NULL,
+            status                  {schema}.transaction_status NOT NULL,
+            created_at              TIMESTAMP NOT NULL,
+            updated_at              TIMESTAMP NOT NULL,
+            archived_at             TIMESTAMP NOT NULL DEFAULT NOW(),
+            CONSTRAINT              transaction_archive_user_id_fk FOREIGN KEY (user_id) REFERENCES {schema}.user (id),
+            CONSTRAINT              transaction_archive_book_id_fk FOREIGN KEY (book_id) REFERENCES {schema}.book (id)
+        );""",
+        "CREATE INDEX transaction_archive_user_id_idx ON {schema}.transaction_archive (user_id);",
+        "CREATE INDEX transaction_archive_book_id_idx ON {schema}.transaction_archive (book_id);",
+        """CREATE VIEW {schema}.transaction_history AS
+        SELECT id, user_id, book_id, status, created_at, updated_at FROM {schema}.transaction
+        UNION ALL
+        SELECT id, user_id, book_id, status, created_at, updated_at FROM {schema}.transaction_archive;""",
+        # Months before the bound of the default partition are skipped, a partition cannot take its rows over and
+        # creating one would scan it. Without the constraint, only the months holding rows in it are skipped.
+        """CREATE OR REPLACE FUNCTION {schema}.create_transaction_partitions(from_date DATE, to_date DATE)
+        RETURNS INT
+        LANGUAGE plpgsql
+        AS $$
+        DECLARE
+            month_start DATE := date_trunc('month', from_date)::DATE;
+            default_bound TIMESTAMP;
+            partition_name TEXT;
+            created INT := 0;
+        BEGIN
+            SELECT substring(pg_get_constraintdef(oid) FROM '''([^'']+)''')::TIMESTAMP INTO default_bound
+            FROM pg_constraint
+            WHERE conrelid = '{schema}.transaction_default'::regclass
+            AND conname = 'transaction_default_created_at_check'
+            AND convalidated;
+
+            WHILE month_start < to_date LOOP
+                partition_name := format(
+                    'transaction_y%sm%s', to_char(month_start, 'YYYY'), to_char(month_start, 'MM')
+                );
+                IF to_regclass(format('{schema}.%I', partition_name)) IS NULL THEN
+                    IF month_start < default_bound THEN
+                        RAISE NOTICE 'Skipping partition %, the default partition holds the rows before %',
+                            partition_name, default_bound;
+                    ELSIF default_bound IS NULL AND EXISTS (
+                        SELECT 1 FROM {schema}.transaction_default
+                        WHERE created_at >= month_start AND created_at < month_start + INTERVAL '1 month'
+                    ) THEN
+                        RAISE NOTICE 'Skipping partition %, the default partition holds rows of the month',
+                            partition_name;
+                    ELSE
+                        EXECUTE format(
+                            'CREATE TABLE {schema}.%I PARTITION OF {schema}.transaction FOR VALUES FROM (%L) TO (%L)',
+                            partition_name, month_start, month_start + INTERVAL '1 month'
+                        );
+                        created := created + 1;
+                    END IF;
+                END IF;
+                month_start := month_start + INTERVAL '1 month';
+            END LOOP;
+            RETURN created;
+        END;
+        $$;""",
+        "SELECT {schema}.create_transaction_partitions(CURRENT_DATE, (CURRENT_DATE + INTERVAL '3 months')::DATE);",
+    ],
+]
+
+DOWN = [
+    [
+        "DROP FUNCTION IF EXISTS {schema}.create_transaction_partitions(DATE, DATE);",
+        "DROP VIEW IF EXISTS {schema}.transaction_history;",
+        """CREATE TABLE {schema}.transaction_unpartitioned (
+            id                      INT NOT NULL DEFAULT nextval('{schema}.transaction_id_seq'),
+            user_id                 INT NOT NULL,
+            book_id                 INT NOT NULL,
+            status                  {schema}.transaction_status NOT NULL DEFAULT 'PENDING',
+            created_at              TIMESTAMP NOT NULL DEFAULT NOW(),
+            updated_at              TIMESTAMP NOT NULL DEFAULT NOW(),
+            CONSTRAINT              transaction_unpartitioned_pkey PRIMARY KEY (id),
+            CONSTRAINT              transaction_mapping_user_id_fk FOREIGN KEY (user_id) REFERENCES {schema}.user (id),
+            CONSTRAINT              transaction_mapping_book_id_fk FOREIGN KEY (book_id) REFERENCES {schema}.book (id)
+        );""",
+        """INSERT INTO {schema}.transaction_unpartitioned (id, user_id, book_id, status, created_at, updated_at)
+        SELECT id, user_id, book_id, status, created_at, updated_at FROM {schema}.transaction
+        UNION ALL
+        SELECT id, user_id, book_id, status, created_at, updated_at FROM {schema}.transaction_archive;""",
+        "ALTER SEQUENCE {schema}.transaction_id_seq OWNED BY {schema}.transaction_unpartitioned.id;",
+        "DROP TABLE {schema}.transaction_archive;",
+        "DROP TABLE {schema}.transaction;",
+        "ALTER TABLE {schema}.transaction_unpartitioned RENAME TO transaction;",
+        "ALTER TABLE {schema}.transaction RENAME CONSTRAINT transaction_unpartitioned_pkey TO transaction_pkey;",
+        "CREATE INDEX transaction_user_id_status_idx ON {schema}.transaction (user_id, status);",
+        "CREATE INDEX transaction_book_id_status_idx ON {schema}.transaction (book_id, status);",
+        """CREATE TRIGGER transaction_version_trigger
+        AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON {schema}.transaction
+        FOR EACH STATEMENT EXECUTE FUNCTION {schema}.bump_table_version();""",
+    ],
+]
@@ -0,0 +1,36 @@
+"""Background jobs, the imports too large to run within an HTTP request.
+
+A job is claimed by one worker at a time, the worker renews its lease through heartbeat_at while it runs it. A
+job whose lease expired, its worker having stopped, is claimed again and resumes from progress, the count of
+input items of the chunks committed so far. input holds the submitted items, cleared once the job is finished.
+"""
+
+UP = [
+    "CREATE TYPE {schema}.job_status AS ENUM ('QUEUED', 'RUNNING', 'COMPLETED', 'FAILED', 'CANCELLED');",
+    """CREATE TABLE {schema}.job (
+        id                      SERIAL PRIMARY KEY,
+        kind                    VARCHAR(64) NOT NULL,
+        status                  {schema}.job_status NOT NULL DEFAULT 'QUEUED',
+        params                  JSONB NOT NULL DEFAULT '{}',
+        input                   JSONB NULL,
+        total                   INT NULL,
+        progress                INT NOT NULL DEFAULT 0,
+        counts                  JSONB NOT NULL DEFAULT '{}',
+        errors                  JSONB NOT NULL DEFAULT '[]',
+        error                   TEXT NULL,
+        cancel_requested        BOOLEAN NOT NULL DEFAULT FALSE,
+        attempts                INT NOT NULL DEFAULT 0,
+        heartbeat_at            TIMESTAMP NULL,
+        created_at              TIMESTAMP NOT NULL DEFAULT NOW(),
+        updated_at              TIMESTAMP NOT NULL DEFAULT NOW(),
+        started_at              TIMESTAMP NULL,
+        finished_at             TIMESTAMP NULL
+    );""",
+    # Polled by every worker, only the unfinished jobs are indexed
+    "CREATE INDEX job_unfinished_idx ON {schema}.job (id) WHERE status IN ('QUEUED', 'RUNNING');",
+]
+
+DOWN = [
+    "DROP TABLE IF EXISTS {schema}.job;",
+    "DROP TYPE IF EXISTS {schema}.job_status;",
+]
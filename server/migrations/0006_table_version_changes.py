@@ -0,0 +1,49 @@
+"""Records the writes to book, user and transaction in an append-only log instead of updating their version row.
+
+Bumping the table_version row of a table serialized every write to the table on that row lock until commit.
+The triggers of 0003 now insert a row into table_version_change, which takes no lock shared with the other
+writers. The version of a table is the version of its row plus the number of its changes, and stays as
+transactional as before: a change is counted once the write it stands for commits.
+TableVersionService.compact_table_versions periodically folds the changes into the version rows.
+"""
+
+UP = [
+    """CREATE TABLE {schema}.table_version_change (
+        table_name              VARCHAR(64) NOT NULL,
+        changed_at              TIMESTAMPTZ NOT NULL DEFAULT NOW()
+    );""",
+    # Counted and dated by an index only scan of the table
+    """CREATE INDEX table_version_change_table_name_idx
+    ON {schema}.table_version_change (table_name, changed_at);""",
+    """CREATE OR REPLACE FUNCTION {schema}.bump_table_version() RETURNS TRIGGER
+    LANGUAGE plpgsql
+    AS $$
+    BEGIN
+        INSERT INTO {schema}.table_version_change (table_name) VALUES (TG_TABLE_NAME);
+        RETURN NULL;
+    END;
+    $$;""",
+]
+
+DOWN = [
+    """CREATE OR REPLACE FUNCTION {schema}.bump_table_version() RETURNS TRIGGER
+    LANGUAGE plpgsql
+    AS $$
+    BEGIN
+        UPDATE {schema}.table_version
+        SET version = version + 1, updated_at = NOW()
+        WHERE table_name = TG_TABLE_NAME;
+        RETURN NULL;
+    END;
+    $$;""",
+    "LOCK TABLE {schema}.table_version_change IN EXCLUSIVE MODE;",
+    """UPDATE {schema}.table_version v
+    SET version = v.version + c.changes, updated_at = GREATEST(v.updated_at, c.changed_at)
+    FROM (
+        SELECT table_name, COUNT(*) AS changes, MAX(changed_at) AS changed_at
+        FROM {schema}.table_version_change
+        GROUP BY table_name
+    ) c
+    WHERE v.table_name = c.table_name;""",
+    "DROP TABLE {schema}.table_version_change;",
+]
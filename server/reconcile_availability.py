@@ -0,0 +1,116 @@
+#!/usr/bin/python3
+
+import asyncio
+import os
+
+import asyncpg
+from dotenv import load_dotenv
+
+
+async def reconcile_availability(connection, schema_name: str) -> int:
+    """Recomputes book_availability from the stock of each book and its PENDING transactions.
+
+    Concurrent checkouts and returns wait on the table lock, so none of them is lost or counted twice.
+
+    Returns:
+        number of books whose availability was corrected
+    """
+
+    async with connection.transaction():
+        await connection.execute(f"LOCK TABLE {schema_name}.book_availability IN EXCLUSIVE MODE;")
+        query = f"""WITH computed AS (
+            SELECT b.id AS book_id, b.stock_quantity - COALESCE(t.pending, 0) AS available_quantity
+            FROM {schema_name}.book b
+            LEFT JOIN (
+                SELECT book_id, COUNT(*) AS pending
+                FROM {schema_name}.transaction
+                WHERE status = 'PENDING'
+                GROUP BY book_id
+            ) t ON t.book_id = b.id
+        )
+        INSERT INTO {schema_name}.book_availability (book_id, available_quantity)
+        SELECT book_id, available_quantity FROM computed
+        ON CONFLICT (book_id) DO UPDATE
+            SET available_quantity = EXCLUDED.available_quantity
+            WHERE book_availability.available_quantity <> EXCLUDED.available_quantity
+        RETURNING book_id;"""
+        print(f"Executing query: {query}")
+        corrected = await connection.fetch(query)
+    return len(corrected)
+
+
+async def reconcile_dues(connection, schema_name: str) -> int:
+    """Recomputes the user_dues ledger from the PENDING transactions of each user.
+
+    Concurrent checkouts and returns wait on the table lock, so none of them is lost or counted twice.
+
+    Returns:
+        number of users whose dues were corrected
+    """
+
+    async with connection.transaction():
+        await connection.execute(f"LOCK TABLE {schema_name}.user_dues IN EXCLUSIVE MODE;")
+        query = f"""WITH computed AS (
+            SELECT
+                u.id AS user_id,
+                COALESCE(t.open_loans, 0) AS open_loans,
+                COALESCE(t.loan_start_day_sum, 0) AS loan_start_day_sum
+            FROM {schema_name}.user u
+            LEFT JOIN (
+                SELECT
+                    user_id,
+                    COUNT(*) AS open_loans,
+                    SUM(DATE(created_at) - DATE '1970-01-01') AS loan_start_day_sum
+                FROM {schema_name}.transaction
+                WHERE status = 'PENDING'
+                GROUP BY user_id
+            ) t ON t.user_id = u.id
+        )
+        INSERT INTO {schema_name}.user_dues (user_id, open_loans, loan_start_day_sum)
+        SELECT user_id, open_loans, loan_start_day_sum FROM computed
+        WHERE open_loans > 0 OR EXISTS (
+            SELECT 1 FROM {schema_name}.user_dues d WHERE d.user_id = computed.user_id
+        )
+        ON CONFLICT (user_id) DO UPDATE
+            SET open_loans = EXCLUDED.open_loans, loan_start_day_sum = EXCLUDED.loan_start_day_sum
+            WHERE (user_dues.open_loans, user_dues.loan_start_day_sum)
+                IS DISTINCT FROM (EXCLUDED.open_loans, EXCLUDED.loan_start_day_sum)
+        RETURNING user_id;"""
+        print(f"Executing query: {query}")
+        corrected = await connection.fetch(query)
+    return len(corrected)
+
+
+async def create_connection():
+    return await asyncpg.connect(
+        host=os.environ.get("DB_HOST"),
+        port=os.environ.get("DB_PORT"),
+        database=os.environ.get("DB_NAME"),
+        user=os.environ.get("DB_USER"),
+        password=os.environ.get("DB_PASSWORD"),
+        timeout=int(os.environ.get("CONNECTION_TIMEOUT", 10)),
+        command_timeout=int(os.environ.get("QUERY_TIMEOUT", 60)),
+    )
+
+
+async def main():
+    connection = await create_connection()
+
+    print(f"Reconciling book availability in schema: {schema_name}")
+    corrected = await reconcile_availability(connection, schema_name)
+    print(f"Corrected availability of {corrected} book(s)")
+
+    print(f"Reconciling user dues in schema: {schema_name}")
+    corrected = await reconcile_dues(connection, schema_name)
+    print(f"Corrected dues of {corrected} user(s)")
+
+    await connection.close()
+    print(f"Closed connection")
+
+
+if __name__ == "__main__":
+    load_dotenv()
+
+    schema_name = os.environ.get("DB_SCHEMA")
+
+    asyncio.run(main())
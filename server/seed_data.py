@@ -0,0 +1,372 @@
+#!/usr/bin/python3
+"""Seeds the schema with synthetic users, books and transaction history for large-scale testing.
+
+Rows are generated in parallel processes and loaded through the COPY protocol over concurrent connections. Books
+and readers are skewed: a few popular books and heavy readers account for most of the transactions. Recent
+loans are PENDING, never more of a book than its stock, older ones COMPLETED. The monthly partitions of the
+history are created beforehand. The foreign keys and indexes of the transaction table are dropped during the
+load and rebuilt after it, book_availability and user_dues are then recomputed from the loaded rows.
+
+    python seed_data.py --users 200000 --books 500000 --transactions 10000000 --connections 8
+
+Rows are added next to the existing ones. Generation is deterministic for a given --seed and scale.
+"""
+
+import argparse
+import asyncio
+import csv
+import io
+import os
+import random
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, datetime, timedelta
+from typing import Callable, List, Tuple
+
+import asyncpg
+from dotenv import load_dotenv
+
+from reconcile_availability import reconcile_availability, reconcile_dues
+
+FIRST_NAMES = [
+    "Aarav", "Amelia", "Ana", "Chen", "Diego", "Elena", "Fatima", "Hana", "Ivan", "James", "Kwame", "Leila",
+    "Lucas", "Maria", "Mateo", "Mei", "Noah", "Olga", "Priya", "Sofia", "Tariq", "Yuki", "Zara", "Oliver",
+]
+LAST_NAMES = [
+    "Garcia", "Smith", "Kim", "Nguyen", "Müller", "Rossi", "Sato", "Singh", "Ivanova", "Okafor", "Silva",
+    "Johnson", "Dubois", "Cohen", "Haddad", "Novak", "Larsen", "Kowalski", "Martin", "Chowdhury", "Wang",
+]
+TITLE_WORDS = [
+    "Shadow", "River", "Silent", "Empire", "Garden", "Winter", "Secret", "Night", "Stone", "Glass", "House",
+    "Light", "Storm", "Crown", "Letters", "Ocean", "Memory", "Iron", "Summer", "Forest", "Wind", "Fire", "Song",
+]
+PUBLISHERS = [
+    "Penguin Books", "HarperCollins", "Vintage", "Scholastic", "Bloomsbury", "Tor Books", "Del Rey",
+    "Random House", "Simon & Schuster", "Faber & Faber", "Gallimard", "Anagrama", "Hachette", "Picador",
+]
+# Language codes as found in the Frappe catalog, weighted by frequency
+LANGUAGES = ["eng", "en-US", "en-GB", "spa", "fre", "ger", "jpn", "mul", "ita", "por"]
+LANGUAGE_WEIGHTS = [62, 14, 5, 5, 4, 3, 2, 2, 2, 1]
+
+USER_COLUMNS = ["id", "name", "email", "created_at", "updated_at"]
+BOOK_COLUMNS = [
+    "id", "title", "authors", "isbn", "isbn13", "language_code", "num_pages", "stock_quantity",
+    "publication_date", "publisher", "created_at", "updated_at",
+]
+TRANSACTION_COLUMNS = ["id", "user_id", "book_id", "status", "created_at", "updated_at"]
+
+
+def skewed_index(rng: random.Random, n: int, skew: float) -> int:
+    """Draws an index in [0, n) from a power law, index 0 being the most likely. skew = 0 is uniform."""
+
+    if skew == 1:
+        return min(n - 1, int(n ** rng.random()) - 1)
+    u = rng.random()
+    return min(n - 1, int((1 + u * (n ** (1 - skew) - 1)) ** (1 / (1 - skew))) - 1)
+
+
+def timestamp(moment: datetime) -> str:
+    return moment.isoformat(" ")
+
+
+def isbn10(number: int) -> str:
+    digits = f"{number % 10 ** 9:09d}"
+    check = (11 - sum((10 - i) * int(d) for i, d in enumerate(digits)) % 11) % 11
+    return digits + ("X" if check == 10 else str(check))
+
+
+def isbn13(number: int) -> str:
+    digits = f"979{number % 10 ** 9:09d}"
+    check = (10 - sum((3 if i % 2 else 1) * int(d) for i, d in enumerate(digits)) % 10) % 10
+    return digits + str(check)
+
+
+def user_rows(first_id: int, count: int, seed: int, days: int) -> bytes:
+    rng = random.Random(f"{seed}-user-{first_id}")
+    now = datetime.now()
+    output = io.StringIO()
+    writer = csv.writer(output)
+    for user_id in range(first_id, first_id + count):
+        first, last = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+        joined = timestamp(now - timedelta(days=days + rng.randint(0, 365), seconds=rng.randint(0, 86399)))
+        writer.writerow([user_id, f"{first} {last}", f"{first.lower()}.{user_id}@example.org", joined, joined])
+    return output.getvalue().encode()
+
+
+def book_rows(first_id: int, count: int, seed: int, days: int) -> bytes:
+    rng = random.Random(f"{seed}-book-{first_id}")
+    now = datetime.now()
+    output = io.StringIO()
+    writer = csv.writer(output)
+    for book_id in range(first_id, first_id + count):
+        title = " ".join(rng.sample(TITLE_WORDS, rng.randint(1, 3)))
+        authors = [f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}" for _ in range(1 + (rng.random() < 0.2))]
+        added = timestamp(now - timedelta(days=days + rng.randint(0, 365), seconds=rng.randint(0, 86399)))
+        writer.writerow(
+            [
+                book_id,
+                f"The {title} ({book_id})",
+                "{" + ",".join(f'"{author}"' for author in authors) + "}",
+                isbn10(book_id),
+                isbn13(book_id),
+                rng.choices(LANGUAGES, LANGUAGE_WEIGHTS)[0],
+                rng.randint(64, 1200),
+                1 + skewed_index(rng, 20, 1.5),
+                date(1900, 1, 1) + timedelta(days=rng.randint(0, 125 * 365)),
+                rng.choice(PUBLISHERS),
+                added,
+                added,
+            ]
+        )
+    return output.getvalue().encode()
+
+
+def transaction_rows(
+    first_id: int,
+    count: int,
+    seed: int,
+    days: int,
+    users: Tuple[int, int],
+    books: Tuple[int, int],
+    skew: float,
+    loan_days: int,
+) -> bytes:
+    rng = random.Random(f"{seed}-transaction-{first_id}")
+    now = datetime.now()
+    first_user_id, user_count = users
+    first_book_id, book_count = books
+    output = io.StringIO()
+    writer = csv.writer(output)
+    for transaction_id in range(first_id, first_id + count):
+        age = timedelta(days=rng.uniform(0, days))
+        borrowed = now - age
+        # Most loans younger than the loan period are still out, a few old ones were never returned
+        pending = rng.random() < (0.7 if age.days < loan_days else 0.002)
+        returned = borrowed if pending else min(now, borrowed + timedelta(days=rng.uniform(0.5, loan_days * 1.5)))
+        writer.writerow(
+            [
+                transaction_id,
+                first_user_id + skewed_index(rng, user_count, skew * 0.8),
+                first_book_id + skewed_index(rng, book_count, skew),
+                "PENDING" if pending else "COMPLETED",
+                timestamp(borrowed),
+                timestamp(returned),
+            ]
+        )
+    return output.getvalue().encode()
+
+
+async def create_connection():
+    return await asyncpg.connect(
+        host=os.environ.get("DB_HOST"),
+        port=os.environ.get("DB_PORT"),
+        database=os.environ.get("DB_NAME"),
+        user=os.environ.get("DB_USER"),
+        password=os.environ.get("DB_PASSWORD"),
+        timeout=int(os.environ.get("CONNECTION_TIMEOUT", 10)),
+        command_timeout=None,
+    )
+
+
+async def reserve_ids(connection, table: str, count: int) -> int:
+    """Advances the id sequence of the table past count ids and returns the first one.
+
+    The table lock makes concurrent inserts wait for the sequence to be advanced, none of them can take a
+    reserved id.
+    """
+
+    async with connection.transaction():
+        await connection.execute(f"LOCK TABLE {schema_name}.{table} IN EXCLUSIVE MODE;")
+        sequence = f"pg_get_serial_sequence('{schema_name}.{table}', 'id')"
+        first_id = await connection.fetchval(f"SELECT nextval({sequence});")
+        if count > 1:
+            await connection.execute(f"SELECT setval({sequence}, $1);", first_id + count - 1)
+    return first_id
+
+
+async def copy_table(
+    executor: ProcessPoolExecutor,
+    connections: List[asyncpg.Connection],
+    table: str,
+    columns: List[str],
+    generate: Callable[..., bytes],
+    first_id: int,
+    count: int,
+    chunk_size: int,
+    *args,
+):
+    """Generates the rows of the table in the executor and copies them over all connections concurrently."""
+
+    loop = asyncio.get_running_loop()
+    chunks = asyncio.Queue()
+    for start in range(first_id, first_id + count, chunk_size):
+        chunks.put_nowait((start, min(chunk_size, first_id + count - start)))
+    copied = 0
+    started = time.perf_counter()
+
+    async def copy_chunks(connection: asyncpg.Connection):
+        nonlocal copied
+        while not chunks.empty():
+            start, size = chunks.get_nowait()
+            data = await loop.run_in_executor(executor, generate, start, size, *args)
+            await connection.copy_to_table(
+                table, source=io.BytesIO(data), columns=columns, schema_name=schema_name, format="csv"
+            )
+            copied += size
+            print(f"Copied {copied}/{count} rows into {schema_name}.{table}")
+
+    await asyncio.gather(*(copy_chunks(connection) for connection in connections))
+    elapsed = time.perf_counter() - started
+    print(f"Copied {count} rows into {schema_name}.{table} in {elapsed:.1f} s ({count / max(elapsed, 1e-9):.0f} rows/s)")
+
+
+async def drop_foreign_keys_and_indexes(connection, table: str) -> List[str]:
+    """Drops the foreign keys and the non unique indexes of the table, checked and updated row by row on COPY.
+
+    Returns:
+        statements recreating them, validating every row and building each index in a single pass
+    """
+
+    relation = f"'{schema_name}.\"{table}\"'::regclass"
+    foreign_keys = await connection.fetch(
+        f"SELECT conname, pg_get_constraintdef(oid) AS definition FROM pg_constraint "
+        f"WHERE conrelid = {relation} AND contype = 'f';"
+    )
+    indexes = await connection.fetch(
+        f"SELECT indexrelid::regclass::text AS name, pg_get_indexdef(indexrelid) AS definition FROM pg_index "
+        f"WHERE indrelid = {relation} AND NOT indisprimary AND NOT indisunique;"
+    )
+    statements = [
+        f"ALTER TABLE {schema_name}.{table} DROP CONSTRAINT {foreign_key['conname']};" for foreign_key in foreign_keys
+    ] + [f"DROP INDEX {index['name']};" for index in indexes]
+    for query in statements:
+        print(f"Executing query: {query}")
+        await connection.execute(query)
+    return [
+        f"ALTER TABLE {schema_name}.{table} ADD CONSTRAINT {foreign_key['conname']} {foreign_key['definition']};"
+        for foreign_key in foreign_keys
+    ] + [
+        # The definition of the index of a partitioned table only covers the table itself
+        f"{index['definition'].replace(' ON ONLY ', ' ON ', 1)};"
+        for index in indexes
+    ]
+
+
+async def release_overbooked_loans(connection, first_transaction_id: int) -> int:
+    """Completes the seeded PENDING loans of a book beyond its stock, most recent first, so availability stays >= 0.
+
+    Returns:
+        number of loans completed
+    """
+
+    query = f"""WITH ranked AS (
+        SELECT t.id, b.stock_quantity,
+            ROW_NUMBER() OVER (PARTITION BY t.book_id ORDER BY t.id < $1 DESC, t.created_at) AS loan_number
+        FROM {schema_name}.transaction t
+        JOIN {schema_name}.book b ON b.id = t.book_id
+        WHERE t.status = 'PENDING'
+            AND t.book_id IN (SELECT book_id FROM {schema_name}.transaction WHERE id >= $1 AND status = 'PENDING')
+    )
+    UPDATE {schema_name}.transaction t SET status = 'COMPLETED'
+    FROM ranked r
+    WHERE t.id = r.id AND t.id >= $1 AND r.loan_number > r.stock_quantity;"""
+    print(f"Executing query: {query}")
+    result = await connection.execute(query, first_transaction_id)
+    return int(result.split()[-1])
+
+
+async def main(args: argparse.Namespace):
+    connection = await create_connection()
+    connections = [connection] + [await create_connection() for _ in range(args.connections - 1)]
+    started = time.perf_counter()
+
+    try:
+        first_user_id = await reserve_ids(connection, "user", args.users)
+        first_book_id = await reserve_ids(connection, "book", args.books)
+        first_transaction_id = await reserve_ids(connection, "transaction", args.transactions)
+
+        with ProcessPoolExecutor(max_workers=args.connections) as executor:
+            await asyncio.gather(
+                copy_table(
+                    executor, connections[: max(1, args.connections // 2)], "user", USER_COLUMNS, user_rows,
+                    first_user_id, args.users, args.chunk_size, args.seed, args.days,
+                ),
+                copy_table(
+                    executor, connections[max(1, args.connections // 2):] or connections, "book", BOOK_COLUMNS,
+                    book_rows, first_book_id, args.books, args.chunk_size, args.seed, args.days,
+                ),
+            )
+            query = f"""SELECT {schema_name}.create_transaction_partitions(
+                (CURRENT_DATE - $1::int), (CURRENT_DATE + INTERVAL '3 months')::DATE
+            );"""
+            print(f"Executing query: {query}")
+            await connection.execute(query, args.days)
+            restore = [] if args.keep_indexes else await drop_foreign_keys_and_indexes(connection, "transaction")
+            try:
+                await copy_table(
+                    executor, connections, "transaction", TRANSACTION_COLUMNS, transaction_rows,
+                    first_transaction_id, args.transactions, args.chunk_size, args.seed, args.days,
+                    (first_user_id, args.users), (first_book_id, args.books), args.skew, args.loan_days,
+                )
+            finally:
+                for query in restore:
+                    print(f"Executing query: {query}")
+                    await connection.execute(query)
+
+        released = await release_overbooked_loans(connection, first_transaction_id)
+        print(f"Completed {released} loan(s) of books lent out beyond their stock")
+
+        print(f"Reconciling book availability in schema: {schema_name}")
+        corrected = await reconcile_availability(connection, schema_name)
+        print(f"Corrected availability of {corrected} book(s)")
+        print(f"Reconciling user dues in schema: {schema_name}")
+        corrected = await reconcile_dues(connection, schema_name)
+        print(f"Corrected dues of {corrected} user(s)")
+
+        for table in ("user", "book", "transaction", "book_availability", "user_dues"):
+            query = f"ANALYZE {schema_name}.{table};"
+            print(f"Executing query: {query}")
+            await connection.execute(query)
+    finally:
+        for open_connection in connections:
+            await open_connection.close()
+        print("Closed connections")
+
+    print(f"Seeded the schema: {schema_name} in {time.perf_counter() - started:.1f} s")
+
+
+if __name__ == "__main__":
+    load_dotenv()
+
+    parser = argparse.ArgumentParser(description="Seeds the schema with synthetic users, books and transactions")
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--books", type=int, default=50000)
+    parser.add_argument("--transactions", type=int, default=1000000)
+    parser.add_argument("--connections", type=int, default=4, help="concurrent COPY connections")
+    parser.add_argument("--chunk-size", type=int, default=50000, help="rows per COPY")
+    parser.add_argument("--days", type=int, default=730, help="days of transaction history")
+    parser.add_argument("--loan-days", type=int, default=21, help="days a book is usually kept")
+    parser.add_argument("--skew", type=float, default=1.0, help="popularity skew of the books, 0 is uniform")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument(
+        "--keep-indexes",
+        action="store_true",
+        help="keep the foreign keys and indexes of the transaction table during the load, for a schema in use",
+    )
+    args = parser.parse_args()
+    if min(args.users, args.books, args.transactions, args.connections, args.chunk_size) < 1:
+        parser.error("every count must be at least 1")
+
+    schema_name = os.environ.get("DB_SCHEMA")
+    host_name = os.environ.get("DB_HOST")
+    if host_name not in ("localhost", "127.0.0.1", "postgres"):
+        answer: str = input(
+            f"Environment using host: {host_name} seems to be non local. "
+            f"Are you sure you want to seed it? Type - Yes to continue or No to abort"
+        )
+        if answer.lower() != "yes":
+            print(f"You have chosen not to seed environment using host: {host_name}")
+            sys.exit(0)
+
+    asyncio.run(main(args))
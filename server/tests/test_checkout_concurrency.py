@@ -0,0 +1,80 @@
+"""Concurrent checkouts against the database configured in .env, skipped when it cannot be reached."""
+
+import asyncio
+import logging
+import os
+import uuid
+from typing import List
+
+import asyncpg
+import pytest
+from dotenv import load_dotenv
+
+from app.database import DatabaseConnectionPool
+from app.entities.transctions import CheckoutStatus
+from app.models.transactions import CheckoutResult
+from app.services.book_service import BookService
+from app.services.transaction_service import TransactionService
+from app.services.user_service import UserService
+from app.utils.database_utils import generate_dsn
+from app.utils.logging_utils import logger
+
+load_dotenv()
+
+
+async def database_reachable() -> bool:
+    try:
+        connection = await asyncpg.connect(generate_dsn(), timeout=5)
+    except (OSError, asyncio.TimeoutError, asyncpg.PostgresError, ValueError):
+        return False
+    await connection.close()
+    return True
+
+
+@pytest.fixture(scope="module", autouse=True)
+def database():
+    if not asyncio.run(database_reachable()):
+        pytest.skip("database configured in .env is not reachable")
+    logger.setLevel(logging.WARNING)
+
+
+async def concurrent_checkouts(n_checkouts: int, copies: int):
+    await DatabaseConnectionPool.create()
+    schema = os.environ.get("DB_SCHEMA")
+    run_id = uuid.uuid4().hex[:8]
+    book = await BookService().create_new_book(
+        {"title": f"Concurrent checkouts {run_id}", "authors": ["Test"], "stock_quantity": copies}
+    )
+    user_ids: List[int] = [
+        (await UserService().create_new_user(f"concurrent-{run_id}-{i}@example.com", "Test")).id
+        for i in range(n_checkouts)
+    ]
+
+    try:
+        results: List[CheckoutResult] = await asyncio.gather(
+            *(TransactionService().checkout(user_id, book.id) for user_id in user_ids)
+        )
+        async with DatabaseConnectionPool.get().acquire() as connection:
+            available = await connection.fetchval(
+                f"SELECT available_quantity FROM {schema}.book_availability WHERE book_id = $1;", book.id
+            )
+            pending = await connection.fetchval(
+                f"SELECT COUNT(*) FROM {schema}.transaction WHERE book_id = $1 AND status = 'PENDING';", book.id
+            )
+        return [result.status for result in results], available, pending
+    finally:
+        async with DatabaseConnectionPool.get().acquire() as connection:
+            await connection.execute(f"DELETE FROM {schema}.transaction WHERE book_id = $1;", book.id)
+            await connection.execute(f"DELETE FROM {schema}.user WHERE id = ANY($1::int[]);", user_ids)
+            await connection.execute(f"DELETE FROM {schema}.book WHERE id = $1;", book.id)
+        await DatabaseConnectionPool.close()
+
+
+@pytest.mark.parametrize("n_checkouts, copies", [(50, 1), (50, 7), (20, 20)])
+def test_concurrent_checkouts_lend_exactly_the_stock(n_checkouts: int, copies: int):
+    statuses, available, pending = asyncio.run(concurrent_checkouts(n_checkouts, copies))
+
+    assert statuses.count(CheckoutStatus.CHECKED_OUT) == copies
+    assert statuses.count(CheckoutStatus.OUT_OF_STOCK) == n_checkouts - copies
+    assert available == 0
+    assert pending == copies
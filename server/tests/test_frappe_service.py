@@ -0,0 +1,93 @@
+"""FrappeService against a stubbed Frappe API, no network access needed."""
+
+import asyncio
+from typing import Dict, List, Optional, Set
+
+import httpx
+import pytest
+
+from app.services.frappe_service import FrappeService
+
+
+def frappe_row(book_id: int, publication_date: str = "9/16/2006") -> Dict[str, str]:
+    return {
+        "bookID": str(book_id),
+        "title": f"Book {book_id}",
+        "authors": "Author A/Author B",
+        "isbn": f"{book_id:010d}",
+        "isbn13": f"{book_id:013d}",
+        "language_code": "eng",
+        "  num_pages": "100",
+        "publication_date": publication_date,
+        "publisher": "Publisher",
+    }
+
+
+class FrappeStub:
+    """Serves n_rows rows 20 per page, the rows whose id is in invalid have an unparseable date."""
+
+    def __init__(self, n_rows: int, invalid: Set[int] = frozenset(), failing_page: Optional[int] = None):
+        self.n_rows = n_rows
+        self.invalid = invalid
+        self.failing_page = failing_page
+        self.requested_pages: List[int] = []
+
+    def __call__(self, request: httpx.Request) -> httpx.Response:
+        page = int(request.url.params["page"])
+        self.requested_pages.append(page)
+        if page == self.failing_page:
+            return httpx.Response(502)
+        ids = range((page - 1) * 20, min(page * 20, self.n_rows))
+        rows = [frappe_row(i, "not a date" if i in self.invalid else "9/16/2006") for i in ids]
+        return httpx.Response(200, json={"message": rows})
+
+    def service(self) -> FrappeService:
+        return FrappeService(transport=httpx.MockTransport(self))
+
+
+def test_fetch_books_returns_limit_books_in_page_order():
+    stub = FrappeStub(n_rows=200)
+
+    books = asyncio.run(stub.service().fetch_books(45))
+
+    assert [book.title for book in books] == [f"Book {i}" for i in range(45)]
+    assert books[0].authors == ["Author A", "Author B"]
+    assert max(stub.requested_pages) == 3
+
+
+def test_fetch_books_fetches_more_pages_to_replace_invalid_rows():
+    stub = FrappeStub(n_rows=200, invalid=set(range(0, 40, 2)))
+
+    books = asyncio.run(stub.service().fetch_books(30))
+
+    assert len(books) == 30
+    assert all(int(book.isbn) % 2 == 1 for book in books[:20])
+    assert [int(book.isbn) for book in books[20:]] == list(range(40, 50))
+
+
+def test_fetch_books_stops_at_the_short_last_page():
+    stub = FrappeStub(n_rows=50, invalid={3})
+
+    books = asyncio.run(stub.service().fetch_books(100))
+
+    assert len(books) == 49
+    assert max(stub.requested_pages) <= 5
+
+
+def test_fetch_pages_reports_the_end_of_the_data():
+    stub = FrappeStub(n_rows=50)
+
+    books, exhausted = asyncio.run(stub.service().fetch_pages(2, 2))
+    assert [int(book.isbn) for book in books] == list(range(20, 50))
+    assert exhausted
+
+    books, exhausted = asyncio.run(stub.service().fetch_pages(1, 2))
+    assert len(books) == 40
+    assert not exhausted
+
+
+def test_fetch_books_raises_on_a_failed_page():
+    stub = FrappeStub(n_rows=200, failing_page=2)
+
+    with pytest.raises(httpx.HTTPStatusError):
+        asyncio.run(stub.service().fetch_books(60))
@@ -0,0 +1,208 @@
+"""Background jobs run against the database configured in .env, skipped when it cannot be reached."""
+
+import asyncio
+import logging
+import os
+import uuid
+from typing import Any, Dict, List, Optional
+
+import asyncpg
+import pytest
+from dotenv import load_dotenv
+
+from app.database import DatabaseConnectionPool
+from app.entities.job import JobKind, JobStatus
+from app.job_runner import JobRunner
+from app.models.job import Job
+from app.services.book_import_service import BookImportService
+from app.services.job_service import JobLeaseLost, JobService
+from app.utils.database_utils import generate_dsn
+from app.utils.logging_utils import logger
+
+load_dotenv()
+
+
+async def unfinished_jobs() -> Optional[int]:
+    """Counts the jobs queued or running, None if the database cannot be reached."""
+
+    try:
+        connection = await asyncpg.connect(generate_dsn(), timeout=5)
+    except (OSError, asyncio.TimeoutError, asyncpg.PostgresError, ValueError):
+        return None
+    try:
+        return await connection.fetchval(
+            f"SELECT COUNT(*) FROM {os.environ.get('DB_SCHEMA')}.job WHERE status IN ('QUEUED', 'RUNNING');"
+        )
+    finally:
+        await connection.close()
+
+
+@pytest.fixture(scope="module", autouse=True)
+def database():
+    unfinished = asyncio.run(unfinished_jobs())
+    if unfinished is None:
+        pytest.skip("database configured in .env is not reachable")
+    # Workers claim the oldest job, a job left by someone else would be claimed in place of the one under test
+    if unfinished:
+        pytest.skip("the job table holds unfinished jobs")
+    logger.setLevel(logging.WARNING)
+
+
+def book_rows(run_id: str, n_books: int) -> List[Dict[str, Any]]:
+    return [{"title": f"Job runner {run_id}-{i}", "authors": ["Test"], "stock_quantity": 1} for i in range(n_books)]
+
+
+async def fetch_job(job_id: int) -> Dict[str, Any]:
+    async with DatabaseConnectionPool.get().acquire() as connection:
+        return dict(
+            await connection.fetchrow(f"SELECT * FROM {os.environ.get('DB_SCHEMA')}.job WHERE id = $1;", job_id)
+        )
+
+
+async def count_books(run_id: str) -> int:
+    async with DatabaseConnectionPool.get().acquire() as connection:
+        return await connection.fetchval(
+            f"SELECT COUNT(*) FROM {os.environ.get('DB_SCHEMA')}.book WHERE title LIKE $1;", f"Job runner {run_id}-%"
+        )
+
+
+async def cleanup(run_id: str, job_ids: List[int]):
+    schema = os.environ.get("DB_SCHEMA")
+    async with DatabaseConnectionPool.get().acquire() as connection:
+        await connection.execute(f"DELETE FROM {schema}.job WHERE id = ANY($1::int[]);", job_ids)
+        await connection.execute(f"DELETE FROM {schema}.book WHERE title LIKE $1;", f"Job runner {run_id}-%")
+
+
+async def claims_and_lease_expiry():
+    await DatabaseConnectionPool.create()
+    run_id = uuid.uuid4().hex[:8]
+    job: Job = await JobService().submit_job(JobKind.BOOK_BATCH, {}, book_rows(run_id, 1), 1)
+
+    try:
+        claims: List[Optional[Job]] = await asyncio.gather(*(JobService().claim_job(60) for _ in range(5)))
+        claimed = [claim for claim in claims if claim is not None]
+        leased = await JobService().claim_job(60)
+
+        # Run the second claim in a later transaction, the lease is older than its start
+        await asyncio.sleep(0.01)
+        reclaimed: Optional[Job] = await JobService().claim_job(0)
+        lease_lost = False
+        async with DatabaseConnectionPool.get().acquire() as connection:
+            async with connection.transaction():
+                try:
+                    await JobService().checkpoint(connection, claimed[0])
+                except JobLeaseLost:
+                    lease_lost = True
+        # The outcome recorded by the worker that lost the lease is ignored
+        await JobService().finish_job(claimed[0], JobStatus.COMPLETED)
+        return job, claimed, leased, reclaimed, lease_lost, await fetch_job(job.id)
+    finally:
+        await cleanup(run_id, [job.id])
+        await DatabaseConnectionPool.close()
+
+
+def test_a_job_is_leased_to_one_worker_until_its_lease_expires():
+    job, claimed, leased, reclaimed, lease_lost, row = asyncio.run(claims_and_lease_expiry())
+
+    assert [claim.id for claim in claimed] == [job.id]
+    assert claimed[0].status == JobStatus.RUNNING
+    assert claimed[0].attempts == 1
+    assert leased is None
+    assert reclaimed.id == job.id
+    assert reclaimed.attempts == 2
+    assert lease_lost
+    assert row["status"] == JobStatus.RUNNING.value
+    assert row["attempts"] == 2
+
+
+async def interrupted_and_resumed_import(monkeypatch: pytest.MonkeyPatch):
+    await DatabaseConnectionPool.create()
+    run_id = uuid.uuid4().hex[:8]
+    job: Job = await JobService().submit_job(JobKind.BOOK_BATCH, {}, book_rows(run_id, 5), 5)
+    monkeypatch.setenv("JOB_CHUNK_SIZE", "2")
+
+    try:
+        # The first chunk is committed, the import then hangs until the worker is stopped
+        checkpointed = asyncio.Event()
+        import_chunk = BookImportService._import_chunk
+
+        async def hanging_import_chunk(self, *args):
+            await import_chunk(self, *args)
+            checkpointed.set()
+            await asyncio.Event().wait()
+
+        monkeypatch.setattr(BookImportService, "_import_chunk", hanging_import_chunk)
+        monkeypatch.setitem(
+            JobRunner.handlers, JobKind.BOOK_BATCH, lambda job: BookImportService().import_book_batch(job)
+        )
+        run = asyncio.create_task(JobRunner.run(await JobService().claim_job(60)))
+        await asyncio.wait_for(checkpointed.wait(), timeout=10)
+        # Stopped as by a shutdown
+        run.cancel()
+        await asyncio.gather(run, return_exceptions=True)
+        requeued = await fetch_job(job.id)
+
+        monkeypatch.setattr(BookImportService, "_import_chunk", import_chunk)
+        resumed: Job = await JobService().claim_job(60)
+        resumed_from = resumed.progress
+        await JobRunner.run(resumed)
+        return requeued, resumed_from, await JobService().get_job(job.id), await count_books(run_id)
+    finally:
+        await cleanup(run_id, [job.id])
+        await DatabaseConnectionPool.close()
+
+
+def test_a_stopped_job_is_requeued_and_resumes_from_its_checkpoint(monkeypatch: pytest.MonkeyPatch):
+    requeued, resumed_from, finished, n_books = asyncio.run(interrupted_and_resumed_import(monkeypatch))
+
+    assert requeued["status"] == JobStatus.QUEUED.value
+    assert requeued["progress"] == 2
+    # A graceful stop does not count as an attempt
+    assert requeued["attempts"] == 0
+    assert resumed_from == 2
+    assert finished.status == JobStatus.COMPLETED
+    assert finished.progress == 5
+    assert finished.counts["inserted"] == 5
+    assert n_books == 5
+
+
+async def cancellations(monkeypatch: pytest.MonkeyPatch):
+    await DatabaseConnectionPool.create()
+    run_id = uuid.uuid4().hex[:8]
+    queued: Job = await JobService().submit_job(JobKind.BOOK_BATCH, {}, book_rows(run_id, 1), 1)
+    running: Job = await JobService().submit_job(JobKind.BOOK_BATCH, {}, book_rows(run_id, 1), 1)
+
+    try:
+        cancelled_queued: Job = await JobService().cancel_job(queued.id)
+
+        started = asyncio.Event()
+
+        async def hanging_handler(job: Job):
+            started.set()
+            await asyncio.Event().wait()
+
+        monkeypatch.setitem(JobRunner.handlers, JobKind.BOOK_BATCH, hanging_handler)
+        claimed: Job = await JobService().claim_job(60)
+        run = asyncio.create_task(JobRunner.run(claimed))
+        await asyncio.wait_for(started.wait(), timeout=10)
+        await JobService().cancel_job(running.id)
+        # As done by the lease renewal of the worker
+        cancel_requested = await JobService().renew_leases([claimed])
+        stopped = JobRunner.cancel(running.id)
+        await run
+        return cancelled_queued, claimed, cancel_requested, stopped, await JobService().get_job(running.id)
+    finally:
+        await cleanup(run_id, [queued.id, running.id])
+        await DatabaseConnectionPool.close()
+
+
+def test_cancelled_jobs_stop(monkeypatch: pytest.MonkeyPatch):
+    cancelled_queued, claimed, cancel_requested, stopped, cancelled_running = asyncio.run(cancellations(monkeypatch))
+
+    assert cancelled_queued.status == JobStatus.CANCELLED
+    # The queued job cancelled is never claimed
+    assert claimed.id == cancelled_running.id
+    assert cancel_requested == {claimed.id: True}
+    assert stopped
+    assert cancelled_running.status == JobStatus.CANCELLED
+    assert not JobRunner.running